@@ -1,4 +1,71 @@
-from mb_modelbase.models_core import *
-from mb_modelbase.model_eval import *
-from mb_modelbase.server import *
-from mb_modelbase.utils import *
+"""
+The modelbase: a backend to query probabilistic models and their data using the probabilistic query language PQL.
+
+The subpackages `models_core`, `server`, `utils` and `model_eval` as well as their public names (e.g.
+`mb_modelbase.ModelBase` or `mb_modelbase.MixableCondGaussianModel`) are imported lazily on first access. Accessing a
+public name only imports the subpackage that defines it.
+"""
+import importlib
+
+# subpackages in the order they are searched for names
+_subpackages = ['models_core', 'server', 'utils', 'model_eval']
+
+# subpackages that are lazy themselves. Importing them is cheap, and their `__all__` lists their public names
+_lazy_subpackages = ['models_core', 'utils']
+
+# public names of the other subpackages by the subpackage that defines them
+_lazy_names = {
+    'server': ['QuerySyntaxError', 'QueryValueError', 'QueryIncompleteError', 'NumpyCompliantJSONEncoder',
+               'PQL_parse_json', 'ModelBase', 'PreforkModelBase'],
+    'model_eval': ['posterior_predictive_check', 'quantile', 'mean', 'median', 'minimum', 'maximum'],
+}
+
+_name2subpackage = {name: sub for sub, names in _lazy_names.items() for name in names}
+
+
+def _import(sub):
+    return importlib.import_module('.' + sub, __name__)
+
+
+def _subpackage_of(name):
+    """Returns the name of the subpackage that defines the public name `name`, or None if there is none."""
+    for sub in _lazy_subpackages:
+        if name in _import(sub).__all__:
+            return sub
+    return _name2subpackage.get(name)
+
+
+def _all():
+    """Returns the public names of all subpackages, as used by star-imports."""
+    names = []
+    for sub in _subpackages:
+        module = _import(sub)
+        names.extend(getattr(module, '__all__', [n for n in vars(module) if not n.startswith('_')]))
+    return names
+
+
+def __getattr__(name):
+    if name in _subpackages:
+        value = _import(name)
+    elif name == '__all__':
+        value = _all()
+    elif name.startswith('_'):
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    elif _subpackage_of(name) is not None:
+        value = getattr(_import(_subpackage_of(name)), name)
+    else:
+        # try harder by asking all subpackages for it
+        for sub in _subpackages:
+            try:
+                value = getattr(_import(sub), name)
+                break
+            except AttributeError:
+                pass
+        else:
+            raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_subpackages))
@@ -1,26 +1,86 @@
-from mb_modelbase.models_core.auto_extent import *
-from mb_modelbase.models_core.base import *
-from mb_modelbase.models_core.categoricals import *
-from mb_modelbase.models_core.cond_gaussian_fitting import *
-from mb_modelbase.models_core.cond_gaussian_wm import *
-from mb_modelbase.models_core.cond_gaussians import *
-from mb_modelbase.models_core.data_aggregation import *
-from mb_modelbase.models_core.domains import *
-from mb_modelbase.models_core.empirical_model import *
-from mb_modelbase.models_core.fixed_mixture_model import *
-from mb_modelbase.models_core.gaussians import *
-from mb_modelbase.models_core.mixable_cond_gaussian import *
-from mb_modelbase.models_core.mixture_cond_gaussian_wm import *
-from mb_modelbase.models_core.mixture_gaussians import *
-from mb_modelbase.models_core.mockup_model import *
-# from mb_modelbase.models_core.models_debug import *
-from mb_modelbase.models_core.models import *
-from mb_modelbase.models_core.pci_graph import *
-from mb_modelbase.models_core.splitter import *
-# from mb_modelbase.models_core.spn import *
-# from mb_modelbase.models_core.mspn import *
-from mb_modelbase.models_core.tests import *
-from mb_modelbase.models_core.spflow import *
-from mb_modelbase.models_core.pyMC3_model import *
-from mb_modelbase.models_core.kde_model import *
+# Copyright (c) 2017-2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+The models_core package provides the abstract `Model` class, all concrete model classes and the machinery to query
+them.
 
+Submodules are imported lazily: accessing a public name, like `models_core.CgWmModel`, only imports the submodule that
+defines it. Hence, a process only pays for the model classes it actually uses, and optional dependencies (like pymc3
+or spflow) are only required if the corresponding model class is used.
+"""
+import importlib
+import importlib.util
+
+# public names by the submodule that defines them
+_lazy_names = {
+    'auto_extent': ['print_extents', 'field_to_auto_extent', 'auto_range_by_sample', 'adopt_all_extents'],
+    'base': ['AggregationMethods', 'SplitMethods', 'AggregationTuple', 'SplitTuple', 'NAME_IDX', 'METHOD_IDX',
+             'YIELDS_IDX', 'ARGS_IDX', 'ConditionTuple', 'OP_IDX', 'VALUE_IDX', 'Field', 'Aggregation', 'Density',
+             'Probability', 'Split', 'Condition', 'to_name_sequence'],
+    'categoricals': ['CategoricalModel'],
+    'cond_gaussian_fitting': ['fit_pairwise_canonical', 'fit_clz_mean', 'fit_map_mean', 'clz_to_mean',
+                              'mean_to_canonical', 'canonical_to_mean'],
+    'cond_gaussian_wm': ['numeric_extents_from_params', 'common_sigma_to_full_sigma', 'fit_full', 'fit_CLZ', 'fit_MAP',
+                         'CgWmModel'],
+    'cond_gaussians': ['ConditionallyGaussianModel'],
+    'data_aggregation': ['DEFAULT_BIN_NUMBER', 'aggregate_data', 'most_frequent_equi_sized',
+                         'most_frequent_equi_massed', 'most_frequent', 'average_most_frequent', 'average'],
+    'domains': ['Domain', 'NumericDomain', 'DiscreteDomain'],
+    'empirical_model': ['EmpiricalModel'],
+    'fixed_mixture_model': ['FixedMixtureModel'],
+    'gaussians': ['MultiVariateGaussianModel'],
+    'mixable_cond_gaussian': ['normalized', 'Normalizer', 'MixableCondGaussianModel'],
+    'mixture_cond_gaussian_wm': ['MixtureOfCgWmModel', 'MoCGModelWithK'],
+    'mixture_gaussians': ['MixtureOfGaussiansModel', 'MoGModelWithK'],
+    'mockup_model': ['MockUpModel'],
+    'models': ['field_tojson', 'name_to_str', 'field_to_str', 'model_to_str', 'condition_to_str',
+               'conditions_to_str', 'Model'],
+    'pci_graph': ['create', 'to_json'],
+    'splitter': ['equidist', 'equiinterval', 'identity', 'elements', 'return_types'],
+    'sparse_cond_gaussian_wm': ['SparseCgWmModel'],
+    'spflow': ['SPNModel'],
+    'pyMC3_model': ['ProbabilisticPymc3Model'],
+    'kde_model': ['KDEModel'],
+}
+
+# submodules that are searched (in this order) for any other name. This keeps names available that used to be
+# exported by star-imports of these submodules. Submodules with heavy or optional dependencies come last.
+_fallback_modules = ['base', 'domains', 'models', 'splitter', 'data_aggregation', 'data_operations', 'auto_extent',
+                     'categoricals', 'cond_gaussians', 'cond_gaussian_wm', 'mixable_cond_gaussian', 'gaussians',
+                     'fixed_mixture_model', 'mixture_gaussians', 'mixture_cond_gaussian_wm', 'empirical_model',
+                     'mockup_model', 'kde_model', 'cond_gaussian_fitting', 'pci_graph', 'spflow', 'pyMC3_model',
+                     'tests']
+
+_name2module = {name: module for module, names in _lazy_names.items() for name in names}
+
+__all__ = list(_name2module.keys())
+
+
+def _import(module):
+    return importlib.import_module('.' + module, __name__)
+
+
+def __getattr__(name):
+    if name in _name2module:
+        value = getattr(_import(_name2module[name]), name)
+    elif name.startswith('_'):
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    elif importlib.util.find_spec('.' + name, __name__) is not None:
+        # a submodule
+        value = _import(name)
+    else:
+        for module in _fallback_modules:
+            try:
+                module = _import(module)
+            except ImportError:
+                continue
+            if hasattr(module, name):
+                value = getattr(module, name)
+                break
+        else:
+            raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
@@ -0,0 +1,129 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Integer coding of the categorical dimensions of parameter arrays.
+
+The parameters of the categorical and conditional gaussian models (e.g. `_p`, `_mu`, `_S`) are dense arrays whose
+leading axes are indexed by the values of categorical fields. Looking values up by label (i.e. `DataArray.loc`) is
+slow, in particular on the hot path of density queries. A `CategoricalIndex` maps values to integer codes once,
+such that the parameters can be accessed as plain numpy arrays instead.
+"""
+import numpy as np
+import pandas as pd
+
+
+class CategoricalIndex:
+    """An index of the leading categorical axes of a dense parameter array.
+
+    Attributes:
+        dims: list of str
+            The names of the categorical dimensions, in order of the axes.
+        levels: list of list
+            The values of each dimension, in order of their position on the axis.
+        shape: tuple of int
+            The number of values of each dimension.
+        strides: np.ndarray of int
+            The strides (in elements, not bytes) of each dimension in a C-ordered array of the given shape. It allows
+            to compute the flat index of a cell.
+        axis: dict
+            Map of dimension name to axis.
+    """
+
+    def __init__(self, dims, levels):
+        self.dims = list(dims)
+        self.levels = [list(l) for l in levels]
+        if len(self.dims) != len(self.levels):
+            raise ValueError("number of dimensions and levels does not match")
+        self.shape = tuple(len(l) for l in self.levels)
+        self.strides = np.array([int(np.prod(self.shape[i+1:])) for i in range(len(self.shape))], dtype=int)
+        self.axis = {name: i for i, name in enumerate(self.dims)}
+        self._codes = [{value: code for code, value in enumerate(l)} for l in self.levels]
+
+    @classmethod
+    def from_dataarray(cls, arr, dims=None):
+        """Returns the index of the dimensions `dims` of the given xarray.DataArray. `dims` default to all
+        dimensions of `arr`."""
+        if dims is None:
+            dims = arr.dims
+        return cls(dims, [arr.coords[name].values.tolist() for name in dims])
+
+    def __len__(self):
+        return len(self.dims)
+
+    @property
+    def size(self):
+        """The number of cells."""
+        return int(np.prod(self.shape))
+
+    def code(self, name, value):
+        """Returns the code of `value` of dimension `name`.
+
+        Raises:
+            KeyError: if value is not a level of dimension `name`.
+        """
+        return self._codes[self.axis[name]][value]
+
+    def encode(self, values):
+        """Returns the tuple of codes of the given values of all dimensions, in order. The tuple may be used to index
+        the parameter arrays.
+
+        Raises:
+            KeyError: if any value is not a level of its dimension.
+        """
+        return tuple(codes[value] for codes, value in zip(self._codes, values))
+
+    def indexer(self, pairs):
+        """Returns a tuple to index the parameter arrays that selects the cells of the given values of some
+        dimensions.
+
+        Args:
+            pairs: dict
+                Map of dimension name to the value to select. Dimensions not in pairs are not restricted.
+
+        Returns: tuple
+            The indexer. It contains the code of the value for restricted dimensions, and slice(None) for the others.
+        """
+        return tuple(self._codes[i][pairs[name]] if name in pairs else slice(None) for i, name in enumerate(self.dims))
+
+    def encode_columns(self, columns, missing=None):
+        """Returns the flat indexes of the cells of multiple data points.
+
+        Args:
+            columns: sequence of array-like
+                The values of each dimension, in order of the dimensions.
+            missing: int, optional.
+                If given, this is returned as the flat index of data points with any value that is not a level of
+                its dimension, instead of raising a KeyError.
+
+        Returns: np.ndarray of int
+            The flat index of the cell of each data point.
+
+        Raises:
+            KeyError: if any value is not a level of its dimension and `missing` is None.
+        """
+        if len(self.dims) == 0:
+            raise ValueError("cannot encode values of an index without dimensions")
+        flat = 0
+        invalid = False
+        for name, levels, stride, column in zip(self.dims, self.levels, self.strides, columns):
+            codes = pd.Categorical(column, categories=levels).codes
+            if (codes == -1).any():
+                if missing is None:
+                    values = set(np.asarray(column, dtype=object)[codes == -1])
+                    raise KeyError("invalid value(s) for field '{}': {}".format(name, values))
+                invalid = invalid | (codes == -1)
+            flat = flat + codes.astype(int) * stride
+        return np.where(invalid, missing, flat) if missing is not None else flat
+
+    def decode(self, flat):
+        """Returns the list of values of all dimensions of the cell with flat index `flat`. This is the inverse of
+        `encode_columns` for a single data point."""
+        codes = np.unravel_index(flat, self.shape)
+        return [levels[code] for levels, code in zip(self.levels, codes)]
+
+    def remove(self, names):
+        """Returns a new index without the dimensions `names`."""
+        names = set(names)
+        keep = [i for i, name in enumerate(self.dims) if name not in names]
+        return CategoricalIndex([self.dims[i] for i in keep], [self.levels[i] for i in keep])
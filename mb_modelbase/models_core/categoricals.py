@@ -8,6 +8,7 @@ import logging
 from mb_modelbase.utils import utils
 from mb_modelbase.models_core import models as md
 from mb_modelbase.models_core import domains as dm
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
@@ -18,6 +19,7 @@ class CategoricalModel(md.Model):
     def __init__(self, name):
         super().__init__(name)
         self._p = nan
+        self._index = CategoricalIndex([], [])  # integer coding of the dimensions of _p
         self._aggrMethods = {
             'maximum': self._maximum
         }
@@ -25,21 +27,38 @@ class CategoricalModel(md.Model):
         self._unbound_updater = functools.partial(self.__class__._update, self)
 
     @staticmethod
-    def _maximum_aposteriori(df, fields, k=1):
-        extents = [f['extent'].value() for f in fields]
-        sizes = tuple(len(e) for e in extents)
-        z = np.zeros(shape=sizes)
-
-        # initialize count array
-        counts = xr.DataArray(data=z, coords=extents, dims=df.columns)
+    def _cell_counts(df, fields):
+        """Counts the rows of the categorical data `df` in each cell of the extents of `fields`.
+
+        Args:
+            df: pd.DataFrame
+                The data. Its columns correspond to `fields`, in order.
+            fields: list of dict
+                The fields of the columns of df. Their extents span the cells.
+
+        Returns: (CategoricalIndex, np.ndarray, np.ndarray)
+            The index of the extents, the flat index of the cell of each row, and the number of rows in each cell as
+            an array of shape `index.shape`.
+        """
+        index = CategoricalIndex(df.columns, [f['extent'].value() for f in fields])
+        if len(index) == 0:
+            cells = np.zeros(len(df), dtype=int)
+        else:
+            cells = index.encode_columns([df[name].values for name in df.columns])
+        counts = np.bincount(cells, minlength=index.size).reshape(index.shape)
+        return index, cells, counts
 
-        # iterate over table and sum up occurrences
-        for row in df.itertuples():
-            values = row[1:]  # 1st element is index, which we don't need
-            counts.loc[values] += 1
+    @staticmethod
+    def _smooth(index, counts, k=1):
+        """Returns the probability table of the cell `counts` with additive smoothing `k` as an xr.DataArray
+        along the dimensions of `index`."""
+        p = (counts + k) / (counts.sum() + k * counts.size)
+        return xr.DataArray(data=p, coords=index.levels, dims=index.dims)
 
-        # smooth, normalize and return
-        return (counts + k) / (counts.sum() + k * counts.size)
+    @staticmethod
+    def _maximum_aposteriori(df, fields, k=1):
+        index, _, counts = CategoricalModel._cell_counts(df, fields)
+        return CategoricalModel._smooth(index, counts, k)
 
     def _set_data(self, df, drop_silently, **kwargs):
         self._set_data_categorical(df, drop_silently)
@@ -53,8 +72,17 @@ class CategoricalModel(md.Model):
         """updates dependent parameters / precalculated values of the model"""
         if self.dim == 0:
             self._p = xr.DataArray([])
+            self._index = CategoricalIndex([], [])
+        else:
+            self._index = CategoricalIndex.from_dataarray(self._p)
         return self
 
+    def _upgrade(self):
+        # models stored by earlier versions lack the integer coding of the dimensions of _p
+        if not hasattr(self, '_index'):
+            self._update()
+        return super()._upgrade()
+
     def _conditionout(self, keep, remove):
         # Conditioning out categorical variables works by means of the definition of conditional probability:
         #   p(x|c) = p(x,c) / p(c)
@@ -65,7 +93,7 @@ class CategoricalModel(md.Model):
         pairs = dict(self._condition_values(remove, True))
 
         # 1. trim the probability look-up table to the appropriate subrange
-        p = self._p.loc[pairs]
+        p = self._p[self._index.indexer(pairs)]
 
         # 2. normalize
         self._p = p / p.sum()
@@ -81,9 +109,11 @@ class CategoricalModel(md.Model):
         return self._unbound_updater,
 
     def _density(self, x):
-        # note1: need to convert x to tuple for indexing
-        # note2: .values.item() is to extract the scalar as a float
-        return self._p.loc[tuple(x)].values.item()
+        # note: .item() is to extract the scalar as a float
+        return self._p.values[self._index.encode(x)].item()
+
+    def _density_batch(self, X):
+        return self._p.values.ravel()[self._index.encode_columns(X[col] for col in X.columns)]
 
     def _maximum(self):
         """Returns the point of the maximum density in this model"""
@@ -95,6 +125,9 @@ class CategoricalModel(md.Model):
     def _sample(self):
         raise NotImplementedError()
 
+    def _memory_components(self):
+        return {'parameters': self._p}
+
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
         mycopy._p = self._p
@@ -172,4 +172,51 @@ def genMixGSample(n, dic): # outdated
 
 #        data[i][0:dc] = x
         data[i][dc:dc +dg] = y
-    return data
\ No newline at end of file
+    return data
+
+def genMixedSample(n, num_dims, cat_levels, seed=None):
+    """Returns a data frame of `n` samples of a random CG distribution with categorical and gaussian variables.
+
+    In contrast to genCGSample this generator is fully vectorized and hence suited to produce large data sets, e.g.
+    for benchmarking. The categorical variables are drawn independently from random (dirichlet-distributed)
+    marginals. The mean of the gaussian variables is the sum of a random offset per categorical variable and level,
+    and all gaussian variables share a random full covariance matrix.
+
+    Args:
+        n: int
+            Number of samples.
+        num_dims: int
+            Number of gaussian (numerical) variables. They are named 'g0', 'g1', ...
+        cat_levels: int or sequence of int
+            Number of levels of each categorical variable. They are named 'c0', 'c1', ... and their levels 'val0',
+            'val1', ...
+        seed: int, optional.
+            Seed for the random number generator. Set it to obtain reproducible data.
+
+    Returns: pd.DataFrame
+        The samples with the categorical columns first.
+    """
+    if isinstance(cat_levels, int):
+        cat_levels = [cat_levels]
+    rs = np.random.RandomState(seed)
+    dc = len(cat_levels)
+
+    df = pd.DataFrame(index=range(n))
+    mu = np.zeros((n, num_dims))
+    for j, levels in enumerate(cat_levels):
+        p = rs.dirichlet(np.ones(levels) * 2)
+        codes = rs.choice(levels, size=n, p=p)
+        labels = np.array(['val%d' % (l) for l in range(levels)], dtype=object)
+        df['c%d' % (j)] = labels[codes]
+        offsets = rs.normal(0, 5, size=(levels, num_dims))
+        mu += offsets[codes]
+
+    if num_dims > 0:
+        A = rs.normal(size=(num_dims, num_dims))
+        Sigma = A.dot(A.T) + num_dims * np.eye(num_dims)
+        y = mu + rs.standard_normal(size=(n, num_dims)).dot(np.linalg.cholesky(Sigma).T)
+        for j in range(num_dims):
+            df['g%d' % (j)] = y[:, j]
+
+    assert(len(df.columns) == dc + num_dims)
+    return df
@@ -11,10 +11,9 @@ Data is generally given as a pandas data frame. Appropiate preperation is expect
 
 Parameters are generally provided by means of numpy ndarrays. The order of categorical random variables in the given data frame is equivalent to the implicit order of dimensions (representing categorical random variables) in the derived parameters.
 
+The CGmodelselection package is imported lazily by the fitting methods, since it is costly to import and not needed for
+anything else.
 """
-from CGmodelselection.CG_CLZ_utils import CG_CLZ_Utils
-from CGmodelselection.CG_MAP_utils import CG_MAP_Utils
-from CGmodelselection.dataops import get_meta_data, prepare_cat_data
 
 ### model selection methods
 
@@ -29,6 +28,8 @@ def fit_clz_mean (df):
     Args:
         df: DataFrame of training data.
     """
+    from CGmodelselection.CG_CLZ_utils import CG_CLZ_Utils
+    from CGmodelselection.dataops import get_meta_data, prepare_cat_data
 
     meta = get_meta_data(df)
     Y = df.as_matrix(meta['contnames'])
@@ -52,6 +53,8 @@ def fit_map_mean (df):
     Args:
         df: DataFrame of training data.
     """
+    from CGmodelselection.CG_MAP_utils import CG_MAP_Utils
+    from CGmodelselection.dataops import get_meta_data, prepare_cat_data
 
     meta = get_meta_data(df)
     Y = df[meta['contnames']].values
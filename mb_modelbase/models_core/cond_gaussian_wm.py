@@ -2,6 +2,7 @@
 import functools
 import logging
 import numpy as np
+import pandas as pd
 from numpy import nan, pi, exp, dot, abs, ix_
 from numpy.linalg import inv, det
 import xarray as xr
@@ -9,6 +10,7 @@ import xarray as xr
 import mb_modelbase.utils as utils
 from mb_modelbase.utils import no_nan
 from mb_modelbase.models_core import models as md
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
 from mb_modelbase.models_core import cond_gaussian_fitting as cgf
 from mb_modelbase.models_core import cond_gaussians as cg
 
@@ -188,7 +190,7 @@ class CgWmModel(md.Model):
 
         self._aggrMethods = {
             'maximum': self._maximum,
-            'average': self._maximum
+            'average': self._average
         }
         self._categoricals = []
         self._numericals = []
@@ -197,6 +199,7 @@ class CgWmModel(md.Model):
         self._S = xr.DataArray([])
         self._SInv = xr.DataArray([])
         self._detS = xr.DataArray([])
+        self._index = CategoricalIndex([], [])  # integer coding of the categorical dimensions of the parameters
         # creates an self contained update function. we use it as a callback function later
         self._unbound_updater = functools.partial(self.__class__._update, self)
 
@@ -237,11 +240,20 @@ class CgWmModel(md.Model):
 
         if len(self._categoricals) == 0:
             self._p = xr.DataArray([])
+            self._index = CategoricalIndex([], [])
+        else:
+            self._index = CategoricalIndex.from_dataarray(self._p)
 
         self._assert_no_nans()
 
         return self
 
+    def _upgrade(self):
+        # models stored by earlier versions lack the integer coding of the categorical dimensions of the parameters
+        if not hasattr(self, '_index'):
+            self._update()
+        return super()._upgrade()
+
     # #@profile
     # def _conditionout_continuous_internal_slow(self, cond_values, i, j, cat_keep, all_num_removing):
     #     if all_num_removing:
@@ -372,6 +384,7 @@ class CgWmModel(md.Model):
         else:
             # this is the actual difficult case
             #self._conditionout_continuous_internal_slow(cond_values, i, j, cat_keep, all_num_removing)
+            zero_mass = float(self._p.sum()) == 0  # e.g. a slice of pruned cells, see _conditionout_categorical
             self._conditionout_continuous_internal_fast(self._p, self._mu, self._detS, self._S, cond_values, i, j, all_num_removing)
 
             # rescale to one
@@ -379,7 +392,7 @@ class CgWmModel(md.Model):
             psum = self._p.sum()
             if psum != 0:
                 self._p /= psum
-            else:
+            elif not zero_mass:
                 logger.warning("creating a conditional model with extremely low probability and alike low predictive "
                                "power")
                 self._p.values = np.full_like(self._p.values, 1 / self._p.size)
@@ -400,18 +413,21 @@ class CgWmModel(md.Model):
             return
 
         pairs = dict(self._condition_values(names=cat_remove, pairflag=True))
+        indexer = self._index.indexer(pairs)
 
         # _p changes like in the categoricals.py case
         # trim the probability look-up table to the appropriate subrange and normalize it
-        p = self._p.loc[pairs]
-        self._p = p / p.sum()
+        # a slice of probability 0 (e.g. of pruned cells of a compressed model) remains 0, i.e. has density 0
+        p = self._p[indexer]
+        total = float(p.sum())
+        self._p = p / total if total > 0 else p
         assert no_nan(self._p), "Renormalization of p failed."
 
-        # _mu and _S is trimmed: keep the slice that we condition on, i.e. reuse the 'pairs' access-structure
+        # _mu and _S is trimmed: keep the slice that we condition on, i.e. reuse the indexer
         # note: if we condition on all categoricals this also works: it simply remains the single 'selected' mu...
         if len(self._numericals) != 0:
-            self._mu = self._mu.loc[pairs]
-            self._S = self._S.loc[pairs]
+            self._mu = self._mu[indexer]
+            self._S = self._S[indexer]
 
         # update internals
         self._categoricals = [name for name in self._categoricals if name not in cat_remove]
@@ -489,19 +505,19 @@ class CgWmModel(md.Model):
     def _density(self, x):
         cat_len = len(self._categoricals)
         num_len = len(self._numericals)
-        cat = tuple(x[:cat_len])  # need it as a tuple for indexing below
+        cat = self._index.encode(x[:cat_len])  # tuple of integer codes for indexing below
         num = np.array(x[cat_len:])  # need as np array for dot product
 
-        p = self._p.loc[cat].values
+        p = self._p.values[cat]
 
         if num_len == 0:
             return p
 
         # works because gaussian variables are - by design of this class - after categoricals.
         # Therefore the only not specified dimension is the last one, i.e. the one that holds the mean!
-        mu = self._mu.loc[cat].values
-        detS = self._detS.loc[cat].values
-        invS = self._SInv.loc[cat].values
+        mu = self._mu.values[cat]
+        detS = self._detS.values[cat]
+        invS = self._SInv.values[cat]
         xmu = num - mu
         gauss = (2 * pi) ** (-num_len / 2) * detS * exp(-.5 * np.dot(xmu, np.dot(invS, xmu)))
         assert no_nan(gauss), "Density computation failed."
@@ -511,6 +527,13 @@ class CgWmModel(md.Model):
         else:
             return p * gauss
 
+    def _gradient(self, x):
+        """Returns the gradient of the density at x with respect to the numerical fields."""
+        cat_len = len(self._categoricals)
+        cat = self._index.encode(x[:cat_len])
+        xmu = np.array(x[cat_len:], dtype=float) - self._mu.values[cat]
+        return -self._density(x) * np.dot(self._SInv.values[cat], xmu)
+
     def _maximum(self):
         """Returns the point of the maximum density in this model"""
         cat_len = len(self._categoricals)
@@ -518,6 +541,36 @@ class CgWmModel(md.Model):
 
         return _maximum_cgwm_heuristic1(cat_len, num_len, self._mu, self._p, self._detS)
 
+    def _average(self):
+        """Returns the average of this model, i.e. the expectation of the numerical fields and the most probable
+        value of the categorical fields."""
+        return self._conditional_average_batch([], pd.DataFrame(index=range(1))).values.tolist()[0]
+
+    def _conditional_average_batch(self, names, X):
+        """Vectorized computation of conditional averages. See `Model._conditional_average_batch()` and
+        `conditional_average_cg()`."""
+        cats, nums = self._categoricals, self._numericals
+        p = self._p.values if len(cats) > 0 else None
+        mu = self._mu.transpose(*cats, 'mean').values if len(nums) > 0 else None
+        S = self._S.transpose(*cats, 'S1', 'S2').values if len(nums) > 0 else None
+        return cg.conditional_average_cg(self._index, p, mu, S, cats, nums, names, X)
+
+    def _probability(self, domains):
+        return self._probability_batch(pd.DataFrame([domains], columns=self.names))[0]
+
+    def _probability_batch(self, domains):
+        """Vectorized, exact computation of probabilities. See `Model._probability_batch()` and
+        `cond_gaussians.box_probability_cg()`."""
+        cats, nums = self._categoricals, self._numericals
+        cat_domains, lower, upper = cg.split_domains(domains, len(cats))
+        p = self._p.values if len(cats) > 0 else None
+        mu = self._mu.transpose(*cats, 'mean').values if len(nums) > 0 else None
+        S = self._S.transpose(*cats, 'S1', 'S2').values if len(nums) > 0 else None
+        return cg.box_probability_cg(self._index, p, mu, S, cats, cat_domains, lower, upper)
+
+    def _memory_components(self):
+        return {'parameters': [self._p, self._mu, self._S, self._SInv, self._detS]}
+
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
         mycopy._mu = self._mu.copy()
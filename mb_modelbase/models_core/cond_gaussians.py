@@ -3,17 +3,178 @@
 import functools
 import logging
 import numpy as np
+import pandas as pd
 from numpy import nan, pi, exp, dot, abs
 from numpy.linalg import inv, det
 import xarray as xr
 
 from mb_modelbase.utils import no_nan
 from mb_modelbase.models_core import models as md
+from mb_modelbase.models_core import gaussian_kernels as gk
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
+from mb_modelbase.models_core.categoricals import CategoricalModel
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
 
+def conditional_average_cg(index, p, mu, S, cats, nums, names, X, cells=None):
+    """Returns the averages of the conditional distributions of a CG distribution (or a mixture of CG distributions)
+    given values of some of its fields, for a batch of such values.
+
+    The average of the numerical fields is their expectation. The average of the categorical fields is their most
+    probable (joint) value.
+
+    Args:
+        index: CategoricalIndex
+            The index of all categorical dimensions of the parameters. For a mixture, this includes the dimensions
+            that are marginalized.
+        p: np.ndarray of shape index.shape
+            The probabilities of the cells. Ignored if there is no categorical dimension.
+        mu: np.ndarray of shape index.shape + (n,)
+            The means of the cells. Ignored if there is no numerical field.
+        S: np.ndarray of shape index.shape + (n, n), or of shape (n, n) if it is shared by all cells
+            The covariances of the cells. Ignored if there is no numerical field.
+        cats: list of str
+            The names of the categorical fields, that is the not marginalized categorical dimensions.
+        nums: list of str
+            The names of the numerical fields, in the order of the parameters.
+        names: list of str
+            The names of the fields to condition on.
+        X: pd.DataFrame
+            The values to condition on, one set of values per row, with columns `names`.
+        cells: np.ndarray of shape (K, len(index)), optional.
+            The codes of the cells, if only some cells of `index` are stored. `p`, `mu` and `S` are then given per
+            stored cell, i.e. they are of shapes (K,), (K, n) and (K, n, n).
+
+    Returns: pd.DataFrame
+        The averages, one row for each row of `X`, with columns for the remaining categorical fields followed by the
+        remaining numerical fields, in the order of `cats` and `nums`.
+
+    Raises:
+        KeyError: if any value of a categorical field is not in its extent.
+    """
+    N, n = len(X), len(nums)
+    if cells is None:
+        K = index.size
+        cell_codes = np.unravel_index(np.arange(K), index.shape) if len(index) > 0 else ()
+    else:
+        K = len(cells)
+        cell_codes = tuple(np.asarray(cells).T)
+    with np.errstate(divide='ignore'):
+        log_weights = np.log(np.asarray(p, dtype=float).reshape(-1)) if len(index) > 0 else np.zeros(1)
+    log_weights = np.broadcast_to(log_weights, (N, K))
+
+    # conditioning on categorical values: cells that do not match get a weight of 0
+    for name in (name for name in cats if name in names):
+        axis = index.axis[name]
+        codes = pd.Categorical(X[name], categories=index.levels[axis]).codes
+        if (codes == -1).any():
+            invalid = set(np.asarray(X[name], dtype=object)[codes == -1])
+            raise KeyError("invalid value(s) for field '{}': {}".format(name, invalid))
+        log_weights = np.where(cell_codes[axis] == codes[:, np.newaxis], log_weights, -np.inf)
+
+    num_names = [name for name in nums if name not in names]
+    if n == 0:
+        with np.errstate(invalid='ignore'):
+            weights = np.exp(log_weights - np.logaddexp.reduce(log_weights, axis=1, keepdims=True))
+        num_averages = np.empty((N, 0))
+    else:
+        cond = [i for i, name in enumerate(nums) if name in names]
+        Y = X.loc[:, [nums[i] for i in cond]].values.astype(float)
+        mu = np.asarray(mu, dtype=float).reshape(K, n)
+        S = np.broadcast_to(np.asarray(S, dtype=float).reshape(-1, n, n), (K, n, n))
+        weights, means = gk.conditional_mixture_moments(Y, mu, S, log_weights, cond)
+        num_averages = np.einsum('nk,nkr->nr', weights, means)
+
+    # most probable value of the remaining categorical fields
+    cat_names = [name for name in cats if name not in names]
+    columns = []
+    if len(cat_names) > 0:
+        # sum the weights of the cells with equal values of the remaining fields, and take the largest sum
+        axes = sorted(index.axis[name] for name in cat_names)
+        shape = [index.shape[i] for i in axes]
+        keys, group = np.unique(np.ravel_multi_index([cell_codes[i] for i in axes], shape), return_inverse=True)
+        marginal = np.zeros((len(keys), N))
+        np.add.at(marginal, group.reshape(-1), np.transpose(weights))
+        argmax = np.unravel_index(keys[marginal.argmax(axis=0)], shape)
+        for name in cat_names:
+            levels = np.array(index.levels[index.axis[name]], dtype=object)
+            columns.append(levels[argmax[axes.index(index.axis[name])]])
+    columns.extend(num_averages.T)
+
+    return pd.DataFrame(data=dict(zip(cat_names + num_names, columns)), columns=cat_names + num_names, index=range(N))
+
+
+def split_domains(domains, cat_len):
+    """Splits a batch of events into their categorical domains and the bounds of their numerical domains.
+
+    Args:
+        domains: pd.DataFrame
+            The events, one per row, with one domain per field. A categorical domain is a sequence of values (or a
+            single value), a numerical domain a 2-element sequence [low, high]. Categorical fields come first.
+        cat_len: int
+            The number of categorical fields.
+
+    Returns: (list, np.ndarray, np.ndarray)
+        The list of the columns of categorical domains, each a list of lists of values, and the lower and upper
+        bounds of the numerical domains, each of shape (N, number of numerical fields).
+    """
+    cat_domains = [[[d] if isinstance(d, str) else list(d) for d in domains.iloc[:, i]] for i in range(cat_len)]
+    bounds = np.array([[list(d) for d in row] for row in domains.iloc[:, cat_len:].itertuples(index=False, name=None)],
+                      dtype=float).reshape(len(domains), -1, 2)
+    return cat_domains, bounds[:, :, 0], bounds[:, :, 1]
+
+
+def box_probability_cg(index, p, mu, S, cats, cat_domains, lower, upper, cells=None):
+    """Returns the probabilities of a batch of events under a CG distribution (or a mixture of CG distributions).
+
+    An event is the cartesian product of a set of values of each categorical field and an interval of each numerical
+    field. Its probability is the sum over all matching cells of the probability of the cell times the probability of
+    the box of intervals under the Gaussian of the cell, see `gaussian_kernels.box_probabilities`.
+
+    Args:
+        index, p, mu, S, cats:
+            See `conditional_average_cg`.
+        cat_domains: list
+            For each field in `cats` the list of the sets of values of all events. Values that are not in the extent
+            of the field do not match any cell.
+        lower, upper: np.ndarray of shape (N, n)
+            The bounds of the intervals of the numerical fields of all events.
+        cells: np.ndarray of shape (K, len(index)), optional.
+            The codes of the cells, if only some cells of `index` are stored. `p`, `mu` and `S` are then given per
+            stored cell, i.e. they are of shapes (K,), (K, n) and (K, n, n).
+
+    Returns: np.ndarray of shape (N,)
+        The probabilities of the events.
+    """
+    N, n = lower.shape
+    if cells is None:
+        K = index.size
+        cell_codes = np.unravel_index(np.arange(K), index.shape) if len(index) > 0 else ()
+    else:
+        K = len(cells)
+        cell_codes = tuple(np.asarray(cells).T)
+    p = np.asarray(p, dtype=float).reshape(-1) if len(index) > 0 else np.ones(1)
+
+    # weights of the cells per event: the probabilities of the matching cells, 0 else
+    weights = np.broadcast_to(p, (N, K))
+    for name, domains in zip(cats, cat_domains):
+        axis = index.axis[name]
+        levels = index.levels[axis]
+        member = np.array([np.isin(levels, domain) for domain in domains], dtype=bool).reshape(N, len(levels))
+        weights = weights * member[:, cell_codes[axis]]
+
+    if n == 0:
+        return weights.sum(axis=1)
+
+    # only cells that contribute to any event
+    cells = np.flatnonzero(weights.any(axis=0))
+    mu = np.asarray(mu, dtype=float).reshape(K, n)[cells]
+    S = np.broadcast_to(np.asarray(S, dtype=float).reshape(-1, n, n), (K, n, n))[cells]
+    return (weights[:, cells] * gk.box_probabilities(lower, upper, mu, S)).sum(axis=1)
+
+
 class ConditionallyGaussianModel(md.Model):
     """A conditional gaussian model and methods to derive submodels from it
     or query density and other aggregations of it.
@@ -66,7 +227,7 @@ class ConditionallyGaussianModel(md.Model):
 
         self._aggrMethods = {
             'maximum': self._maximum,
-            'average': self._maximum
+            'average': self._average
         }
         self._categoricals = []
         self._numericals = []
@@ -75,6 +236,7 @@ class ConditionallyGaussianModel(md.Model):
         self._S = xr.DataArray([])
         self._SInv = xr.DataArray([])
         self._detS = xr.DataArray([])
+        self._index = CategoricalIndex([], [])  # integer coding of the categorical dimensions of the parameters
         # creates an self contained update function. we use it as a callback function later
         self._unbound_updater = functools.partial(self.__class__._update, self)
 
@@ -94,44 +256,25 @@ class ConditionallyGaussianModel(md.Model):
         catcols = cols[:dc]
         gausscols = cols[dc:]
 
-        extents = [f['extent'].value() for f in fields[:dc]]  # levels
-        sizes = [len(v) for v in extents]
-        #        print('extents:', extents)
-
-        z = np.zeros(tuple(sizes))
-        pML = xr.DataArray(data=z, coords=extents, dims=catcols)
-
-        # mus
-        mus = np.zeros(tuple(sizes + [dg]))
-        coords = extents + [[contname for contname in gausscols]]
+        # count and sum up the rows of each cell
+        index, cells, counts = CategoricalModel._cell_counts(data.loc[:, catcols], fields[:dc])
+        Y = data.loc[:, gausscols].values.astype(float)
+        sums = np.zeros((index.size, dg))
+        for i in range(dg):
+            sums[:, i] = np.bincount(cells, weights=Y[:, i], minlength=index.size)
+
+        # mus (nan for cells without data)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mus = sums / counts.reshape(-1, 1)
+        coords = index.levels + [list(gausscols)]
         dims = list(catcols) + ['mean']
-        musML = xr.DataArray(data=mus, coords=coords, dims=dims)
-
-        # calculate p(x)
-        for row in data.itertuples():
-            cats = row[1:1 + dc]
-            gauss = row[1 + dc:]
-            pML.loc[cats] += 1
-            musML.loc[cats] += gauss
-
-        it = np.nditer(pML, flags=['multi_index'])  # iterator over complete array
-        while not it.finished:
-            ind = it.multi_index
-            musML[ind] /= pML[ind]
-            it.iternext()
+        musML = xr.DataArray(data=mus.reshape(index.shape + (dg,)), coords=coords, dims=dims)
 
         # smooth and normalize
-        # pML /= 1.0 * n  # without smoothing
-        pML = (pML + k) / (pML.sum() + k*pML.size)
-
-        Sigma = np.zeros((dg, dg))
-        for row in data.itertuples():
-            cats = row[1:1 + dc]
-            gauss = row[1 + dc:]
-            ymu = gauss - musML.loc[cats]
-            Sigma += np.outer(ymu, ymu)
+        pML = CategoricalModel._smooth(index, counts, k)
 
-        Sigma /= n
+        ymu = Y - mus[cells]
+        Sigma = ymu.T @ ymu / n
         Sigma = xr.DataArray(Sigma, coords=[gausscols]*2)
 
         return pML, musML, Sigma
@@ -164,11 +307,20 @@ class ConditionallyGaussianModel(md.Model):
 
         if len(self._categoricals) == 0:
             self._p = xr.DataArray([])
+            self._index = CategoricalIndex([], [])
+        else:
+            self._index = CategoricalIndex.from_dataarray(self._p)
 
         self._assert_invariants()
 
         return self
 
+    def _upgrade(self):
+        # models stored by earlier versions lack the integer coding of the categorical dimensions of the parameters
+        if not hasattr(self, '_index'):
+            self._update()
+        return super()._upgrade()
+
     def _assert_invariants(self):
         for o in [self._detS, self._SInv, self._S, self._mu, self._p]:
             assert(no_nan(o))
@@ -247,16 +399,17 @@ class ConditionallyGaussianModel(md.Model):
         if len(cat_remove) != 0:
             # _S remains unchanged
             pairs = dict(self._condition_values(cat_remove, True))
+            indexer = self._index.indexer(pairs)
 
             # _p changes like in the categoricals.py case
             # trim the probability look-up table to the appropriate subrange and normalize it
-            p = self._p.loc[pairs]
+            p = self._p[indexer]
             self._p = p / p.sum()
 
-            # _mu is trimmed: keep the slice that we condition on, i.e. reuse the 'pairs' access-structure
+            # _mu is trimmed: keep the slice that we condition on, i.e. reuse the indexer
             # note: if we condition on all categoricals this also works: it simply remains the single 'selected' mu...
             if len(self._numericals) != 0:
-                self._mu = self._mu.loc[pairs]
+                self._mu = self._mu[indexer]
 
         # condition on continuous fields
         num_remove = [name for name in self._numericals if name in remove]
@@ -298,17 +451,17 @@ class ConditionallyGaussianModel(md.Model):
     def _density(self, x):
         cat_len = len(self._categoricals)
         num_len = len(self._numericals)
-        cat = tuple(x[:cat_len])  # need it as a tuple for indexing below
+        cat = self._index.encode(x[:cat_len])  # tuple of integer codes for indexing below
         num = np.array(x[cat_len:])  # need as np array for dot product
 
-        p = self._p.loc[cat].data
+        p = self._p.values[cat]
 
         if num_len == 0:
             return p
 
         # works because gaussian variables are - by design of this class - after categoricals.
         # Therefore the only not specified dimension is the last one, i.e. the one that holds the mean!
-        mu = self._mu.loc[cat].data
+        mu = self._mu.values[cat]
 
         xmu = num - mu
         gauss = (2 * pi) ** (-num_len / 2) * (self._detS ** -.5) * exp(-.5 * np.dot(xmu, np.dot(self._SInv, xmu)))
@@ -342,6 +495,36 @@ class ConditionallyGaussianModel(md.Model):
         num_argmax = self._mu.loc[tuple(cat_argmax)]
         return cat_argmax + list(num_argmax.data)
 
+    def _average(self):
+        """Returns the average of this model, i.e. the expectation of the numerical fields and the most probable
+        value of the categorical fields."""
+        return self._conditional_average_batch([], pd.DataFrame(index=range(1))).values.tolist()[0]
+
+    def _conditional_average_batch(self, names, X):
+        """Vectorized computation of conditional averages. See `Model._conditional_average_batch()` and
+        `conditional_average_cg()`."""
+        cats, nums = self._categoricals, self._numericals
+        p = self._p.values if len(cats) > 0 else None
+        mu = self._mu.transpose(*cats, 'mean').values if len(nums) > 0 else None
+        S = np.asarray(self._S) if len(nums) > 0 else None  # shared by all cells
+        return conditional_average_cg(self._index, p, mu, S, cats, nums, names, X)
+
+    def _probability(self, domains):
+        return self._probability_batch(pd.DataFrame([domains], columns=self.names))[0]
+
+    def _probability_batch(self, domains):
+        """Vectorized, exact computation of probabilities. See `Model._probability_batch()` and
+        `box_probability_cg()`."""
+        cats, nums = self._categoricals, self._numericals
+        cat_domains, lower, upper = split_domains(domains, len(cats))
+        p = self._p.values if len(cats) > 0 else None
+        mu = self._mu.transpose(*cats, 'mean').values if len(nums) > 0 else None
+        S = np.asarray(self._S) if len(nums) > 0 else None
+        return box_probability_cg(self._index, p, mu, S, cats, cat_domains, lower, upper)
+
+    def _memory_components(self):
+        return {'parameters': [self._p, self._mu, self._S, self._SInv, self._detS]}
+
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
         mycopy._mu = self._mu.copy()
@@ -32,6 +32,41 @@ def aggregate_data(df, method, opts=None):
         raise ValueError("invalid value for method: " + str(method))
 
 
+def _is_numeric(dtype):
+    return np.issubdtype(dtype, np.number)
+
+
+def _encode(column):
+    """Returns the integer codes of the values of a categorical column and the values of the codes. Codes are ordered
+    like the values."""
+    codes, levels = pd.factorize(column, sort=True)
+    return codes, np.asarray(levels, dtype=object)
+
+
+def _bin(column, k):
+    """Returns the integer codes of the values of a numerical column split into `k` intervals of equal length, and the
+    centers of the intervals. Intervals are closed on the right, except for the first one."""
+    values = np.asarray(column, dtype=float)
+    edges = np.linspace(values.min(), values.max(), k + 1)
+    codes = np.clip(np.searchsorted(edges, values, side='left') - 1, 0, k - 1)
+    return codes, utils.rolling_1d_mean(edges)
+
+
+def _most_frequent_codes(codes, sizes):
+    """Returns the most frequent row of the integer codes `codes` of shape (n, d), where column i has `sizes[i]`
+    distinct codes. Of multiple most frequent rows the lexicographically smallest one is returned.
+
+    The columns are packed into a single int64 key, if possible, and the mode is found by counting the distinct keys.
+    """
+    if np.sum(np.log2(np.maximum(sizes, 1))) < 62:
+        strides = np.concatenate([np.cumprod(np.asarray(sizes[:0:-1], dtype=np.int64))[::-1], [1]])
+        keys = codes.astype(np.int64).dot(strides)
+        unique, counts = np.unique(keys, return_counts=True)
+        return np.array(np.unravel_index(unique[counts.argmax()], sizes))
+    unique, counts = np.unique(codes, axis=0, return_counts=True)
+    return unique[counts.argmax()]
+
+
 def most_frequent_equi_sized(data, opts=None):
     """ Expects a pandas data frame of mixed (i.e. numerical and categorical) columns.
     It returns a most frequent item, with details as follows:
@@ -43,36 +78,16 @@ def most_frequent_equi_sized(data, opts=None):
     """
 
     n, d = data.shape
+    if n == 0:
+        return [None] * d
     k = opts[0] if (opts is not None and opts != []) else DEFAULT_BIN_NUMBER
     k = min(k, n)
 
-    # derive interval levels for each numerical column
-    # TODO: this _copies_ the whole data!!!
-    # todo: can I circumvent this by passing in the numpy structures instead?
-
-    numeric = [np.issubdtype(dtype, np.number) for dtype in list(data.dtype)]
-
-    if any(numeric):
-        df = pd.DataFrame()
-        for idx, colname in enumerate(data.columns):
-            if numeric[idx]:
-                # attached leveled numerical column by cutting it to levels
-                df[colname], bins = pd.cut(x=data[colname], bins=k, retbins=True)
-                # change level values to the later result
-                df[colname].cat.categories = utils.rolling_1d_mean(bins)
-            else:
-                df[colname] = data[colname]
-    else:
-        df = data
-
-    # find observation with highest number of occurrences
-    grps = df.groupby(list(df.columns))
-    if len(grps) == 0:
-        return [None] * d
-    else:
-        data_res = grps.size().argmax()
-        #assert (len(data_res) == len(df.columns) and len(data_res) == d)
-        return [data_res] if d == 1 else list(data_res)
+    # integer codes of each column: levels for categorical columns and intervals for numerical ones
+    codes, levels = zip(*(_bin(data[name], k) if _is_numeric(dtype) else _encode(data[name])
+                          for name, dtype in data.dtypes.items()))
+    mode = _most_frequent_codes(np.stack(codes, axis=1), [len(l) for l in levels])
+    return [l[c] for l, c in zip(levels, mode)]
 
 
 def most_frequent_equi_massed(data, opts=None):
@@ -133,17 +148,14 @@ def most_frequent(df):
     """ Expects a pandas data frame of only categorical columns (dtype == 'object' or dtype == 'string').
     Returns the most frequent row in the data frame.
     """
-    assert(np.number not in list(df.dtypes))
+    assert(not any(_is_numeric(dtype) for dtype in df.dtypes))
 
     n, d = df.shape
-    allcols = list(df.columns)
-    grps = df.groupby(allcols)
-
-    if len(grps) == 0:
-        return [None] * n
-    else:
-        data_res = grps.size().idxmax()
-        return [data_res] if d == 1 else list(data_res)
+    if n == 0:
+        return [None] * d
+    codes, levels = zip(*(_encode(df[name]) for name in df.columns))
+    mode = _most_frequent_codes(np.stack(codes, axis=1), [len(l) for l in levels])
+    return [l[c] for l, c in zip(levels, mode)]
 
 
 def average_most_frequent(df, opts=None):
@@ -156,8 +168,7 @@ def average_most_frequent(df, opts=None):
     if d == 0:
         raise ValueError("Cannot aggregate empty DataFrame")
     if n == 0:
-        return [None] * n
-
+        return [None] * d
 
     num_idx = []
     cat_idx = []
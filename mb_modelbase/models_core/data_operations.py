@@ -1,42 +1,92 @@
 # Copyright (c) 2018 Philipp Lucas (philipp.lucas@uni-jena.de)
 
+import numpy as np
+import pandas as pd
 
-def condition_data(df, where):
-    """ Conditions data frame df according to conditions in where and returns a view on the remaining, filtered data frame.
+_OPERATORS = {'in', 'equals', '==', 'greater', '>', 'less', '<'}
 
-    :param df: A data frame.
-    :param where: a single condition, or a sequence of conditions. A condition is a three-tuple of (name, operator, values).
-    :return: pd.DataFrame
+
+def _is_categorical(column):
+    return column.dtype == 'object' or column.dtype.name == 'category'
+
+
+def _evaluate(values, conditions, categorical):
+    """Returns the boolean mask of the elements of the np.ndarray `values` that satisfy all (operator, values)
+    `conditions`."""
+    mask = np.ones(len(values), dtype=bool)
+    for operator, value in conditions:
+        if operator == 'in':
+            if categorical:
+                mask &= pd.Index(values).isin(value)
+            else:
+                lower, upper = value
+                mask &= (values >= lower) & (values <= upper)  # TODO: inclusive??
+        # value is necessarily a single scalar value, not a list
+        elif operator == 'equals' or operator == '==':
+            mask &= values == value
+        elif operator == 'greater' or operator == '>':
+            mask &= values >= value  # TODO: i use >= !!
+        else:
+            mask &= values < value
+    return mask
+
+
+def compile_conditions(where):
+    """Compiles the conditions in `where` into a predicate on the rows of data frames.
+
+    The conditions are grouped by column, and the predicate evaluates all conditions on a column in a single pass over
+    its array. Conditions on categorical columns are evaluated on the distinct values of the column only, and mapped to
+    the rows by their integer codes.
+
+    :param where: None, a single condition, or a sequence of conditions. A condition is a three-tuple of
+        (name, operator, values).
+    :return: A function that maps a pd.DataFrame to the np.ndarray boolean mask of its rows that satisfy all
+        conditions.
     """
+    if where is None:
+        where = []
     # make it a sequence if not already
-    if isinstance(where, tuple):
-        where = [where,]
-    # iteratively build boolean selection mask
-    mask = [True] * len(df)
+    elif isinstance(where, tuple):
+        where = [where]
+    by_name = {}
     for (name, operator, values) in where:
         operator = operator.lower()
-        column = df[name]
-        if operator == 'in':
-            if column.dtype == 'object' or column.dtype.name == 'category':  # categorical column
-                # df = df.loc[column.isin(values)]
-                mask &= column.isin(values)
-            else:  # quantitative column
-                mask &= column.between(*values, inclusive=True)  # TODO: inclusive??
-        else:
-            # values is necessarily a single scalar value, not a list
-            if operator == 'equals' or operator == '==':
-                # df = df.loc[column == values]
-                mask &= column == values
-            elif operator == 'greater' or operator == '>':
-                # df = df.loc[column > values]
-                mask &= column >= values  # TODO: i use >= !!
-            elif operator == 'less' or operator == '<':
-                # df = df.loc[column < values]
-                mask &= column < values
+        if operator not in _OPERATORS:
+            raise ValueError('invalid operator for condition: ' + str(operator))
+        by_name.setdefault(name, []).append((operator, values))
+
+    def predicate(df):
+        mask = np.ones(len(df), dtype=bool)
+        for name, conditions in by_name.items():
+            column = df[name]
+            if _is_categorical(column):
+                codes, levels = pd.factorize(column)
+                # missing values have code -1, which is mapped to the last element: False
+                allowed = np.append(_evaluate(np.asarray(levels, dtype=object), conditions, True), False)
+                mask &= allowed[codes]
             else:
-                raise ValueError('invalid operator for condition: ' + str(operator))
-    # apply mask all at once
-    return df.loc[mask, :]
+                mask &= _evaluate(column.values, conditions, False)
+        return mask
+
+    return predicate
+
+
+def condition_index(df, where):
+    """Returns the positions of the rows of data frame df that satisfy the conditions in where, as an np.ndarray.
+
+    See `compile_conditions` for the arguments.
+    """
+    return np.flatnonzero(compile_conditions(where)(df))
+
+
+def condition_data(df, where):
+    """ Conditions data frame df according to conditions in where and returns the remaining, filtered data frame.
+
+    :param df: A data frame.
+    :param where: a single condition, or a sequence of conditions. A condition is a three-tuple of (name, operator, values).
+    :return: pd.DataFrame
+    """
+    return df.iloc[condition_index(df, where)]
 
 
 def density(df, x):
@@ -48,9 +98,7 @@ def density(df, x):
     """
     dim = df.shape[1]
     names = df.columns
-    # TODO: count matches instead of data frame construction? should be faster
-    reduced_df = condition_data(df, zip(names, ['=='] * dim, x))
-    return reduced_df.shape[0]
+    return int(compile_conditions(list(zip(names, ['=='] * dim, x)))(df).sum())
 
 
 def probability(df, domains):
@@ -65,9 +113,7 @@ def probability(df, domains):
         return 0
     dim = df.shape[1]
     names = df.columns
-    # TODO: count matches instead of data frame construction? should be faster
-    reduced_df = condition_data(df, zip(names, ['in'] * dim, domains))
-    return reduced_df.shape[0] / df.shape[0]
+    return compile_conditions(list(zip(names, ['in'] * dim, domains)))(df).sum() / df.shape[0]
 
 
 def reduce_to_scalars(values):
@@ -3,11 +3,17 @@
 from mb_modelbase.models_core.models import Model
 from mb_modelbase.models_core import data_operations as data_op
 from mb_modelbase.models_core import data_aggregation as data_aggr
+from mb_modelbase.models_core.frequency_index import FrequencyIndex
+from mb_modelbase.models_core.range_count_index import RangeCountIndex
 
 
 class EmpiricalModel(Model):
     """
     An empirical model is a model that is directly based on the relative frequency of relevant evidence.
+
+    The frequencies of the distinct data points are kept in a `FrequencyIndex`, which is conditioned and marginalized
+    along with the data. Hence, density queries are hash lookups instead of scans of the data. Probability queries are
+    answered by a `RangeCountIndex`, which is built lazily from the frequencies.
     """
 
     def __init__(self, name):
@@ -17,6 +23,8 @@ class EmpiricalModel(Model):
             'average': self._maximum
         }
         self._emp_data = None
+        self._frequencies = None
+        self._range_counts = None
 
     def _set_data(self, df, drop_silently, **kwargs):
         self._set_data_mixed(df, drop_silently)
@@ -29,8 +37,17 @@ class EmpiricalModel(Model):
         """
         # fitting simply consists of setting the data...
         self._emp_data = self.data
+        self._frequencies = FrequencyIndex.from_data(self.data)
+        self._range_counts = None
         return ()
 
+    def _upgrade(self):
+        # models stored by earlier versions lack the frequency index of their data
+        if not hasattr(self, '_frequencies'):
+            self._frequencies = FrequencyIndex.from_data(self._emp_data)
+            self._range_counts = None
+        return super()._upgrade()
+
     def __str__(self):
         return ("Emperical Model '" + self.name + "':\n" +
                 "dimension: " + str(self.dim) + "\n" +
@@ -39,7 +56,10 @@ class EmpiricalModel(Model):
 
     def _condition(self, conditions):
         """Conditions it according to conditions"""
+        conditions = list(conditions)
         self._emp_data = data_op.condition_data(self._emp_data, conditions)
+        self._frequencies = self._frequencies.condition(conditions)
+        self._range_counts = None
         return ()
 
     def _conditionout(self, keep, remove):
@@ -62,15 +82,32 @@ class EmpiricalModel(Model):
     def _marginalizeout(self, keep, remove):
         """Marginalizes the dimensions in remove, keeping all those in keep"""
         self._emp_data = self._emp_data.loc[:, keep]
+        self._frequencies = self._frequencies.marginalize(keep)
+        self._range_counts = None
         return ()
 
     def _density(self, x):
         """Returns the density at x"""
-        return data_op.density(self._emp_data, x)
+        return self._frequencies.count(x)
+
+    def _density_batch(self, X):
+        """Vectorized version of `_density()`. See `Model._density_batch()`."""
+        return self._frequencies.count_batch(X)
 
     def _probability(self, event):
         """Returns the probability of event"""
-        return data_op.probability(self._emp_data, event)
+        return self._range_count_index().probability([event])[0]
+
+    def _probability_batch(self, domains):
+        """Vectorized version of `_probability()`. See `Model._probability_batch()`."""
+        return self._range_count_index().probability(list(domains.itertuples(index=False, name=None)))
+
+    def _range_count_index(self):
+        """Returns the index to count data points in boxes. It is built on first use after each change of the
+        data."""
+        if self._range_counts is None:
+            self._range_counts = RangeCountIndex(self._frequencies)
+        return self._range_counts
 
     def _maximum(self):
         """Returns the point of the maximum density"""
@@ -80,10 +117,15 @@ class EmpiricalModel(Model):
         """Returns random point of evidence"""
         return self._emp_data.sample(n, replace=True)
 
+    def _memory_components(self):
+        return {'emp_data': self._emp_data, 'frequencies': self._frequencies, 'range_counts': self._range_counts}
+
     def copy(self, name=None):
         """Returns a copy of this model."""
         mycopy = self._defaultcopy(name)
         mycopy._emp_data = self._emp_data
+        mycopy._frequencies = self._frequencies
+        mycopy._range_counts = self._range_counts
         return mycopy
 
     def _generate_model(self, opts):
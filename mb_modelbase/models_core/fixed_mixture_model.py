@@ -2,9 +2,12 @@
 import functools
 import logging
 import math
+import numpy as np
+import pandas as pd
 from scipy.optimize import minimize
 
 from mb_modelbase.models_core import models as md
+from mb_modelbase.utils import utils
 
 # setup logger
 logger = logging.getLogger(__name__)
@@ -128,6 +131,11 @@ class FixedMixtureModel(md.Model):
             for attr in attrs_to_update:
                 setattr(model, attr, getattr(self, attr))
 
+    def _upgrade(self):
+        for model in self:
+            model._upgrade()
+        return super()._upgrade()
+
     def _conditionout(self, keep, remove):
         callbacks = [self._unbound_component_updater]
         for conditions in (model._conditionout(keep, remove) for model in self):
@@ -143,9 +151,37 @@ class FixedMixtureModel(md.Model):
     def _density(self, x):
         return sum(model._density(x) * weight for weight, model in zip(self.weights, self))
 
+    def _density_batch(self, X):
+        return sum(model._density_batch(X) * weight for weight, model in zip(self.weights, self))
+
     def _gradient(self, x):
         return sum(model._gradient(x) * weight for weight, model in zip(self.weights, self))
 
+    def _probability(self, domains):
+        return sum(model._probability(domains) * weight for weight, model in zip(self.weights, self))
+
+    def _probability_batch(self, domains):
+        return sum(model._probability_batch(domains) * weight for weight, model in zip(self.weights, self))
+
+    def _compress(self, tolerance):
+        """Removes the components of smallest weight."""
+        if any(w is None for w in self.weights):
+            raise ValueError("cannot compress a mixture without weights")
+        prune = utils.negligible_weights(self.weights, tolerance)
+        if not prune.any():
+            return 0.0
+        removed = sum(w for w, p in zip(self.weights, prune) if p)
+        pruned = set(id(model) for model, p in zip(self, prune) if p)
+        self.components = {class_name: tuple(model for model in models if id(model) not in pruned)
+                           for class_name, models in self.components.items()}
+        weights = [w for w, p in zip(self.weights, prune) if not p]
+        self.weights = [w / sum(weights) for w in weights]
+        self._component_sequence = [model for model in self]
+        return removed
+
+    def _memory_components(self):
+        return {'components': self.components, 'weights': getattr(self, 'weights', None)}
+
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
         mycopy.weights = self.weights[:]
@@ -153,18 +189,18 @@ class FixedMixtureModel(md.Model):
         # copy all models
         for class_name, models_per_class in self.components.items():
             mycopy.components[class_name] = tuple(model.copy() for model in models_per_class)
+        mycopy._component_sequence = [model for model in mycopy]
 
         # update/link all
         mycopy._update_in_components()
         return mycopy
 
-    def _sample(self):
-        # choose component by weight
-
-        # sample from it
-
-        # TODO: can be done generically!
-        raise NotImplementedError("Implement it - this can be done generically!")
+    def _sample(self, n=1):
+        # choose the number of samples of each component by weight, and sample from all at once
+        counts = np.random.multinomial(int(n), np.asarray(self.weights, dtype=float))
+        samples = pd.concat([pd.DataFrame(model._sample(k), columns=self.names)
+                             for k, model in zip(counts, self) if k > 0], ignore_index=True)
+        return samples.sample(frac=1).reset_index(drop=True)
 
     def _set_data(self, df, drop_silently, **kwargs):
         # we need to link the set data to all components, hence we need to run _update_in_components after setting
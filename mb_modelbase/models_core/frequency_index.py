@@ -0,0 +1,126 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Frequency tables of the distinct rows of data.
+
+Looking up the frequency of a point in a data frame by a boolean mask over all rows costs O(n) per point. A
+`FrequencyIndex` aggregates the data once into a table of its distinct rows and their frequencies, such that the
+frequency of a point is a hash lookup. Conditioning and marginalizing work on the table, instead of the data.
+"""
+import numpy as np
+import pandas as pd
+
+from mb_modelbase.models_core import data_operations as data_op
+
+
+class FrequencyIndex:
+    """A table of the distinct rows of a data frame and their (weighted) absolute frequencies.
+
+    Each column is coded by integers. Frequencies are looked up in a hash table that maps the tuple of codes of a row
+    to its position in the table. An index is never modified: `condition()` and `marginalize()` return new indexes.
+    Hence, it may be shared by copies of a model.
+
+    Attributes:
+        names: list of str
+            The names of the columns.
+        levels: list of np.ndarray
+            The distinct values of each column. A value is coded by its position.
+        codes: np.ndarray of int of shape (U, d)
+            The codes of the distinct rows.
+        counts: np.ndarray of shape (U,)
+            The frequencies of the distinct rows.
+    """
+
+    def __init__(self, names, levels, codes, counts):
+        self.names = list(names)
+        self.levels = list(levels)
+        self.codes = codes
+        self.counts = counts
+        self._lookup = None
+
+    @classmethod
+    def from_data(cls, df, weights=None):
+        """Returns the frequency index of the data frame `df`.
+
+        Args:
+            df: pd.DataFrame
+                The data.
+            weights: np.ndarray of shape (len(df),), optional.
+                The weights of the rows. The frequency of a distinct row is the sum of the weights of its occurrences.
+                Defaults to 1 for all rows, i.e. absolute frequencies.
+        """
+        levels, codes = [], []
+        for name in df.columns:
+            column_codes, column_levels = pd.factorize(df[name])
+            levels.append(np.asarray(column_levels))
+            codes.append(column_codes)
+        codes = np.stack(codes, axis=1) if codes else np.zeros((len(df), 0), dtype=int)
+        counts = np.ones(len(df), dtype=int) if weights is None else np.asarray(weights, dtype=float)
+        return cls._aggregate(df.columns, levels, codes, counts)
+
+    @classmethod
+    def _aggregate(cls, names, levels, codes, counts):
+        """Returns the index of the rows `codes` with frequencies `counts`, which may contain duplicates."""
+        if len(codes) == 0:
+            return cls(names, levels, codes.reshape(0, len(levels)), counts)
+        unique, inverse = np.unique(codes, axis=0, return_inverse=True)
+        return cls(names, levels, unique, np.bincount(inverse.ravel(), weights=counts).astype(counts.dtype))
+
+    def __len__(self):
+        """The number of distinct rows."""
+        return len(self.counts)
+
+    @property
+    def total(self):
+        """The sum of the frequencies of all rows."""
+        return self.counts.sum()
+
+    def _row_position(self):
+        if self._lookup is None:
+            self._lookup = {tuple(row): i for i, row in enumerate(self.codes.tolist())}
+        return self._lookup
+
+    def encode(self, X):
+        """Returns the codes of the rows `X` of shape (N, d) as an array of the same shape. Values that do not occur
+        in a column are coded as -1."""
+        X = np.asarray(X, dtype=object).reshape(-1, len(self.names))
+        codes = np.empty(X.shape, dtype=int)
+        for i, levels in enumerate(self.levels):
+            codes[:, i] = pd.Index(levels).get_indexer(X[:, i].tolist())
+        return codes
+
+    def count(self, x):
+        """Returns the frequency of the point `x`, which is a sequence of values in the order of `names`."""
+        position = self._row_position().get(tuple(self.encode([x])[0].tolist()))
+        return 0 if position is None else self.counts[position]
+
+    def count_batch(self, X):
+        """Vectorized version of `count()` for the rows of `X`, which is a pd.DataFrame or array of shape (N, d)."""
+        if len(self) == 0:
+            return np.zeros(len(X), dtype=self.counts.dtype)
+        lookup = self._row_position()
+        positions = np.array([lookup.get(row, -1) for row in map(tuple, self.encode(X).tolist())], dtype=int)
+        return np.where(positions >= 0, self.counts[positions], 0)
+
+    def condition(self, conditions):
+        """Returns the index of the rows that fulfill all `conditions`.
+
+        Args:
+            conditions: sequence of (name, operator, values)
+                The conditions, with the same semantics as in `data_operations.condition_data`. Each condition is
+                evaluated on the distinct values of its column only.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, operator, values in conditions:
+            i = self.names.index(name)
+            levels = pd.DataFrame({name: self.levels[i]})
+            allowed = np.zeros(len(levels), dtype=bool)
+            allowed[data_op.condition_data(levels, (name, operator, values)).index] = True
+            mask &= allowed[self.codes[:, i]]
+        return FrequencyIndex(self.names, self.levels, self.codes[mask], self.counts[mask])
+
+    def marginalize(self, keep):
+        """Returns the index of the columns `keep` only."""
+        idx = [self.names.index(name) for name in keep]
+        return self._aggregate(keep, [self.levels[i] for i in idx], self.codes[:, idx], self.counts)
@@ -0,0 +1,291 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Vectorized numerics for (mixtures of) multivariate Gaussians.
+
+All functions work on stacks of Gaussians, i.e. on arrays whose last one (means) or two (covariances) axes are the
+parameters of a single Gaussian and all leading axes index the Gaussians. They are meant as building blocks for
+batched queries (e.g. `Model._density_batch`) of the Gaussian based model classes.
+"""
+import itertools
+
+import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import multivariate_normal, norm
+
+_LOG_2PI = np.log(2 * np.pi)
+
+
+def cholesky_factors(S):
+    """Returns the inverse Cholesky factors and the log normalizers of a stack of covariance matrices.
+
+    Args:
+        S: np.ndarray of shape (..., d, d)
+            The covariance matrices. They must be positive definite.
+
+    Returns: (np.ndarray, np.ndarray)
+        The tuple (Linv, log_norm), where Linv of shape (..., d, d) is the inverse of the lower Cholesky factor L
+        of S, i.e. S^-1 = Linv^T Linv, and log_norm of shape (...) is the logarithm of the normalization constant of
+        the Gaussian, i.e. -0.5 * (d log(2 pi) + log(det(S))).
+
+    Raises:
+        np.linalg.LinAlgError: if any S is not positive definite.
+    """
+    S = np.asarray(S, dtype=float)
+    d = S.shape[-1]
+    L = np.linalg.cholesky(S)
+    eye = np.broadcast_to(np.eye(d), S.shape)
+    Linv = np.linalg.solve(L, eye)
+    log_det = 2 * np.log(np.diagonal(L, axis1=-2, axis2=-1)).sum(axis=-1)
+    log_norm = -0.5 * (d * _LOG_2PI + log_det)
+    return Linv, log_norm
+
+
+def log_gaussians(X, mu, Linv, log_norm):
+    """Returns the log densities of a batch of points under a batch of stacks of Gaussians.
+
+    Args:
+        X: np.ndarray of shape (N, d)
+            The points.
+        mu: np.ndarray of shape (N, K, d)
+            The means of the K Gaussians to evaluate for each point.
+        Linv: np.ndarray of shape (N, K, d, d)
+            The inverse Cholesky factors of the K Gaussians for each point. See `cholesky_factors`.
+        log_norm: np.ndarray of shape (N, K)
+            The log normalizers of the K Gaussians for each point. See `cholesky_factors`.
+
+    Returns: np.ndarray of shape (N, K)
+        The log density of the n-th point under the k-th of its Gaussians.
+    """
+    z = np.einsum('nkij,nkj->nki', Linv, X[:, np.newaxis, :] - mu)
+    return log_norm - 0.5 * np.einsum('nki,nki->nk', z, z)
+
+
+def mixture_log_density(X, mu, Linv, log_norm, log_weights):
+    """Returns the log densities of a batch of points under a batch of mixtures of Gaussians.
+
+    The arguments are as for `log_gaussians` and additionally:
+
+    Args:
+        log_weights: np.ndarray of shape (N, K)
+            The log weights of the K components of the mixture of each point. The weights need not be normalized.
+
+    Returns: np.ndarray of shape (N,)
+        The log density of each point under its mixture.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return logsumexp(log_gaussians(X, mu, Linv, log_norm) + log_weights, axis=-1)
+
+
+def conditional_mixture_moments(Y, mu, S, log_weights, cond):
+    """Returns the posterior weights and the conditional means of the components of a mixture of Gaussians given the
+    values of some of its dimensions, for a batch of such values.
+
+    Args:
+        Y: np.ndarray of shape (N, c)
+            The values of the conditioning dimensions.
+        mu: np.ndarray of shape (K, d)
+            The means of the K components.
+        S: np.ndarray of shape (K, d, d)
+            The covariance matrices of the K components.
+        log_weights: np.ndarray of shape (K,) or (N, K)
+            The log weights of the components, possibly for each value separately. The weights need not be normalized.
+        cond: sequence of int
+            The indexes of the c conditioning dimensions.
+
+    Returns: (np.ndarray, np.ndarray)
+        The tuple (weights, means), where weights of shape (N, K) are the normalized weights of the components of the
+        conditional mixture, and means of shape (N, K, d-c) are the means of its components over the remaining
+        dimensions, in their order.
+    """
+    cond = list(cond)
+    rest = [i for i in range(mu.shape[-1]) if i not in cond]
+    N, K = len(Y), len(mu)
+    log_weights = np.broadcast_to(log_weights, (N, K))
+    means = np.broadcast_to(mu[:, rest], (N, K, len(rest)))
+
+    if len(cond) > 0:
+        S_jj = S[:, cond][:, :, cond]
+        S_ij = S[:, rest][:, :, cond]
+        mu_j = mu[:, cond]
+        Linv, log_norm = cholesky_factors(S_jj)
+        log_weights = log_weights + log_gaussians(Y, np.broadcast_to(mu_j, (N, K, len(cond))),
+                                                  np.broadcast_to(Linv, (N,) + Linv.shape),
+                                                  np.broadcast_to(log_norm, (N, K)))
+        # the regression coefficients S_ij S_jj^-1 of each component
+        gain = np.linalg.solve(S_jj, np.swapaxes(S_ij, -1, -2)).swapaxes(-1, -2)
+        means = means + np.einsum('krc,nkc->nkr', gain, Y[:, np.newaxis, :] - mu_j)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.exp(log_weights - logsumexp(log_weights, axis=-1, keepdims=True))
+    return weights, means
+
+
+def _log_components(X, mu, Sinv, log_norm):
+    """Returns the log densities of points under the components of mixtures, and the precision-weighted deviations
+    of the points from the means.
+
+    Args:
+        X: np.ndarray of shape (..., M, d)
+            The points.
+        mu, Sinv, log_norm: np.ndarray of shapes (..., K, d), (..., K, d, d) and (..., K)
+            The means, precision matrices and log normalizers of the components.
+
+    Returns: (np.ndarray, np.ndarray)
+        The log densities of shape (..., M, K) and the deviations Sinv (x - mu) of shape (..., M, K, d).
+    """
+    diff = X[..., :, np.newaxis, :] - mu[..., np.newaxis, :, :]
+    Sdiff = np.einsum('...kij,...mkj->...mki', Sinv, diff)
+    return log_norm[..., np.newaxis, :] - 0.5 * np.einsum('...mki,...mki->...mk', diff, Sdiff), Sdiff
+
+
+def mixture_gradient(X, mu, Sinv, log_norm, log_weights):
+    """Returns the densities and their gradients of a batch of points under a batch of mixtures of Gaussians.
+
+    Args:
+        X: np.ndarray of shape (N, d)
+            The points.
+        mu: np.ndarray of shape (N, K, d)
+            The means of the K components of the mixture of each point.
+        Sinv: np.ndarray of shape (N, K, d, d)
+            The inverse covariance matrices of the components.
+        log_norm: np.ndarray of shape (N, K)
+            The log normalizers of the components. See `cholesky_factors`.
+        log_weights: np.ndarray of shape (N, K)
+            The log weights of the components.
+
+    Returns: (np.ndarray, np.ndarray)
+        The densities of shape (N,) and the gradients of shape (N, d).
+    """
+    log_dens, Sdiff = _log_components(X[:, np.newaxis, :], mu, Sinv, log_norm)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted = np.exp(log_dens[:, 0, :] + log_weights)
+    return weighted.sum(axis=-1), -np.einsum('nk,nki->ni', weighted, Sdiff[:, 0])
+
+
+def mixture_modes(starts, mu, Sinv, log_norm, log_weights, max_iter=200, tol=1e-9):
+    """Returns a mode of each of a batch of mixtures of Gaussians, found by multi-start fixed-point iteration.
+
+    All starting points of all mixtures are iterated simultaneously by the fixed-point (i.e. mean-shift) iteration
+    for Gaussian mixtures:
+
+        x <- (sum_k r_k(x) Sinv_k)^-1 sum_k r_k(x) Sinv_k mu_k,
+
+    where r_k(x) is the posterior probability of component k at x. Each iteration does not decrease the density,
+    and the iteration converges to a mode (or, rarely, a saddle point) of the density. Of all found modes of a mixture
+    the one of largest density is returned.
+
+    Args:
+        starts: np.ndarray of shape (B, M, d)
+            M starting points for each of the B mixtures. The means of the components are a good choice.
+        mu, Sinv, log_norm, log_weights: np.ndarray of shapes (B, K, d), (B, K, d, d), (B, K) and (B, K)
+            The parameters of the K components of each mixture. See `mixture_gradient`. A mixture where all
+            weights are 0 has no mode and a log density of -inf.
+        max_iter: int, optional.
+            The maximum number of iterations.
+        tol: float, optional.
+            The iteration stops when no point moved by more than `tol` relative to the scale of the points.
+
+    Returns: (np.ndarray, np.ndarray)
+        The modes of shape (B, d) and their log densities of shape (B,).
+    """
+    valid = np.isfinite(log_weights).any(axis=-1)
+    log_weights = np.where(valid[:, np.newaxis], log_weights, 0)
+    SinvMu = np.einsum('bkij,bkj->bki', Sinv, mu)
+    X = np.array(starts, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore', under='ignore'):
+        for _ in range(max_iter):
+            log_r = _log_components(X, mu, Sinv, log_norm)[0] + log_weights[:, np.newaxis, :]
+            r = np.exp(log_r - logsumexp(log_r, axis=-1, keepdims=True))
+            A = np.einsum('bmk,bkij->bmij', r, Sinv)
+            b = np.einsum('bmk,bki->bmi', r, SinvMu)
+            X_new = np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+            converged = np.abs(X_new - X).max() <= tol * (1 + np.abs(X).max())
+            X = X_new
+            if converged:
+                break
+
+        log_density = logsumexp(_log_components(X, mu, Sinv, log_norm)[0] + log_weights[:, np.newaxis, :], axis=-1)
+    best = log_density.argmax(axis=-1)
+    rows = np.arange(len(X))
+    return X[rows, best], np.where(valid, log_density[rows, best], -np.inf)
+
+
+def warm_mixture_modes(x0, mu, Sinv, log_norm, log_weights, **kwargs):
+    """Returns a mode of each of a batch of mixtures of Gaussians like `mixture_modes`, but searched from a single
+    starting point per mixture only.
+
+    This is meant for warm starts, e.g. from the solution of a similar, previous problem. The search is not reliable
+    then: None is returned if it diverged, or if it missed the mode of largest density for sure, i.e. if the density
+    at any mean of a component is larger than at all found modes. The caller should then restart cold.
+
+    Args:
+        x0: np.ndarray of shape (B, d) or (d,)
+            The starting point for each mixture, or a common one for all.
+        mu, Sinv, log_norm, log_weights, kwargs:
+            See `mixture_modes`.
+
+    Returns: (np.ndarray, np.ndarray) or None
+        See `mixture_modes`.
+    """
+    B, K, d = mu.shape
+    modes, log_density = mixture_modes(np.broadcast_to(x0, (B, 1, d)), mu, Sinv, log_norm, log_weights, **kwargs)
+    # no iterations: only the densities at the means
+    _, log_density_means = mixture_modes(mu, mu, Sinv, log_norm, log_weights, max_iter=0)
+    if not np.isfinite(modes).all() or log_density.max() < log_density_means.max() - 1e-9:
+        return None
+    return modes, log_density
+
+
+def box_probabilities(lower, upper, mu, S):
+    """Returns the probabilities of a batch of axis-aligned boxes under a stack of Gaussians.
+
+    In one dimension and for Gaussians of diagonal covariance, the probabilities are products of univariate normal
+    CDFs and exact. Otherwise they are computed by inclusion-exclusion over the CDF at the 2^d corners of each box,
+    where the CDF is integrated numerically by `scipy.stats.multivariate_normal.cdf`, one call for all corners of all
+    boxes per Gaussian.
+
+    Args:
+        lower: np.ndarray of shape (N, d)
+            The lower bounds of the boxes. Bounds may be infinite.
+        upper: np.ndarray of shape (N, d)
+            The upper bounds of the boxes. Boxes where any upper bound is not larger than its lower bound are empty.
+        mu: np.ndarray of shape (K, d)
+            The means of the Gaussians.
+        S: np.ndarray of shape (K, d, d)
+            The covariances of the Gaussians.
+
+    Returns: np.ndarray of shape (N, K)
+        The probability of the n-th box under the k-th Gaussian.
+    """
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    mu, S = np.asarray(mu, dtype=float), np.asarray(S, dtype=float)
+    N, d = lower.shape
+    K = len(mu)
+    empty = (upper <= lower).any(axis=1)
+
+    variances = np.diagonal(S, axis1=-2, axis2=-1)
+    diagonal = np.all(S == variances[:, :, np.newaxis] * np.eye(d), axis=(1, 2))
+    probabilities = np.empty((N, K))
+    if diagonal.any():
+        stddev = np.sqrt(variances[diagonal])
+        mu_ = mu[diagonal]
+        probabilities[:, diagonal] = np.prod(norm.cdf((upper[:, np.newaxis] - mu_) / stddev)
+                                             - norm.cdf((lower[:, np.newaxis] - mu_) / stddev), axis=-1)
+    if not diagonal.all():
+        # corners of the boxes: the lower bound of the dimensions in `take_lower`, the upper bound of all others.
+        # the CDF at a corner with any bound of -inf is 0
+        take_lower = np.array(list(itertools.product([False, True], repeat=d)), dtype=bool)
+        signs = np.where(take_lower.sum(axis=1) % 2 == 0, 1.0, -1.0)
+        corners = np.where(take_lower, lower[:, np.newaxis], upper[:, np.newaxis]).reshape(-1, d)
+        zero = (corners == -np.inf).any(axis=1) | np.repeat(empty, len(signs))
+        for k in np.flatnonzero(~diagonal):
+            cdf = np.zeros(len(corners))
+            if not zero.all():
+                cdf[~zero] = np.reshape(multivariate_normal.cdf(corners[~zero], mean=mu[k], cov=S[k]), -1)
+            probabilities[:, k] = cdf.reshape(N, -1).dot(signs)
+
+    probabilities[empty] = 0
+    return np.clip(probabilities, 0, 1)
@@ -2,12 +2,15 @@
 import functools
 import logging
 import numpy as np
-from numpy import pi, exp, matrix, ix_, nan
-from sklearn import mixture
+import pandas as pd
+from numpy import exp, ix_, nan
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
 
 from mb_modelbase.utils import utils
 from mb_modelbase.models_core import models as md
 from mb_modelbase.models_core import domains as dm
+from mb_modelbase.models_core.base import Field
+from mb_modelbase.models_core import gaussian_kernels as gk
 
 # setup logger
 logger = logging.getLogger(__name__)
@@ -16,18 +19,25 @@ logger.setLevel(logging.WARNING)
 
 class MultiVariateGaussianModel(md.Model):
     """A multivariate gaussian model and methods to derive submodels from it
-    or query density and other aggregations of it
+    or query density and other aggregations of it.
+
+    The parameters are the mean `_mu`, a np.ndarray of shape (d,), and the covariance matrix `_S`, a np.ndarray of
+    shape (d, d). All queries use the dependent parameters `_L`, the lower Cholesky factor of `_S`, `_Linv`, its
+    inverse, and `_log_norm`, the log normalizer of the density. See `gaussian_kernels.cholesky_factors`.
     """
 
+    _exact_marginals = True
+
     def __init__(self, name):
         super().__init__(name)
         self._mu = nan
         self._S = nan
-        self._detS = nan
-        self._SInv = nan
+        self._L = nan
+        self._Linv = nan
+        self._log_norm = nan
         self._aggrMethods = {
             'maximum': self._maximum,
-            'average': self._maximum
+            'average': self._average
         }
         # creates an self contained update function. we use it as a callback function later
         self._unbound_updater = functools.partial(self.__class__._update, self)
@@ -37,17 +47,14 @@ class MultiVariateGaussianModel(md.Model):
         return ()
 
     def _fit(self):
-        """Fits the model to data of the model
+        """Fits the model to data of the model, i.e. sets the maximum likelihood estimates of mean and covariance.
 
         Returns:
             The modified model.
         """
-
-        # fit using scikit learn mixtures
-        model = mixture.GMM(n_components=1, covariance_type='full')
-        model.fit(self.data)
-        self._mu = matrix(model.means_).T
-        self._S = matrix(model.covars_)
+        data = self.data.values.astype(float)
+        self._mu = data.mean(axis=0)
+        self._S = np.atleast_2d(np.cov(data, rowvar=False, bias=True))
         return self._unbound_updater,
 
     def __str__(self):
@@ -59,17 +66,29 @@ class MultiVariateGaussianModel(md.Model):
     def _update(self):
         """updates dependent parameters / precalculated values of the model"""
         if self.dim == 0:
-            self._detS = nan
-            self._SInv = nan
+            self._L = nan
+            self._Linv = nan
+            self._log_norm = nan
         else:
-            self._detS = np.abs(np.linalg.det(self._S))
-            self._SInv = self._S.I
+            self._Linv, self._log_norm = gk.cholesky_factors(self._S)
+            self._L = np.linalg.cholesky(self._S)
 
-        assert (self._mu.shape == (self.dim, 1) and
+        assert (self._mu.shape == (self.dim,) and
                 self._S.shape == (self.dim, self.dim))
 
         return self
 
+    def _upgrade(self):
+        # models stored by earlier versions store the parameters as np.matrix, and the determinant and inverse of _S
+        # instead of its Cholesky factors
+        if not hasattr(self, '_Linv'):
+            self._mu = np.asarray(self._mu, dtype=float).reshape(-1)
+            self._S = np.asarray(self._S, dtype=float).reshape(self.dim, self.dim)
+            for attr in ['_detS', '_SInv']:
+                self.__dict__.pop(attr, None)
+            self._update()
+        return super()._upgrade()
+
     def _conditionout(self, keep, remove):
         """Conditions the random variables with name in remove on their available, //not unbounded// domain and marginalizes
                 them out.
@@ -80,16 +99,16 @@ class MultiVariateGaussianModel(md.Model):
                   * for discrete domains: condition on the first element in the domain
          """
         # collect singular values to condition out on
-        condvalues = self._condition_values(remove)
-        condvalues = matrix(condvalues).T
+        condvalues = np.array(self._condition_values(remove), dtype=float)
 
-        # calculate updated mu and sigma for conditional distribution, according to GM script
+        # the conditional gaussian has mean mu_i + S_ij S_jj^-1 (x_j - mu_j) and covariance S_ii - S_ij S_jj^-1 S_ji.
+        # Both reuse a single Cholesky factorization of S_jj
         j = self.asindex(remove)
         i = utils.invert_indexes(j, self.dim)
-        S = self._SInv
-        mu = self._mu
-        self._S = utils.schur_complement(S, i)
-        self._mu = mu[i] + S[ix_(i, j)] * S[ix_(j, j)].I * (condvalues - mu[j])
+        S, mu = self._S, self._mu
+        factor = cho_factor(S[ix_(j, j)], lower=True)
+        self._mu = mu[i] + S[ix_(i, j)].dot(cho_solve(factor, condvalues - mu[j]))
+        self._S = S[ix_(i, i)] - S[ix_(i, j)].dot(cho_solve(factor, S[ix_(j, i)]))
 
         return self._unbound_updater,
 
@@ -100,25 +119,59 @@ class MultiVariateGaussianModel(md.Model):
         self._S = self._S[np.ix_(keepidx, keepidx)]
         return self._unbound_updater,
 
+    def _log_density_batch(self, X):
+        """Returns the log densities at all points of the np.ndarray `X` of shape (N, d)."""
+        z = (X - self._mu).dot(self._Linv.T)
+        return self._log_norm - .5 * np.einsum('ni,ni->n', z, z)
+
     def _density(self, x):
-        x = matrix(x).T  # turn into column vector of type numpy matrix
-        xmu = x - self._mu
-        return ((2 * pi) ** (-self.dim / 2) * (self._detS ** -.5) * exp(-.5 * xmu.T * self._SInv * xmu)).item()
+        return exp(self._log_density_batch(np.array(x, dtype=float).reshape(1, -1))[0])
+
+    def _density_batch(self, X):
+        return exp(self._log_density_batch(X.values.astype(float)))
 
     def _gradient(self, x):
-        x = matrix(x).T 
-        xmu = x - self._mu
-        result = ((2 * pi) ** (-self.dim / 2) * (self._detS ** -.5) * exp(-.5 * xmu.T * self._SInv * xmu)).item() * (-.5 * self._SInv * xmu)
-        return np.array(result).T[0]
+        x = np.array(x, dtype=float)
+        # S^-1 (x - mu) by two triangular solves
+        SInv_xmu = solve_triangular(self._L, solve_triangular(self._L, x - self._mu, lower=True), lower=True, trans='T')
+        return -self._density(x) * SInv_xmu
 
     def _maximum(self):
         """Returns the point of the maximum density in this model"""
-        # _mu is a np matrix, but we want to return a list
-        return self._mu.T.tolist()[0]
+        return self._mu.tolist()
+
+    def _average(self):
+        """Returns the average of this model, which is, like its maximum, the mean of the Gaussian"""
+        return self._maximum()
 
-    def _sample(self):
-        sample = self._S * np.matrix(np.random.randn(self.dim)).T + self._mu
-        return sample.T.tolist()[0]   # we want it as a 'normal' list
+    def _conditional_average_batch(self, names, X):
+        """Vectorized computation of conditional averages. See `Model._conditional_average_batch()`.
+
+        The conditional averages are the means of the conditional Gaussians, which are linear in the conditioning
+        values.
+        """
+        names = list(names)
+        keep = [name for name in self.names if name not in names]
+        Y = X.loc[:, names].values.astype(float)
+        _, means = gk.conditional_mixture_moments(Y, self._mu[np.newaxis], self._S[np.newaxis], np.zeros(1),
+                                                  self.asindex(names))
+        return pd.DataFrame(data=means[:, 0, :], columns=keep)
+
+    def _probability(self, domains):
+        return self._probability_batch(pd.DataFrame([domains], columns=self.names))[0]
+
+    def _probability_batch(self, domains):
+        """Vectorized, exact computation of probabilities. See `Model._probability_batch()` and
+        `gaussian_kernels.box_probabilities()`."""
+        bounds = np.array([[list(d) for d in row] for row in domains.itertuples(index=False, name=None)],
+                          dtype=float).reshape(len(domains), self.dim, 2)
+        return gk.box_probabilities(bounds[:, :, 0], bounds[:, :, 1], self._mu[np.newaxis], self._S[np.newaxis])[:, 0]
+
+    def _sample(self, n=1):
+        return self._mu + np.random.randn(int(n), self.dim).dot(self._L.T)
+
+    def _memory_components(self):
+        return {'parameters': [self._mu, self._S, self._L, self._Linv]}
 
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
@@ -136,7 +189,7 @@ class MultiVariateGaussianModel(md.Model):
         Options must have a key 'mode' of value 'custom' or 'normal':
 
         If mode is 'custom':
-            option must have keys 'sigma' and 'mu'. which are a suitable numpy matrix and row vector, resp.
+            option must have keys 'sigma' and 'mu', which are a suitable covariance matrix and mean vector, resp.
             The domain of each field is set to (-10,10).
 
         if mode is 'normal'
@@ -147,34 +200,32 @@ class MultiVariateGaussianModel(md.Model):
 
         mode = opts['mode']
         if mode == 'custom':
-            mu = opts['mu']
-            sigma = opts['sigma']
-            if not isinstance(mu, matrix) or not isinstance(sigma, matrix) or mu.shape[1] != 1:
+            mu = np.array(opts['mu'], dtype=float).ravel()
+            sigma = np.array(opts['sigma'], dtype=float)
+            if sigma.shape != (len(mu), len(mu)):
                 raise ValueError("invalid arguments")
             self._S = sigma
             self._mu = mu
-            self.fields = [md.Field(name="dim" + str(idx),
-                                     domain=dm.NumericDomain(),
-                                     extent=dm.NumericDomain(mu[idx].item() - 2, mu[idx].item() + 2))
-                           for idx in range(sigma.shape[0])]
+            self.fields = [Field(name="dim" + str(idx),
+                                 domain=dm.NumericDomain(),
+                                 extent=dm.NumericDomain(mu[idx] - 2, mu[idx] + 2),
+                                 independent=False)
+                           for idx in range(len(mu))]
             self.mode = 'model'
             return self._unbound_updater,
 
         if mode == 'normal':
             dim = opts['dim']
-            sigma = matrix(np.eye(dim))
-            mu = matrix(np.zeros(dim)).T
-            opts = {'mode': 'custom', 'sigma': sigma, 'mu': mu}
+            opts = {'mode': 'custom', 'sigma': np.eye(dim), 'mu': np.zeros(dim)}
             return self._generate_model(opts=opts)
         else:
             raise ValueError('invalid mode: ' + str(mode))
 
-
     @staticmethod
     def dummy2d_model(name='test'):
         m = MultiVariateGaussianModel(name)
-        mu = np.matrix(np.zeros(2)).T
-        sigma = np.matrix([[1, 0.5], [0.5, 1]])
+        mu = np.zeros(2)
+        sigma = np.array([[1, 0.5], [0.5, 1]])
         m.generate_model({'mode': 'custom', 'mu': mu, 'sigma': sigma})
         m._generate_data({'n': 200})
         return m
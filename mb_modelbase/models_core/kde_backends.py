@@ -0,0 +1,467 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Backends for the evaluation of Gaussian kernel density estimates (KDE).
+
+A backend is built once from the data points and the covariance matrix of the kernel, and then evaluates the density
+at batches of query points. All backends work on whitened coordinates, where the kernel is the standard normal
+distribution. They differ in speed and precision:
+
+  * `ExactBackend`: sums the kernels of all data points. O(n) per query point. This is the reference, and fastest for
+    small data.
+  * `TreeBackend`: sums only the kernels of data points within a cutoff radius of the query point, which are found by a
+    k-d tree. Sublinear per query point for small bandwidths, in any dimension.
+  * `GridBackend`: bins the data on a regular grid, convolves it with the kernel by FFT once, and interpolates the
+    density at the query points. O(1) per query point, but only for one or two dimensions.
+
+The approximating backends take a `tolerance`: the absolute error of the density is at most about `tolerance` times
+the maximum of a single kernel.
+
+All backends accept optional `weights` of the data points, i.e. they evaluate the weighted sum of the kernels. This is
+used to condition a KDE by re-weighting its data points.
+
+Modes of the KDE are found by mean-shift iteration from many starting points at once, see `ExactBackend.modes()`.
+"""
+import collections
+import logging
+import math
+import threading
+
+import numpy as np
+from scipy import ndimage, signal
+from scipy.spatial import cKDTree
+
+from mb_modelbase.models_core import gaussian_kernels as gk
+
+logger = logging.getLogger(__name__)
+
+# the maximum number of elements of intermediate arrays of the exact backend
+_MAX_CHUNK_SIZE = 2**22
+
+# the default bound of the memory occupied by the backends in a `BackendCache`, in bytes
+DEFAULT_CACHE_BYTES = 2**28
+
+
+def bandwidth_covariance(data, weights=None):
+    """Returns the covariance matrix of the kernel for `data`, according to Scott's rule.
+
+    This is identical to the default bandwidth of `scipy.stats.gaussian_kde`, also for weighted data.
+
+    Args:
+        data: np.ndarray of shape (n, d)
+            The data points.
+        weights: np.ndarray of shape (n,), optional.
+            The weights of the data points. Defaults to equal weights.
+    """
+    n, d = data.shape
+    if weights is None:
+        n_eff = n
+    else:
+        weights = weights / weights.sum()
+        n_eff = 1 / np.sum(weights**2)
+    factor = n_eff ** (-1. / (d + 4))
+    return np.atleast_2d(np.cov(data, rowvar=False, aweights=weights)) * factor**2
+
+
+def normalized_weights(n, weights=None):
+    """Returns `weights` of `n` data points normalized to sum 1, or equal weights if `weights` is None."""
+    if weights is None:
+        return np.full(n, 1. / n)
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != (n,):
+        raise ValueError("expected {} weights, but got shape {}".format(n, weights.shape))
+    total = weights.sum()
+    if not total > 0:
+        raise ValueError("the sum of the weights must be positive")
+    return weights / total
+
+
+def cutoff_radius(tolerance):
+    """Returns the radius in whitened coordinates beyond which the kernel is less than `tolerance` times its
+    maximum."""
+    return math.sqrt(-2 * math.log(tolerance))
+
+
+class ExactBackend:
+    """Exact evaluation of a KDE by summing the kernels of all data points.
+
+    Args:
+        data: np.ndarray of shape (n, d)
+            The data points.
+        covariance: np.ndarray of shape (d, d), optional.
+            The covariance matrix of the kernel. Defaults to `bandwidth_covariance(data)`.
+        tolerance: float, optional.
+            Ignored by this backend.
+        weights: np.ndarray of shape (n,), optional.
+            The weights of the data points. They are normalized to sum 1. Defaults to equal weights.
+    """
+
+    def __init__(self, data, covariance=None, tolerance=None, weights=None):
+        self.data = np.asarray(data, dtype=float)
+        self.n, self.d = self.data.shape
+        self.weights = normalized_weights(self.n, weights)
+        if covariance is None:
+            covariance = bandwidth_covariance(self.data, None if weights is None else self.weights)
+        self.covariance = np.asarray(covariance, dtype=float)
+        self.tolerance = tolerance
+        self._Linv, self._log_norm = gk.cholesky_factors(self.covariance)
+        self._Z = self.whiten(self.data)
+
+    @property
+    def nbytes(self):
+        """The memory occupied by the backend in bytes."""
+        return self.data.nbytes + self.weights.nbytes + self._Z.nbytes
+
+    def whiten(self, X):
+        """Returns the whitened coordinates of the points `X` of shape (N, d)."""
+        return np.asarray(X, dtype=float).reshape(-1, self.d).dot(self._Linv.T)
+
+    def evaluate(self, X):
+        """Returns the densities at the points `X` of shape (N, d)."""
+        return math.exp(self._log_norm) * self._kernel_sums(self.whiten(X))
+
+    def _kernel_sums(self, Z):
+        """Returns the weighted sums of the standard normal kernels (without normalization) of all data points at the
+        whitened points `Z`."""
+        sums = np.empty(len(Z))
+        data_sq = np.einsum('ki,ki->k', self._Z, self._Z)
+        chunk = max(1, _MAX_CHUNK_SIZE // self.n)
+        for start in range(0, len(Z), chunk):
+            z = Z[start:start + chunk]
+            # squared distances |z - z_k|^2 = |z|^2 + |z_k|^2 - 2 z.z_k, as a matrix product
+            sq = np.einsum('ni,ni->n', z, z)[:, np.newaxis] + data_sq - 2 * z.dot(self._Z.T)
+            sums[start:start + chunk] = np.exp(-.5 * np.maximum(sq, 0)).dot(self.weights)
+        return sums
+
+    def _moments(self, Z):
+        """Returns the moments of the data points weighted by their weights times their kernel at each of the whitened
+        points `Z` of shape (N, d): the sums of the weights of shape (N,), and the weighted means and covariances of the
+        whitened data points of shape (N, d) and (N, d, d). The means and covariances are nan where all kernels
+        vanish."""
+        N, d = Z.shape
+        sums = np.empty(N)
+        first = np.empty((N, d))
+        second = np.empty((N, d * d))
+        outer = np.einsum('ki,kj->kij', self._Z, self._Z).reshape(self.n, d * d)
+        data_sq = np.einsum('ki,ki->k', self._Z, self._Z)
+        chunk = max(1, _MAX_CHUNK_SIZE // self.n)
+        for start in range(0, N, chunk):
+            z = Z[start:start + chunk]
+            sq = np.einsum('ni,ni->n', z, z)[:, np.newaxis] + data_sq - 2 * z.dot(self._Z.T)
+            kernels = np.exp(-.5 * np.maximum(sq, 0)) * self.weights
+            sums[start:start + chunk] = kernels.sum(axis=1)
+            first[start:start + chunk] = kernels.dot(self._Z)
+            second[start:start + chunk] = kernels.dot(outer)
+        return self._normalize_moments(sums, first, second)
+
+    @staticmethod
+    def _normalize_moments(sums, first, second):
+        N, d = first.shape
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = first / sums[:, np.newaxis]
+            covariances = second.reshape(N, d, d) / sums[:, np.newaxis, np.newaxis] - \
+                np.einsum('ni,nj->nij', means, means)
+        return sums, means, covariances
+
+    def modes(self, starts, max_iter=500, tol=1e-7, merge_tol=1e-3):
+        """Returns the modes of the KDE found by iteration from each of the points `starts`, and the densities at the
+        modes.
+
+        All starting points are iterated simultaneously. In whitened coordinates the gradient of the log density at a
+        point z is the mean-shift vector m - z, where m is the mean of the data points weighted by their kernels at z,
+        and its Hessian is C - I, where C is their covariance. Where the density is log-concave, a Newton step
+
+            z <- z + (I - C)^-1 (m - z)
+
+        is taken, and else a mean-shift step z <- m. Mean-shift steps never decrease the density but converge slowly
+        near flat modes. A Newton step that decreased the density is undone, and the point continues by mean-shift
+        steps. The iteration converges to a mode (or, rarely, a saddle point) of the density. Points that get closer
+        than `merge_tol` to a point of smaller index converge to the same mode, and are merged into it.
+
+        Args:
+            starts: np.ndarray of shape (M, d)
+                The starting points.
+            max_iter: int, optional.
+                The maximum number of iterations.
+            tol: float, optional.
+                A point is not moved any further once a step would move it by at most `tol` in whitened coordinates,
+                i.e. relative to the bandwidth.
+            merge_tol: float, optional.
+                The distance in whitened coordinates up to which points are merged.
+
+        Returns: (np.ndarray, np.ndarray)
+            The modes of shape (M, d) and their densities of shape (M,).
+        """
+        Z = self.whiten(starts)
+        N = len(Z)
+        sums = np.full(N, -np.inf)
+        mean_shift = Z.copy()
+        newton = np.zeros(N, dtype=bool)
+        failed_newton = np.zeros(N, dtype=bool)
+        # each point is represented by itself or by a point of smaller index that it was merged into
+        representative = np.arange(N)
+        active = np.arange(N)
+        for _ in range(max_iter):
+            if len(active) == 0:
+                break
+            active_sums, means, covariances = self._moments(Z[active])
+
+            # undo Newton steps that decreased the density
+            worse = newton[active] & (active_sums < sums[active])
+            undo = active[worse]
+            Z[undo] = mean_shift[undo]
+            sums[undo] = -np.inf
+            newton[undo] = False
+            failed_newton[undo] = True
+
+            current = active[~worse]
+            sums[current] = active_sums[~worse]
+            means, covariances = means[~worse], covariances[~worse]
+            mean_shift[current] = means
+            steps = means - Z[current]
+            use_newton = ~failed_newton[current] & np.isfinite(covariances).all(axis=(1, 2))
+            use_newton[use_newton] = np.linalg.eigvalsh(covariances[use_newton])[:, -1] < 1 - 1e-6
+            newton_steps = np.linalg.solve(np.eye(self.d) - covariances[use_newton],
+                                           steps[use_newton][..., np.newaxis])[..., 0]
+            # the quadratic model of the log density is trusted up to the bandwidth, or the mean-shift step
+            lengths = np.sqrt(np.einsum('ni,ni->n', newton_steps, newton_steps))
+            limits = np.maximum(1, np.sqrt(np.einsum('ni,ni->n', steps[use_newton], steps[use_newton])))
+            steps[use_newton] = newton_steps * np.minimum(1, limits / lengths)[:, np.newaxis]
+            newton[current] = use_newton
+            failed_newton[current] = False
+
+            # converged points keep their position, such that exact modes (e.g. by symmetry) remain exact
+            moving = np.einsum('ni,ni->n', steps, steps) > tol**2
+            moving &= np.isfinite(steps).all(axis=1)
+            Z[current[moving]] += steps[moving]
+            active = np.sort(np.concatenate([undo, current[moving]]))
+
+            # merge each active point into the first point that is close to it
+            alive = np.flatnonzero(representative == np.arange(N))
+            close = cKDTree(Z[alive]).query_ball_point(Z[active], merge_tol)
+            first = np.array([alive[min(c)] for c in close], dtype=int)
+            merged = first < active
+            representative[active[merged]] = first[merged]
+            active = active[~merged]
+
+        for i in range(N):
+            representative[i] = representative[representative[i]]
+        X = Z[representative].dot(np.linalg.cholesky(self.covariance).T)
+        return X, self.evaluate(X)
+
+    def mode(self, x0=None, n_starts=16):
+        """Returns the mode of largest density of the KDE and its density.
+
+        The modes are searched by `modes()` from the weighted mean of the data, from up to `n_starts` data points
+        and from `x0`, if given.
+
+        Args:
+            x0: array-like of shape (d,), optional.
+                An additional starting point, e.g. the mode of a similar KDE.
+            n_starts: int, optional.
+                The maximum number of data points to start from. They are drawn with probability proportional to their
+                weights, but deterministically.
+        """
+        candidates = np.flatnonzero(self.weights > 0)
+        size = min(n_starts, len(candidates))
+        picked = np.random.RandomState(0).choice(candidates, size, replace=False,
+                                                 p=self.weights[candidates] / self.weights[candidates].sum())
+        starts = [self.weights.dot(self.data)[np.newaxis, :], self.data[np.sort(picked)]]
+        if x0 is not None:
+            starts.append(np.asarray(x0, dtype=float).reshape(1, self.d))
+        modes, densities = self.modes(np.concatenate(starts))
+        # the iteration converges slowly near flat modes. Of the modes of equal density up to rounding prefer the
+        # first one, which is the most reproducible
+        best = np.flatnonzero(densities >= densities.max() * (1 - 1e-10))[0]
+        return modes[best], densities[best]
+
+
+class TreeBackend(ExactBackend):
+    """Approximate evaluation of a KDE by summing the kernels of the data points within a cutoff radius only.
+
+    Neighbours are found by a k-d tree over the whitened data points. See `ExactBackend` for the arguments.
+    """
+
+    def __init__(self, data, covariance=None, tolerance=1e-4, weights=None):
+        super().__init__(data, covariance, tolerance, weights)
+        self._radius = cutoff_radius(tolerance)
+        self._tree = cKDTree(self._Z)
+
+    @property
+    def nbytes(self):
+        # the tree stores a copy of the points and an index
+        return super().nbytes + self._Z.nbytes + self.n * np.dtype(np.intp).itemsize
+
+    def _kernel_sums(self, Z):
+        pairs = self._tree.sparse_distance_matrix(cKDTree(Z), self._radius, output_type='ndarray')
+        return np.bincount(pairs['j'], weights=np.exp(-.5 * pairs['v']**2) * self.weights[pairs['i']],
+                           minlength=len(Z))
+
+    def _moments(self, Z):
+        N, d = Z.shape
+        pairs = self._tree.sparse_distance_matrix(cKDTree(Z), self._radius, output_type='ndarray')
+        kernels = np.exp(-.5 * pairs['v']**2) * self.weights[pairs['i']]
+        data = self._Z[pairs['i']]
+        sums = np.bincount(pairs['j'], weights=kernels, minlength=N)
+        first = np.stack([np.bincount(pairs['j'], weights=kernels * data[:, i], minlength=N) for i in range(d)], axis=1)
+        second = np.stack([np.bincount(pairs['j'], weights=kernels * data[:, i] * data[:, j], minlength=N)
+                           for i in range(d) for j in range(d)], axis=1)
+        return self._normalize_moments(sums, first, second)
+
+
+class GridBackend(ExactBackend):
+    """Approximate evaluation of a KDE by linear binning of the data on a regular grid, a FFT based convolution with the
+    kernel and linear interpolation. This is only available for one or two dimensions.
+
+    The grid spacing is chosen according to `tolerance`, but the grid has at most `max_grid_size` points. See
+    `ExactBackend` for the other arguments.
+    """
+
+    def __init__(self, data, covariance=None, tolerance=1e-4, weights=None, max_grid_size=2**22):
+        super().__init__(data, covariance, tolerance, weights)
+        if self.d > 2:
+            raise ValueError("the grid backend supports at most 2 dimensions, but got {}".format(self.d))
+
+        # the grid covers the data plus the support of the kernels up to the cutoff
+        stddev = np.sqrt(np.diag(self.covariance))
+        margin = cutoff_radius(tolerance) * stddev
+        low = self.data.min(axis=0) - margin
+        high = self.data.max(axis=0) + margin
+
+        # the error of binning and interpolation is about (spacing/stddev)^2/8 of the maximum of a kernel
+        spacing = stddev * math.sqrt(2 * tolerance)
+        shape = np.ceil((high - low) / spacing).astype(int) + 1
+        max_per_dim = int(max_grid_size ** (1. / self.d))
+        if (shape > max_per_dim).any():
+            logger.info("grid of KDE is limited to {} points per dimension".format(max_per_dim))
+            shape = np.minimum(shape, max_per_dim)
+        self._low = low
+        self._spacing = (high - low) / (shape - 1)
+
+        # linear binning: distribute each data point onto the 2^d grid points around it
+        position = (self.data - low) / self._spacing
+        base = np.minimum(np.floor(position).astype(int), shape - 2)
+        fraction = position - base
+        counts = np.zeros(shape)
+        for corner in np.ndindex(*(2,)*self.d):
+            corner = np.array(corner)
+            shares = np.prod(np.where(corner, fraction, 1 - fraction), axis=1)
+            np.add.at(counts, tuple((base + corner).T), shares * self.weights)
+
+        # the kernel on the grid, up to the cutoff
+        half = np.ceil(margin / self._spacing).astype(int)
+        offsets = np.stack(np.meshgrid(*[np.arange(-h, h + 1) * s for h, s in zip(half, self._spacing)],
+                                       indexing='ij'), axis=-1)
+        z = offsets.dot(self._Linv.T)
+        kernel = np.exp(self._log_norm - .5 * np.einsum('...i,...i->...', z, z))
+
+        self._grid = np.maximum(signal.fftconvolve(counts, kernel, mode='same'), 0)
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self._grid.nbytes
+
+    def evaluate(self, X):
+        coords = ((np.asarray(X, dtype=float).reshape(-1, self.d) - self._low) / self._spacing).T
+        return ndimage.map_coordinates(self._grid, coords, order=1, mode='constant', cval=0.)
+
+
+backends = {
+    'exact': ExactBackend,
+    'tree': TreeBackend,
+    'grid': GridBackend,
+}
+"""A dict from the name of a backend to its class."""
+
+
+def make_backend(data, covariance=None, method='auto', tolerance=1e-4, weights=None):
+    """Returns a backend for the KDE of `data`.
+
+    Args:
+        data: np.ndarray of shape (n, d)
+            The data points.
+        covariance: np.ndarray of shape (d, d), optional.
+            The covariance matrix of the kernel. Defaults to `bandwidth_covariance(data)`.
+        method: str, optional.
+            The name of a backend (see `backends`) or 'auto' (the default). 'auto' uses the exact backend for small
+            data, and else the grid backend in up to two dimensions and the tree backend otherwise.
+        tolerance: float, optional.
+            The tolerance of the approximating backends. Defaults to 1e-4.
+        weights: np.ndarray of shape (n,), optional.
+            The weights of the data points. Defaults to equal weights.
+    """
+    if method == 'auto':
+        n, d = np.shape(data)
+        method = 'exact' if n <= 5000 else ('grid' if d <= 2 else 'tree')
+    try:
+        backend = backends[method]
+    except KeyError:
+        raise ValueError("invalid KDE backend: {}".format(method))
+    return backend(data, covariance, tolerance, weights)
+
+
+class BackendCache:
+    """A bounded cache of backends, that evicts the least recently used backends first.
+
+    The memory of the cached backends is accounted by their `nbytes`. If it exceeds `max_bytes`, the least recently
+    used backends are evicted, except for the most recent one. Backends are immutable once built. Hence, a cache may
+    be shared by any models that derive the same backends from the same data. It is safe to use from multiple threads.
+
+    Args:
+        max_bytes: int, optional.
+            The bound of the memory occupied by the cached backends. Defaults to `DEFAULT_CACHE_BYTES`.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._backends = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._backends)
+
+    def __contains__(self, key):
+        return key in self._backends
+
+    def __getitem__(self, key):
+        with self._lock:
+            backend = self._backends[key]
+            self._backends.move_to_end(key)
+        return backend
+
+    def __setitem__(self, key, backend):
+        with self._lock:
+            if key in self._backends:
+                self.nbytes -= self._nbytes(self._backends.pop(key))
+            self._backends[key] = backend
+            self.nbytes += self._nbytes(backend)
+            while self.nbytes > self.max_bytes and len(self._backends) > 1:
+                _, evicted = self._backends.popitem(last=False)
+                self.nbytes -= self._nbytes(evicted)
+
+    def __getstate__(self):
+        # locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _nbytes(backend):
+        return 0 if backend is None else backend.nbytes
+
+    def get(self, key, default=None):
+        """Returns the backend of `key` if it is cached, and `default` otherwise."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Returns the keys of the cached backends, from the least to the most recently used."""
+        return list(self._backends.keys())
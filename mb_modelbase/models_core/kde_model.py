@@ -3,13 +3,14 @@
 from mb_modelbase.models_core.models import Model
 from mb_modelbase.models_core import data_operations as data_op
 from mb_modelbase.models_core import data_aggregation as data_aggr
+from mb_modelbase.models_core import kde_backends as kb
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
+from mb_modelbase.models_core.frequency_index import FrequencyIndex
 from scipy import stats
-from mb_modelbase.utils import data_import_utils
-import copy
+from mb_modelbase.utils import data_import_utils, validate_opts
+import concurrent.futures
 import numpy as np
 import pandas as pd
-import scipy.optimize as sciopt
-import itertools
 
 
 class KDEModel(Model):
@@ -18,17 +19,54 @@ class KDEModel(Model):
     density estimator. KDE work in a way that to each point of the observed data a so-called kernel distribution is
     assigned centered at that point (e.g. a normal distribution). The distributions from all data points
     are then summed up and build up the joint distribution for the model.
+
+    The density of the numerical fields conditional on the values of the categorical fields is evaluated by a backend of
+    `kde_backends`. It is set by the options of `.fit()`:
+
+      * 'backend': the name of the backend, see `kde_backends.make_backend()`. Defaults to 'auto'.
+      * 'tolerance': the tolerance of approximating backends. Defaults to 1e-4.
+      * 'cache_bytes': the bound of the memory occupied by the backends, see `kde_backends.BackendCache`. Defaults
+        to `kde_backends.DEFAULT_CACHE_BYTES`.
+      * 'precompute': if True, the backends of all combinations of categorical values that occur in the data are
+        built in parallel at fit time. Otherwise they are built lazily when needed. Defaults to False.
+
+    The combinations of categorical values (cells) are identified by their flat integer code in a `CategoricalIndex`.
+    The rows of each cell are stored as a contiguous range of a permutation of the data. The backends are cached by
+    cell code in `self.kde`. Since they only depend on the data, copies of a model share the cache until they are
+    refitted.
+
+    Conditioning does not filter the data, but re-weights the data points (see `_conditionout()`). The weights of the
+    rows of `self.data` are stored in `self._weights`, which is None for equal weights.
     """
 
+    _fit_opts_allowed = {
+        'backend': ['auto'] + list(kb.backends.keys()),
+        'precompute': [True, False],
+    }
+
     def __init__(self, name):
         super().__init__(name)
-        self.kde = {}
-        self.marginals = {}
+        self.kde = kb.BackendCache()
+        self._index = None
+        self._num_data = None
+        self._order = None
+        self._cells = None
+        self._starts = None
+        self._counts = None
+        self._probs = None
+        self._frequencies = None
+        self._weights = None
         self._emp_data = None
         self._aggrMethods = {
             'maximum': self._maximum,
         }
         self.parallel_processing = False
+        self.opts = {
+            'backend': 'auto',
+            'tolerance': 1e-4,
+            'cache_bytes': kb.DEFAULT_CACHE_BYTES,
+            'precompute': False,
+        }
 
     def _set_data(self, df, drop_silently, **kwargs):
         self._set_data_mixed(df, drop_silently, split_data=False)
@@ -37,34 +75,105 @@ class KDEModel(Model):
         # needs the data, however when it is called by _marginalize, the actual self.data
         # is already marginalized abd thus not usable by _conditionout
         self._emp_data = self.data.copy()
+        self._weights = None
         return ()
 
-    def _fit(self):
+    def _fit(self, **kwargs):
+        validate_opts(kwargs, __class__._fit_opts_allowed)
+        if not 0 < kwargs.get('tolerance', 1e-4) < 1:
+            raise ValueError("tolerance must be in (0, 1), but is {}".format(kwargs['tolerance']))
+        self.opts.update((key, kwargs[key]) for key in self.opts if key in kwargs)
+
+        # group the rows by cell
+        num_idx, cat_idx = self._split_idx()
+        self._num_data = self.data.iloc[:, num_idx].values.astype(float)
+        if cat_idx:
+            names = list(self.data.columns[cat_idx])
+            self._index = CategoricalIndex(names, [sorted(self.data[name].unique()) for name in names])
+            cells = self._index.encode_columns([self.data[name].values for name in names])
+        else:
+            self._index = None
+            cells = np.zeros(len(self.data), dtype=int)
+        self._order = np.argsort(cells, kind='stable')
+        self._cells, self._starts, self._counts = np.unique(cells[self._order], return_index=True,
+                                                            return_counts=True)
+        # the marginal probability of each cell
+        if self._weights is None:
+            self._probs = self._counts / len(self.data)
+        else:
+            self._probs = np.add.reduceat(self._weights[self._order], self._starts) / self._weights.sum()
+
+        # the kdes depend on the data, which may have changed
+        self.kde = kb.BackendCache(self.opts['cache_bytes'])
+        # the frequencies of the distinct data points are needed for the density of categorical-only models
+        self._frequencies = None if num_idx else FrequencyIndex.from_data(self.data, self._weights)
+        if self.opts['precompute'] and num_idx:
+            self._build_kdes(self._cells)
         return()
 
+    def _upgrade(self):
+        # models stored by earlier versions lack the options, the weights and the grouping of the rows by cell, and
+        # cache their kdes in a dict
+        if not hasattr(self, '_weights'):
+            self.opts = self.__class__(self.name).opts
+            self._weights = None
+            self._fit()
+        return super()._upgrade()
+
     def _conditionout(self, keep, remove):
         """Conditions the random variables with name in remove on their domain and marginalizes them out.
+
+        The data is not filtered, but each data point is weighted by the mass of its kernel in the domains of the
+        removed fields, i.e. by:
+
+          * the kernel density at the value, for a numerical field with singular domain,
+          * the kernel probability of the interval, for a numerical field with bounded domain,
+          * whether its value is in the domain, for a categorical field.
+
+        For numerical fields the bandwidth of the kernel of all (weighted) data is used. Data points of zero weight
+        are dropped. Hence, point conditions on numerical fields are well-defined and the conditional KDE is a
+        weighted KDE of the same data.
         """
+        emp = self._emp_data
+        weights = np.ones(len(emp)) if self._weights is None else self._weights.copy()
+        num_names = [name for name in emp.columns if np.issubdtype(emp[name].dtype, np.number)]
+        if any(name in num_names for name in remove):
+            bandwidth = dict(zip(num_names, np.sqrt(np.diag(
+                kb.bandwidth_covariance(emp.loc[:, num_names].values.astype(float), weights)))))
+
         for name in remove:
-            # Remove all rows from the _emp_data that are outside the domain in name
-            if len(self.byname(name)['domain'].values()) == 2:
-                lower_bound = self.byname(name)['domain'].values()[0]
-                upper_bound = self.byname(name)['domain'].values()[1]
-                lower_cond = self._emp_data[name] >= lower_bound
-                upper_cond = self._emp_data[name] <= upper_bound
-                self._emp_data = self._emp_data[lower_cond & upper_cond]
-            elif len(self.byname(name)['domain'].values()) == 1:
-                cond_val = self.byname(name)['domain'].values()[0]
-                cond = self._emp_data[name] == cond_val
-                self._emp_data = self._emp_data[cond]
+            domain = self.byname(name)['domain']
+            values = emp[name].values
+            if name not in num_names:
+                weights *= np.isin(values, domain.values())
+            elif domain.issingular():
+                weights *= np.exp(-.5 * ((values - domain.value()) / bandwidth[name])**2)
+            elif len(domain.values()) == 2:
+                lower, upper = domain.values()
+                weights *= stats.norm.cdf((upper - values) / bandwidth[name]) - \
+                    stats.norm.cdf((lower - values) / bandwidth[name])
             else:
                 raise ValueError('Unexpected domain dimensions')
 
         # transfer condition from _emp_data to data
-        self.data = self.data.loc[list(self._emp_data.index.values), :]
+        keep_rows = weights > 0
+        self._select(keep_rows)
+        self._weights = weights[keep_rows]
         self._marginalizeout(keep, remove)
         return()
 
+    def _condition_data(self, conditions):
+        """Does not filter the data, since conditioning re-weights the data points instead, see `_conditionout()`.
+        The data must remain aligned to `_emp_data` and `_weights`."""
+        pass
+
+    def _select(self, mask):
+        """Keeps only the rows of the data in `mask`."""
+        self._emp_data = self._emp_data[mask]
+        self.data = self.data[mask]
+        if self._weights is not None:
+            self._weights = self._weights[mask]
+
     def _marginalizeout(self, keep, remove):
         """Marginalizes the dimensions in remove, keeping all those in keep"""
         # Fit the model to the current data. The data dimension to marginalize over
@@ -76,145 +185,215 @@ class KDEModel(Model):
         return ()
 
     def get_relative_frequency(self, value):
-        value = list(value)
-        occurence = [row == value for row in self.data.values.tolist()]
-        freq = sum(occurence)
-        rel_freq = freq / self.data.shape[0]
-        return rel_freq
+        """Returns the (weighted) relative frequency of the data point `value`, which is a sequence of values of all
+        fields in the order of the data."""
+        if self._frequencies is None:
+            self._frequencies = FrequencyIndex.from_data(self.data, self._weights)
+        return self._frequencies.count(list(value)) / self._frequencies.total
+
+    def _split_idx(self):
+        """Returns the indices of the numerical and the categorical columns of the data."""
+        num_idx = []
+        cat_idx = []
+        for idx, dtype in enumerate(self.data.dtypes):
+            if np.issubdtype(dtype, np.number):
+                num_idx.append(idx)
+            else:
+                cat_idx.append(idx)
+        return num_idx, cat_idx
+
+    def _encode(self, X_cat):
+        """Returns the cell codes of the rows of categorical values `X_cat`, which is a DataFrame or 2d array in
+        order of the categorical fields. Values that do not occur in the data are coded as -1."""
+        if self._index is None:
+            return np.zeros(len(X_cat), dtype=int)
+        X_cat = np.asarray(X_cat, dtype=object).reshape(-1, len(self._index))
+        return self._index.encode_columns(list(X_cat.T), missing=-1)
+
+    def _cell_position(self, cells):
+        """Returns the position of the given cell codes in `self._cells`, and a mask of the cells that occur in the
+        data."""
+        cells = np.asarray(cells, dtype=int)
+        pos = np.minimum(np.searchsorted(self._cells, cells), len(self._cells) - 1)
+        return pos, self._cells[pos] == cells
+
+    def _cell_rows(self, cell):
+        """Returns the indices of the rows of the data in `cell`, which must occur in the data."""
+        pos = np.searchsorted(self._cells, cell)
+        return self._order[self._starts[pos]:self._starts[pos] + self._counts[pos]]
+
+    def _build_kde(self, cell):
+        rows = self._cell_rows(cell)
+        return kb.make_backend(self._num_data[rows], method=self.opts['backend'], tolerance=self.opts['tolerance'],
+                               weights=None if self._weights is None else self._weights[rows])
+
+    def _build_kdes(self, cells):
+        """Builds the backends of all given cells that are not cached yet, in parallel. Returns a dict of cell code
+        to backend."""
+        kdes = {cell: self.kde.get(cell) for cell in cells}
+        missing = [cell for cell, kde in kdes.items() if kde is None]
+        if len(missing) > 1:
+            # building backends is mostly numpy and scipy code, which releases the GIL
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                built = dict(zip(missing, executor.map(self._build_kde, missing)))
+        else:
+            built = {cell: self._build_kde(cell) for cell in missing}
+        for cell, kde in built.items():
+            self.kde[cell] = kde
+        kdes.update(built)
+        return kdes
+
+    def _conditional_kde(self, x_cat):
+        """Returns the backend of the kde of the numerical fields conditional on the values `x_cat` of the categorical
+        fields, and the marginal probability of `x_cat`. The backend is None if `x_cat` does not occur in the data or
+        if there are no numerical fields.
+
+        The backend is built only once and then cached in `self.kde` by the code of the cell of `x_cat`.
+        """
+        cell = self._encode([x_cat])[0]
+        pos, occurs = self._cell_position([cell])
+        if not occurs[0]:
+            return None, 0.0
+        if self._num_data.shape[1] == 0:
+            return None, self._probs[pos[0]]
+        kde = self.kde.get(cell)
+        if kde is None:
+            kde = self._build_kde(cell)
+            self.kde[cell] = kde
+        return kde, self._probs[pos[0]]
 
     def _density(self, x):
         """Returns the density at x"""
-        # Sort x in the same way as the data
-        x_df = pd.DataFrame([x])
-        _, cat_names, num_names = data_import_utils.get_columns_by_dtype(x_df)
-        x_df = x_df[cat_names + num_names]
-        x = x_df.values.tolist()[0]
+        # Sort x in the same way as the data, i.e. categorical values first
+        x_cat = [v for v in x if isinstance(v, str)]
+        x_num = [v for v in x if not isinstance(v, str)]
         # Without numerical variables there is no need for a kde
-        if not num_names:
-            return self.get_relative_frequency(x)
-        else:
-            # Split data into numerical and categorical variables
-            num_idx = []
-            cat_idx = []
-            for idx, dtype in enumerate(self.data.dtypes):
-                if np.issubdtype(dtype, np.number):
-                    num_idx.append(idx)
-                else:
-                    cat_idx.append(idx)
-            x_num = [x[i] for i in num_idx]
-            x_cat = [x[i] for i in cat_idx]
-            # If the necessary kde was already generated before, it can be taken from self.kde
-            if str(x_cat) in self.kde.keys():
-                kde = self.kde[str(x_cat)]
-                x_num = np.reshape(x_num, (1, len(x_num)))
-                cond_density = kde.evaluate(x_num)
-                cat_density = self.marginals[str(x_cat)]
-                density = cond_density * cat_density
-                return density[0]
-            # If the necessary kde was NOT already generated before, it has to be generated and then stored in self.kde
-            else:
-                # Condition numeric data on categorical data
-                cond_data = self.data.copy()
-                for i in cat_idx:
-                    cond_data = cond_data[cond_data.iloc[:, i] == x[i]]
-                # Get density of conditioned model p(num|cat)
-                kde = stats.gaussian_kde(cond_data.iloc[:, num_idx].T)
-                self.kde[str(x_cat)] = kde
-                x_num = np.reshape(x_num, (1, len(x_num)))
-                cond_density = kde.evaluate(x_num)
-                # Get marginal density of categorical variables p(cat)
-                cat_density = len(cond_data)/len(self.data)
-                self.marginals[str(x_cat)] = cat_density
-                # p(num,cat) = p(num|cat) * p(cat)
-                density = cond_density * cat_density
-                return density[0]
-
-    def _negdensity(self, x):
-        return -self._density(x)
-
-    def _maximum(self):
-        """Compute the point of maximum density """
-        # # The problem is not convex, so try different starting points and return the biggest of the found maxima
-        #
-        # # Generate starting points
-        # nr_of_points_per_dim = 20
-        # total_nr_of_points = nr_of_points_per_dim ** len(self.fields)
-        # max_vals = [self.fields[i]['extent'].values()[1] for i in range(len(self.fields))]
-        # min_vals = [self.fields[i]['extent'].values()[0] for i in range(len(self.fields))]
-        # extent_range = [x_max - x_min for x_max, x_min in zip(max_vals, min_vals)]
-        # stepsize = [i/nr_of_points_per_dim for i in extent_range]
-        # stepsize_re = np.reshape(stepsize, (len(stepsize), 1))
-        # points_re = np.reshape(np.arange(nr_of_points_per_dim), (1, nr_of_points_per_dim))
-        # min_vals_re = np.reshape(min_vals, (len(self.fields), 1))
-        # points_per_dim = np.inner(stepsize_re, points_re.T) + min_vals_re
-        # # Perform cross join
-        # starting_points = np.array(np.meshgrid(*points_per_dim)).T.reshape(total_nr_of_points, len(self.fields))
-
-
-        # Get all combinations of categorical values
-        unique_vals = [self.fields[i]['extent'].values() for i in range(len(self._categoricals))]
-        cartesian_prod = list(itertools.product(*unique_vals))
-        if self._numericals:
-            # Solve an optimization problem for each of the values
-            # Set initial values
-            global_max_num = [np.mean(self.data[col]) for col in self._numericals]
-            global_max_cat = list(cartesian_prod[0])
-            global_max_density = 0
-            for cat_val in cartesian_prod:
-                m = self.copy()
-                # Condition on categorical values
-                for i, val in enumerate(cat_val):
-                    m.data = m.data[m.data.iloc[:, i] == val]
-                # kde can't handle datasets with only one row
-                if m.data.shape[0] < 2:
-                    continue
-                m.marginalize(m._numericals)
-                # Solve the optimization problem
-                x0 = [np.mean(m.data[col]) for col in m._numericals]
-                local_max = sciopt.minimize(m._negdensity, x0, method='nelder-mead', options={'xtol': 1e-8, 'disp': False})
-                local_max_cond_density = -local_max.fun
-                local_max_marginal_density = len(m.data)/len(self.data)
-                local_max_joint_density = local_max_cond_density * local_max_marginal_density
-                if local_max_joint_density > global_max_density:
-                    global_max_density = local_max_joint_density
-                    global_max_num = local_max.x.tolist()
-                    global_max_cat = list(cat_val)
-            return global_max_cat + global_max_num
-        else:
-            densities = [self.get_relative_frequency(i) for i in cartesian_prod]
-            idx = densities.index(max(densities))
-            return list(cartesian_prod[idx])
+        if not x_num:
+            return self.get_relative_frequency(x_cat)
+        kde, cat_density = self._conditional_kde(x_cat)
+        if kde is None:
+            return 0.0
+        # p(num,cat) = p(num|cat) * p(cat)
+        return kde.evaluate(np.array(x_num, dtype=float))[0] * cat_density
+
+    def _density_batch(self, X):
+        """Vectorized version of `_density()`. See `Model._density_batch()`.
+
+        The points are grouped by their cell, and each group is evaluated at once by its backend. Missing backends are
+        built in parallel.
+        """
+        num_idx, cat_idx = self._split_idx()
+        if not num_idx:
+            return self._frequencies.count_batch(X) / self._frequencies.total
+        pos, occurs = self._cell_position(self._encode(X.iloc[:, cat_idx].values))
+        densities = np.where(occurs, self._probs[pos], 0.)
+        num = X.iloc[:, num_idx].values.astype(float)
+        cells = self._cells[pos]
+        kdes = self._build_kdes(np.unique(cells[occurs]))
+        for cell, kde in kdes.items():
+            idx = np.flatnonzero(occurs & (cells == cell))
+            densities[idx] *= kde.evaluate(num[idx])
+        return densities
+
+    def _maximum(self, x0=None):
+        """Compute the point of maximum density
+
+        The maximum of the numerical fields is searched for each combination of categorical values that occurs in the
+        data, by mean-shift iteration from many starting points at once (see `kde_backends.ExactBackend.mode()`). The
+        combinations are processed in parallel threads.
+
+        Args:
+            x0: list, optional.
+                A starting point. If given, its numerical part is used as an additional starting point for each
+                combination of categorical values.
+        """
+        cat_len = len(self._index) if self._index is not None else 0
+        if self._num_data.shape[1] == 0:
+            return self._index.decode(self._cells[self._probs.argmax()])
+
+        # kde can't handle datasets with only one row
+        cells = self._cells[self._counts > 1]
+        kdes = self._build_kdes(cells)
+        start = None if x0 is None else np.asarray(x0[cat_len:], dtype=float)
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            maxima = list(executor.map(lambda cell: kdes[cell].mode(start), cells))
+
+        pos, _ = self._cell_position(cells)
+        joint_densities = [density * prob for (_, density), prob in zip(maxima, self._probs[pos])]
+        best = int(np.argmax(joint_densities))
+        global_max_cat = self._index.decode(cells[best]) if self._index is not None else []
+        return global_max_cat + maxima[best][0].tolist()
 
     def _arithmetic_mean(self):
         """Returns the point of the average density"""
         mean = data_aggr.aggregate_data(self.data, 'maximum')
         return mean
 
-    def _sample(self, n):
-        """Returns random point of the distribution"""
-        sample = pd.DataFrame(np.nan, columns=self.data.columns, index=range(n))
-        # Split data into numerical and categorical variables
-        num_idx = []
-        cat_idx = []
-        for idx, dtype in enumerate(self.data.dtypes):
-            if np.issubdtype(dtype, np.number):
-                num_idx.append(idx)
+    def _kernel_cholesky(self, cells):
+        """Returns the Cholesky factors of the covariance matrices of the kernels of the given cells, which must occur
+        in the data, as an array of shape (len(cells), d, d). The factor is 0 for cells of a single row, i.e. their
+        kernel is a point mass."""
+        d = self._num_data.shape[1]
+        factors = np.zeros((len(cells), d, d))
+        for i, cell in enumerate(cells):
+            kde = self.kde.get(cell)
+            rows = self._cell_rows(cell)
+            if kde is not None:
+                covariance = kde.covariance
+            elif len(rows) > 1:
+                covariance = kb.bandwidth_covariance(self._num_data[rows],
+                                                     None if self._weights is None else self._weights[rows])
             else:
-                cat_idx.append(idx)
-        # Build kde
-        if len(num_idx) > 0:
-            kde = stats.gaussian_kde(self.data.iloc[:, num_idx].T)
-            # get samples for numerical dimensions
-            sample.iloc[:, num_idx] = kde.resample(n).T
-        # get samples for categorical dimensions
-        if len(cat_idx) > 0:
-            sample.iloc[:, cat_idx] = self.data.iloc[:, cat_idx].sample(n).values
-        return sample
+                continue
+            factors[i] = np.linalg.cholesky(covariance)
+        return factors
+
+    def _sample(self, n=1):
+        """Returns n random points of the distribution.
+
+        Training rows are drawn according to their weights, and the kernel noise of their cells is added to their
+        numerical values. Hence, the joint distribution of categorical and numerical values is preserved.
+        """
+        N = len(self.data)
+        rows = np.random.choice(N, n, p=None if self._weights is None else self._weights / self._weights.sum())
+        num_idx, cat_idx = self._split_idx()
+        columns = {}
+        for i in cat_idx:
+            columns[self.data.columns[i]] = self.data.iloc[:, i].values.take(rows)
+        if num_idx:
+            # the position of the cell of each drawn row in self._cells
+            row_cells = np.empty(N, dtype=int)
+            row_cells[self._order] = np.repeat(np.arange(len(self._cells)), self._counts)
+            pos = row_cells[rows]
+            used = np.unique(pos)
+            factors = np.zeros((len(self._cells),) + (len(num_idx),) * 2)
+            factors[used] = self._kernel_cholesky(self._cells[used])
+            noise = np.random.standard_normal((n, len(num_idx)))
+            values = self._num_data[rows] + np.einsum('nij,nj->ni', factors[pos], noise)
+            for j, i in enumerate(num_idx):
+                columns[self.data.columns[i]] = values[:, j]
+        return pd.DataFrame(columns, columns=self.data.columns)
+
+    def _memory_components(self):
+        return {'kde': self.kde, 'index': [self._index, self._num_data, self._order, self._cells, self._starts,
+                                           self._counts, self._probs, self._frequencies], 'weights': self._weights,
+                'emp_data': self._emp_data}
 
     def copy(self, name=None):
         name = self.name if name is None else name
         mycopy = self._defaultcopy(name)
-        mycopy.kde = copy.deepcopy(self.kde)
+        mycopy.opts = self.opts.copy()
+        # the cache and the index only depend on the data, which is shared, and are never modified in place
+        mycopy.kde = self.kde
+        mycopy._index = self._index
+        mycopy._num_data = self._num_data
+        mycopy._order = self._order
+        mycopy._cells = self._cells
+        mycopy._starts = self._starts
+        mycopy._counts = self._counts
+        mycopy._probs = self._probs
+        mycopy._frequencies = self._frequencies
+        mycopy._weights = self._weights
         mycopy._emp_data = self._emp_data.copy()
         mycopy._categoricals = self._categoricals.copy()
         mycopy._numericals = self._numericals.copy()
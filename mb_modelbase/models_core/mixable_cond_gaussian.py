@@ -4,14 +4,17 @@ import logging
 import math
 
 import numpy as np
+import pandas as pd
 import xarray as xr
 from numpy import pi, exp, abs
 from numpy.linalg import inv, det
-from scipy.optimize import minimize
 
 from mb_modelbase.models_core import cond_gaussian_wm as cgwm
+from mb_modelbase.models_core import cond_gaussians as cg
 from mb_modelbase.models_core import domains as dm
+from mb_modelbase.models_core import gaussian_kernels as gk
 from mb_modelbase.models_core import models as md
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
 from mb_modelbase.utils import data_import_utils
 from mb_modelbase.utils import no_nan, validate_opts
 from mb_modelbase.utils import utils
@@ -61,13 +64,6 @@ def _maximum_mixable_cg_heuristic_a(cat_len, marg_len, num_len, marginalized_mas
     return _not_masked(coord, marginalized_mask)
 
 
-def _fix_args(fct, *args):
-    """Fixes all but the first positional parameters and returns a function with these parameters fixed.
-    e.g given fct = function of a, b, c it returns a
-    """
-    return lambda x: fct(x,*args)
-
-
 def _density_mixture_cg(num, mu_, invS_, detS_, p_):
     """ Returns the density at num of the mixture of gaussian given by numpy arrays (not xarray)."""
     assert(len(num) > 0)
@@ -78,6 +74,8 @@ def _density_mixture_cg(num, mu_, invS_, detS_, p_):
     # iterate over all at the same time. The reshape is necessary for use of the default iterator.
     gauss_sum = 0
     for p, mu, invS, detS in zip(p_.reshape(n), mu_.reshape(n, m), invS_.reshape(n, m, m), detS_.reshape(n)):
+        if p == 0:
+            continue  # pruned component, see MixableCondGaussianModel._compress
         xmu = num - mu
         gauss = prefactor * detS * exp(-.5 * np.dot(xmu, np.dot(invS, xmu)))
         assert (no_nan(gauss))
@@ -87,45 +85,57 @@ def _density_mixture_cg(num, mu_, invS_, detS_, p_):
     return gauss_sum
 
 
-def _gradient_mixture_cg(x, mu_, invS_, detS_, p_):
-    assert (len(x) > 0)
-    n = p_.size  # number of single gaussians in the cg
-    m = len(x)  # gaussian dimension
-    prefactor = (2 * pi) ** (-m / 2)  # needed several times below
+def _compact_components(p, *params):
+    """Moves the components of weight 0 (e.g. pruned ones) to the end of each mixture and cuts off as many of them
+    as possible.
 
-    gradient_sum = 0
-    for p, mu, invS, detS in zip(p_.reshape(n), mu_.reshape(n, m), invS_.reshape(n, m, m), detS_.reshape(n)):
-        xmu = x - mu
-        common_sub1 = np.dot(invS, xmu)
-        result = (prefactor * (detS ** -.5) * exp(-.5 * np.dot(xmu, common_sub1))) * (-.5 * common_sub1)
-        gradient_sum += p * np.array(result).T[0]
+    Args:
+        p: np.ndarray of shape (C, K)
+            The weights of the K components of each of C mixtures.
+        params: np.ndarray of shape (C, K, ...)
+            Further parameters of the components.
 
-    assert (no_nan(gradient_sum))
-    return gradient_sum
+    Returns: list of np.ndarray
+        p and params, of shape (C, k, ...), where k is the largest number of components of nonzero weight of any
+        mixture, but at least 1.
+    """
+    nonzero = p > 0
+    k = max(int(nonzero.sum(axis=1).max(initial=0)), 1)
+    if k == p.shape[1]:
+        return [p] + list(params)
+    order = np.argsort(~nonzero, axis=1, kind='stable')[:, :k]
+    return [np.take_along_axis(arr, order.reshape(order.shape + (1,) * (arr.ndim - 2)), axis=1)
+            for arr in (p,) + params]
 
 
-def _maximum_cg(mus, Sinvs, Sdets, ps, num_len):
-    """Returns an approximation to the point of maximum of density function and its value as a tuple (argmax, max)."""
+def _log_norm(detS_, num_len):
+    """Returns the log normalizers of gaussians, given their precomputed |det(S)|^-0.5 (see `_update`)."""
+    return np.log(detS_) - num_len / 2 * math.log(2 * pi)
+
 
-    # make functions to calculate density and gradient of mixture
-    p_fct = _fix_args(_density_mixture_cg, mus, Sinvs, Sdets, ps)
-    dp_fct = _fix_args(_gradient_mixture_cg, mus, Sinvs, Sdets, ps)
+def _gradient_mixture_cg(x, mu_, invS_, detS_, p_):
+    """ Returns the gradient at x of the density of the mixture of gaussian given by numpy arrays (not xarray)."""
+    assert (len(x) > 0)
+    n = p_.size  # number of single gaussians in the cg
+    m = len(x)  # gaussian dimension
+    with np.errstate(divide='ignore'):
+        log_p = np.log(p_.reshape(1, n))
+    _, gradient = gk.mixture_gradient(np.asarray(x, dtype=float).reshape(1, m), mu_.reshape(1, n, m),
+                                      invS_.reshape(1, n, m, m), _log_norm(detS_.reshape(1, n), m), log_p)
+    assert (no_nan(gradient))
+    return gradient[0]
 
-    # get maximum over conditional
-    mixture_max = None
-    mixture_maxp = math.inf
 
-    for mu in mus.reshape(-1, num_len):
-        # TODO: fix newton cg: problem: doesn't work for non-scalar optimization problems
-        #cur_density = minimize(lambda x: -p_fct(x), mu, method='Newton-CG', jac=lambda x: -dp_fct(x), tol=1e-6)
-        cur_density = minimize(lambda x: -p_fct(x), mu, method='Nelder-Mead', tol=1e-6)
-        cur_value = cur_density.x
-        cur_density = cur_density.fun
-        if cur_density < mixture_maxp:
-            mixture_maxp = cur_density
-            mixture_max = cur_value
+def _maximum_cg(mus, Sinvs, Sdets, ps, num_len):
+    """Returns an approximation to the point of maximum of density function and its value as a tuple (argmax, max).
 
-    return (mixture_max, -mixture_maxp)
+    The maximum is searched by `gaussian_kernels.mixture_modes`, started at all means of components."""
+    mus = mus.reshape(1, -1, num_len)
+    with np.errstate(divide='ignore'):
+        log_p = np.log(ps.reshape(1, -1))
+    mode, log_density = gk.mixture_modes(mus, mus, Sinvs.reshape(1, -1, num_len, num_len),
+                                         _log_norm(Sdets.reshape(1, -1), num_len), log_p)
+    return mode[0], math.exp(log_density[0])
 
 
 class Normalizer():
@@ -235,6 +245,8 @@ class MixableCondGaussianModel(md.Model):
 
     """
 
+    _exact_marginals = True
+
     _fit_opts_allowed = {
         'fit_algo': set(['clz', 'map', 'full']),
         'normalized': set([True, False]),
@@ -244,7 +256,7 @@ class MixableCondGaussianModel(md.Model):
         super().__init__(name)
         self._aggrMethods = {
             'maximum': self._maximum,
-            'average': self._maximum
+            'average': self._average
         }
         self._categoricals = []  # list of categorical field names, which are not marginalized/conditioned out
         self._numericals = []
@@ -259,6 +271,10 @@ class MixableCondGaussianModel(md.Model):
         # precomputed values to speed up model queries
         self._SInv = xr.DataArray([])
         self._detS = xr.DataArray([])
+        # integer coding of the categorical dimensions of the parameters (incl. marginalized ones)
+        self._index = CategoricalIndex([], [])
+        # parameters prepared for batch queries. see _batch_factors()
+        self._batch_factors_cache = None
         # creates an self contained update function. we use it as a callback function later
         self._unbound_updater = functools.partial(self.__class__._update, self)
 
@@ -345,7 +361,7 @@ class MixableCondGaussianModel(md.Model):
         """Check for some invariants and raise AssertionError if violated, since this represents a severe bug."""
         marg_set = set(self._marginalized)
         cat_set =  set(self._categoricals)
-        p_set = set(self._p.dims) if len(self._p) > 0 else set()
+        p_set = set(self._p.dims) if self._p.size > 0 else set()
         s_set = set(self._S.dims)
         invs_set = set(self._SInv.dims)
         dets_set = set(self._detS.dims)
@@ -378,6 +394,7 @@ class MixableCondGaussianModel(md.Model):
 
     def _update(self):   # mostly like CG WM, but different update for _detS
         """Updates dependent parameters / precalculated values of the model after some internal changes."""
+        self._batch_factors_cache = None
         if self.mode == 'data':
             return self
         if len(self._numericals) == 0:
@@ -398,12 +415,28 @@ class MixableCondGaussianModel(md.Model):
                 self._detS = xr.DataArray(data=detS, coords=self._p.coords, dims=self._p.dims)   # reuse coords from p
 
         if len(self._categoricals) == 0 and len(self._marginalized) == 0:
-            self._p = xr.DataArray([])
+            # a single gaussian is left. Its probability is 1, unless it was pruned, see _zero_mass()
+            self._p = xr.DataArray(0.0) if self._zero_mass() else xr.DataArray([])
+            self._index = CategoricalIndex([], [])
+        else:
+            self._index = CategoricalIndex.from_dataarray(self._p)
 
         self._assert_invariants()
 
         return self
 
+    def _upgrade(self):
+        # models stored by earlier versions lack the integer coding of the categorical dimensions of the parameters
+        if not hasattr(self, '_index'):
+            self._update()
+        return super()._upgrade()
+
+    def _zero_mass(self):
+        """Returns True iff the model has probability 0 everywhere. This is the case if it was conditioned on pruned
+        components only, see `_compress()`. With no categorical field left, such a model stores _p as a scalar 0,
+        instead of an empty array."""
+        return self._p.size > 0 and float(self._p.sum()) == 0
+
     def _update_marginalized(self, cat_marginalized=None, cat_conditioned=None):
         """Updates the marginalized information after some categorical dimensions have been conditioned out.
         Args:
@@ -533,45 +566,41 @@ class MixableCondGaussianModel(md.Model):
         cat_len = len(self._categoricals)
         num_len = len(self._numericals)
         num = np.array(x[cat_len:])  # need as np array for dot product
-        cat = tuple(x[:cat_len])   # need it as a tuple for indexing
+        # dictionary of "categorical-field-name : value" for all given categorical values, and the tuple of integer
+        # codes (and slices for shadowed fields) to index the parameters with.
+        # note: even if cat_len == 0, i.e. the following selections have 'empty cat_dict', it works
+        cat_dict = dict(zip(self._categoricals, x[:cat_len]))
+        cat = self._index.indexer(cat_dict)
 
         if self.opts['normalized']:
             num = self._normalizer.norm(num)
 
         if num_len == 0:
-            if len(self._marginalized) == 0:
-                p = self._p
-            else:
-                p = self._p.sum(self._marginalized)   # sum over marginalized/shadowed fields
-            return p.loc[cat].values
+            # sum over marginalized/shadowed fields
+            return self._p.values[cat].sum()
 
         if len(self._marginalized) == 0:
             # no shadowed/marginalized fields. hence we cannot stack over them and the density query works as "normal"
             # the following is copy-and-pasted from cond_gaussian_wm.py -> _density
-            mu = self._mu.loc[cat].values
-            detS = self._detS.loc[cat].values
-            invS = self._SInv.loc[cat].values
+            mu = self._mu.values[cat]
+            detS = self._detS.values[cat]
+            invS = self._SInv.values[cat]
             xmu = num - mu
             gauss = (2 * pi) ** (-num_len / 2) * detS * exp(-.5 * np.dot(xmu, np.dot(invS, xmu)))
 
             if cat_len == 0:
-                result = gauss
+                result = 0.0 if self._zero_mass() else gauss
             else:
-                p = self._p.loc[cat].values
+                p = self._p.values[cat]
                 result = p * gauss
         else:
-            # dictionary of "categorical-field-name : value" for all given categorical values
-
-            # note: even if cat_len == 0, i.e. the following selections have 'empty cat_dict', it works
-            cat_dict = dict(zip(self._categoricals, cat))
+            # filter mu and sigma by the given categorical values in x, i.e. a view on these arrays
+            mu_shadowed = self._mu.values[cat]
+            invS_shadowed = self._SInv.values[cat]
+            detS_shadowed = self._detS.values[cat]
+            p_shadowed = self._p.values[cat]
 
-            # filter mu and sigma by the given categorical values in x, i.e. a view on these xarrays
-            mu_shadowed = self._mu.loc[cat_dict]
-            invS_shadowed = self._SInv.loc[cat_dict]
-            detS_shadowed = self._detS.loc[cat_dict]
-            p_shadowed = self._p.loc[cat_dict]
-
-            result = _density_mixture_cg(num, mu_shadowed.values, invS_shadowed.values, detS_shadowed.values, p_shadowed.values)
+            result = _density_mixture_cg(num, mu_shadowed, invS_shadowed, detS_shadowed, p_shadowed)
             #return self._density_internal_stacked(num, mu_shadowed, invS_shadowed, detS_shadowed, p_shadowed)
 
             ## vectorized version (instead of alternative 2 code)
@@ -582,7 +611,80 @@ class MixableCondGaussianModel(md.Model):
 
         return result
 
+    def _batch_factors(self):
+        """Returns the parameters of the model prepared for batch density queries, and caches them.
+
+        The parameters are flattened to C cells of the categorical fields, each with K components, one for each
+        combination of values of the marginalized fields. Returned is a dict with:
+
+          * 'index': `CategoricalIndex` of the (not marginalized) categorical fields. It maps values to cells.
+          * 'log_p': log of p, shape (C, K), or, if there is no numerical field, p summed over K, shape (C,)
+          * 'mu': the means, shape (C, K, d)
+          * 'Linv', 'log_norm': see `gaussian_kernels.cholesky_factors`, shapes (C, K, d, d) and (C, K)
+        """
+        factors = getattr(self, '_batch_factors_cache', None)
+        if factors is not None:
+            return factors
+
+        marg = self._marginalized
+        num_len = len(self._numericals)
+        index = self._index.remove(marg)
+        cats = index.dims
+        factors = {'index': index}
+
+        if len(cats) + len(marg) == 0:
+            p = np.zeros((1, 1)) if self._zero_mass() else np.ones((1, 1))
+        else:
+            p = self._p.transpose(*cats, *marg).values.reshape(index.size, -1)
+
+        if num_len == 0:
+            factors['p'] = p.sum(axis=1)
+        else:
+            mu = self._mu.transpose(*cats, *marg, 'mean').values.reshape(p.shape + (num_len,))
+            S = self._S.transpose(*cats, *marg, 'S1', 'S2').values.reshape(p.shape + (num_len, num_len))
+
+            # skip components of zero weight (e.g. pruned ones)
+            p, mu, S = _compact_components(p, mu, S)
+            S[p == 0] = np.eye(num_len)  # keep it positive definite
+            factors['Linv'], factors['log_norm'] = gk.cholesky_factors(S)
+            factors['mu'] = mu
+            with np.errstate(divide='ignore'):
+                factors['log_p'] = np.log(p)
 
+        self._batch_factors_cache = factors
+        return factors
+
+    def _density_batch(self, X):
+        """Vectorized version of `_density()`. See `Model._density_batch()`.
+
+        Categorical values are mapped to integer codes once for the whole batch, and all components of the mixtures
+        of all points are evaluated at once.
+        """
+        cat_len = len(self._categoricals)
+        try:
+            factors = self._batch_factors()
+        except np.linalg.LinAlgError:
+            # some covariance matrix is not positive definite: fall back to the generic density
+            return super()._density_batch(X)
+
+        # map categorical values to the flat index of their cell
+        if cat_len == 0:
+            cell = np.zeros(len(X), dtype=int)
+        else:
+            index = factors['index']
+            cell = index.encode_columns(X[name] for name in index.dims)
+
+        if len(self._numericals) == 0:
+            return factors['p'][cell]
+
+        num = X.iloc[:, cat_len:].values.astype(float)
+        if self.opts['normalized']:
+            norm = self._normalizer
+            num = (num - norm._mean) / norm._stddev
+
+        log_density = gk.mixture_log_density(num, factors['mu'][cell], factors['Linv'][cell], factors['log_norm'][cell],
+                                             factors['log_p'][cell])
+        return np.exp(log_density)
 
     def _maximum_mixable_cg_heuristic_b(self):
         """ Returns an approximation to the point of maximum density.
@@ -619,42 +721,60 @@ class MixableCondGaussianModel(md.Model):
         assert(coord_max is not None)
         return coord_max
 
-    def _maximum_mixable_cg_heuristic_d(self):
-        num_len = len(self._numericals)
-
-        if len(self._categoricals) == 0:
-            # only a single mixture left ... Note: index 0 is for the arg max (and not the max)
-            return _maximum_cg(self._mu.values, self._SInv.values, self._detS.values, self._p.values, num_len)[0]
-
-        mixable_maximum_cat = None
-        mixable_maximum_num = None
-        mixable_maximum_density = -math.inf
-
-        # iterate over conditionals
-        mu_stacked = self._mu.stack(pl_stack=self._categoricals)
-        invS_stacked = self._SInv.stack(pl_stack=self._categoricals)
-        detS_stacked = self._detS.stack(pl_stack=self._categoricals)
-        p_stacked = self._p.stack(pl_stack=self._categoricals)
-
-        for coord in mu_stacked.pl_stack:
-            # extract paramters of mixture of gaussian
-            indexer = dict(pl_stack=coord)
-            mus = mu_stacked.loc[indexer].values
-            Sinvs = invS_stacked.loc[indexer].values
-            Sdets = detS_stacked.loc[indexer].values
-            ps = p_stacked.loc[indexer].values
-
-            mixture_max, mixture_maxp = _maximum_cg(mus, Sinvs, Sdets, ps, num_len)
-
-            if mixable_maximum_density < mixture_maxp:
-                mixable_maximum_density = mixture_maxp
-                mixable_maximum_num = mixture_max
-                mixable_maximum_cat = coord.item()
+    def _maximum_mixable_cg_heuristic_d(self, x0=None):
+        """Returns an approximation to the point of maximum density.
 
-        return list(mixable_maximum_cat) + mixable_maximum_num.tolist()
+        Heuristic "mode of mixtures": each cell of the categorical fields is a mixture of gaussians over the
+        marginalized fields. The modes of all mixtures are found at once by `gaussian_kernels.mixture_modes`, each
+        started at the means of all its components. The mode of largest density is returned.
 
-    def _maximum(self):
+        Args:
+            x0: np.ndarray, optional.
+                A (normalized) starting point for the numerical fields. If given, each mixture is searched only from
+                there, instead of from the means of all its components. None is returned if that search fails, see
+                `gaussian_kernels.warm_mixture_modes`.
+        """
+        cats, marg = self._categoricals, self._marginalized
+        num_len = len(self._numericals)
+        index = self._index.remove(marg)
+        size = index.size
+
+        p = self._p.transpose(*cats, *marg).values.reshape(size, -1)
+        mu = self._mu.transpose(*cats, *marg, 'mean').values.reshape(size, -1, num_len)
+        invS = self._SInv.transpose(*cats, *marg, 'S1', 'S2').values.reshape(size, -1, num_len, num_len)
+        detS = self._detS.transpose(*cats, *marg).values.reshape(size, -1)
+
+        # skip cells of probability 0 and components of weight 0 (e.g. pruned ones)
+        cells = np.flatnonzero(p.sum(axis=1) > 0)
+        if 0 < len(cells) < size:
+            p, mu, invS, detS = p[cells], mu[cells], invS[cells], detS[cells]
+        else:
+            cells = np.arange(size)
+        p, mu, invS, detS = _compact_components(p, mu, invS, detS)
+        log_norm = _log_norm(detS, num_len)
+        with np.errstate(divide='ignore'):
+            log_p = np.log(p)
+
+        if x0 is None:
+            modes, log_density = gk.mixture_modes(mu, mu, invS, log_norm, log_p)
+        else:
+            result = gk.warm_mixture_modes(x0, mu, invS, log_norm, log_p)
+            if result is None:
+                return None
+            modes, log_density = result
+        best = int(log_density.argmax())
+        cat = [] if len(cats) == 0 else \
+            [levels[code] for levels, code in zip(index.levels, np.unravel_index(cells[best], index.shape))]
+        return cat + modes[best].tolist()
+
+    def _maximum(self, x0=None):
+        """Returns the point of maximum density.
 
+        Args:
+            x0: list, optional.
+                A starting point for the search of the maximum. It is a warm start: if the search from x0 fails,
+                the search is restarted cold. It is ignored if the maximum is computed in closed form.
+        """
         cat_len = len(self._categoricals)
         num_len = len(self._numericals)
         mrg_len = len(self._marginalized)
@@ -673,58 +793,182 @@ class MixableCondGaussianModel(md.Model):
             # this is the difficult case, and we don't have a perfect solution yet, just a couple of heuristics...
             # return _maximum_mixable_cg_heuristic_a( cat_len, mrg_len, num_len, self._marginalized_mask, self._mu, self._p, self._detS)
             #result = self._maximum_mixable_cg_heuristic_b()
-            result = self._maximum_mixable_cg_heuristic_d()
+            result = None
+            if x0 is not None:
+                num = np.array(x0[cat_len:], dtype=float)
+                result = self._maximum_mixable_cg_heuristic_d(
+                    x0=self._normalizer.norm(num) if self.opts['normalized'] else num)
+            if result is None:
+                result = self._maximum_mixable_cg_heuristic_d()
 
         assert(result is not None)
         return self._normalizer.denormalize(result) if self.opts['normalized'] else result
 
-    def _sample(self, k):
-        """Returns k sample points"""
-        sample_points = []
+    def _average(self):
+        """Returns the average of this model, i.e. the expectation of the numerical fields and the most probable
+        value of the categorical fields.
+
+        The expectation of a mixture of CG distributions is the weighted sum of the means of its components, hence no
+        optimization is required, in contrast to the maximum.
+        """
+        return self._conditional_average_batch([], pd.DataFrame(index=range(1))).values.tolist()[0]
+
+    def _conditional_average_batch(self, names, X):
+        """Vectorized computation of conditional averages. See `Model._conditional_average_batch()` and
+        `cond_gaussians.conditional_average_cg()`.
+
+        Marginalized categorical fields are simply further components of the mixture.
+        """
+        cats, nums = self._categoricals, self._numericals
+        dims = list(self._index.dims)
+        p = self._p.values if len(dims) > 0 else None
+        mu = self._mu.transpose(*dims, 'mean').values if len(nums) > 0 else None
+        S = self._S.transpose(*dims, 'S1', 'S2').values if len(nums) > 0 else None
+
+        if self.opts['normalized']:
+            norm = self._normalizer
+            X = X.copy()
+            for name in (name for name in nums if name in names):
+                idx = norm._numname2idx[name]
+                X[name] = (X[name] - norm._mean[idx]) / norm._stddev[idx]
+
+        averages = cg.conditional_average_cg(self._index, p, mu, S, cats, nums, names, X)
+
+        if self.opts['normalized']:
+            for name in (name for name in nums if name not in names):
+                idx = norm._numname2idx[name]
+                averages[name] = averages[name] * norm._stddev[idx] + norm._mean[idx]
+        return averages
+
+    def _probability(self, domains):
+        return self._probability_batch(pd.DataFrame([domains], columns=self.names))[0]
+
+    def _probability_batch(self, domains):
+        """Vectorized, exact computation of probabilities. See `Model._probability_batch()` and
+        `cond_gaussians.box_probability_cg()`.
+
+        Marginalized categorical fields are simply further components of the mixture.
+        """
+        cats, nums = self._categoricals, self._numericals
+        dims = list(self._index.dims)
+        if self._zero_mass():
+            return np.zeros(len(domains))
+        cat_domains, lower, upper = cg.split_domains(domains, len(cats))
+        p = self._p.values if len(dims) > 0 else None
+        mu = self._mu.transpose(*dims, 'mean').values if len(nums) > 0 else None
+        S = self._S.transpose(*dims, 'S1', 'S2').values if len(nums) > 0 else None
+
+        if self.opts['normalized'] and len(nums) > 0:
+            norm = self._normalizer
+            idx = [norm._numname2idx[name] for name in nums]
+            lower = (lower - norm._mean[idx]) / norm._stddev[idx]
+            upper = (upper - norm._mean[idx]) / norm._stddev[idx]
+
+        # evaluate the cells of nonzero probability only (e.g. not pruned ones)
+        cells = None
+        if len(dims) > 0 and not (p > 0).all():
+            nonzero = p > 0
+            cells = np.argwhere(nonzero)
+            p = p[nonzero]
+            mu = mu[nonzero] if len(nums) > 0 else None
+            S = S[nonzero] if len(nums) > 0 else None
+
+        return cg.box_probability_cg(self._index, p, mu, S, cats, cat_domains, lower, upper, cells=cells)
+
+    def _gradient(self, x):
+        """Returns the gradient of the density at x with respect to the numerical fields."""
         cat_len = len(self._categoricals)
-        num_len = len(self._numericals)
-        mrg_len = len(self._marginalized)
+        num = np.array(x[cat_len:], dtype=float)
+        cat = self._index.indexer(dict(zip(self._categoricals, x[:cat_len])))
 
-        mu = self._mu
-        S = self._S
-        p = self._p
+        if self.opts['normalized']:
+            num = self._normalizer.norm(num)
 
-        if cat_len + mrg_len == 0:
-            # no categoricals left, hence only a 'normal' multivariate gaussian to draw samples from
-            if num_len > 0:
-                for i in range(0, int(k)):
-                    sample = S.values.dot(np.random.randn(num_len)) + mu.values
-                    sample_points.append(sample.tolist())
+        p = self._p.values[cat] if len(self._index) > 0 else np.full(1, 0.0 if self._zero_mass() else 1.0)
+        gradient = _gradient_mixture_cg(num, self._mu.values[cat], self._SInv.values[cat], self._detS.values[cat], p)
 
-        else:
-            # some categoricals are left
-            cum_dens = utils.cumulative_density(self._p.values)
-            for i in range(0, int(k)):
-                sample_point = []
+        # the density is that of the normalized point, see _density
+        return gradient / self._normalizer._stddev if self.opts['normalized'] else gradient
 
-                # Getting index via inverse transform sampling
-                index = utils.inverse_transform_sampling(cum_dens)
-                sample_cat = np.unravel_index(index, p.shape)
+    def _sample(self, k):
+        """Returns k sample points.
 
-                # Get categoricals
-                cat_dict = p[sample_cat].to_dict()
-                sample_point += [cat_dict['coords'][cat]['data'] for cat in self._categoricals]
+        All categorical cells (including those of marginalized fields) are drawn at once. Then, for each drawn cell,
+        all numerical parts are drawn at once from its Gaussian.
+        """
+        k = int(k)
+        if self._zero_mass():
+            raise ValueError("cannot sample from a model of probability 0")
+        cat_len = len(self._categoricals)
+        num_len = len(self._numericals)
+        dims = list(self._p.dims) if cat_len + len(self._marginalized) > 0 else []
 
-                # Sample from gaussian
-                if num_len > 0:
-                    sample = S[sample_cat].values.dot(np.random.randn(num_len)) + mu[sample_cat].values
-                    # sample = self._S[sample_cat].values.dot(np.random.randn(len(mu[sample_cat]))) + mu[sample_cat].values
-                    sample_point += sample.tolist()
+        # draw cells
+        if len(dims) == 0:
+            cells = np.zeros(k, dtype=int)
+        else:
+            p = self._p.values.ravel()
+            cells = np.random.choice(p.size, size=k, p=p / p.sum())
+
+        # categorical part: only of the not-marginalized fields
+        if cat_len > 0:
+            cell_idxs = np.unravel_index(cells, self._p.shape)
+            cat_parts = []
+            for name in self._categoricals:
+                levels = np.array(self._p.coords[name].values.tolist(), dtype=object)
+                cat_parts.append(levels[cell_idxs[dims.index(name)]])
+            cat_samples = np.column_stack(cat_parts).tolist()
+        else:
+            cat_samples = [[] for _ in range(k)]
 
-                sample_points.append(sample_point)
+        if num_len == 0:
+            return cat_samples
+
+        # numerical part: draw from the Gaussian of each cell, using its Cholesky factor
+        mu = self._mu.transpose(*dims, 'mean').values.reshape(-1, num_len)
+        S = self._S.transpose(*dims, 'S1', 'S2').values.reshape(-1, num_len, num_len)
+        num_samples = np.empty((k, num_len))
+        order = np.argsort(cells, kind='stable')
+        unique_cells, starts, counts = np.unique(cells[order], return_index=True, return_counts=True)
+        for cell, start, count in zip(unique_cells, starts, counts):
+            L = np.linalg.cholesky(S[cell])
+            num_samples[order[start:start + count]] = np.random.randn(count, num_len).dot(L.T) + mu[cell]
 
-        # todo: vectorize denormalization
         if self.opts['normalized']:
-            sample_points = map(lambda p: self._normalizer.denormalize(p), sample_points)
+            num_samples = num_samples * self._normalizer._stddev + self._normalizer._mean
 
-        return sample_points
+        return [c + n for c, n in zip(cat_samples, num_samples.tolist())]
+
+    def _compress(self, tolerance):
+        """Prunes the components (i.e. cells, including those of marginalized fields) of smallest probability.
+
+        Values of marginalized fields whose components are all pruned are removed from the parameters. Other pruned
+        components keep their parameters but get a probability of 0 and are skipped by all queries.
+        """
+        if len(self._categoricals) + len(self._marginalized) == 0:
+            return 0.0
+        p = self._p.values
+        prune = utils.negligible_weights(p, tolerance)
+        removed = p[prune].sum()
+        if removed > 0:
+            p = np.where(prune, 0, p)
+            self._p = self._p.copy(data=p / p.sum())
+            for name in self._marginalized:
+                other = [dim for dim in self._p.dims if dim != name]
+                keep = (self._p.sum(other) > 0).values
+                if not keep.all():
+                    self._p = self._p.isel({name: keep})
+                    if len(self._numericals) > 0:
+                        self._mu = self._mu.isel({name: keep})
+                        self._S = self._S.isel({name: keep})
+            self._update()
+        return removed
 
     # mostly like cg wm
+    def _memory_components(self):
+        return {'parameters': [self._p, self._mu, self._S, self._SInv, self._detS, self._marginalized_mask],
+                'normalizer': self._normalizer}
+
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
         mycopy._mu = self._mu.copy()
@@ -1,7 +1,10 @@
 # Copyright (c) 2017 Philipp Lucas (philipp.lucas@uni-jena.de)
 
 import logging
+import math
+import numpy as np
 
+from mb_modelbase.models_core import gaussian_kernels as gk
 from mb_modelbase.models_core.fixed_mixture_model import FixedMixtureModel
 from mb_modelbase.models_core.cond_gaussian_wm import CgWmModel
 
@@ -47,7 +50,52 @@ class MixtureOfCgWmModel(FixedMixtureModel):
         #     model._update()  # stupid me!!
         # return self._unbound_component_updater,
 
-    _maximum = FixedMixtureModel._maximum_naive_heuristic
+    def _maximum(self, x0=None):
+        """Returns the point of maximum density.
+
+        Each cell of the categorical fields is a mixture of the gaussians of the cell in all components. The modes
+        of all these mixtures are searched at once by `gaussian_kernels.mixture_modes`, started at the means of all
+        components. The mode of largest density is returned.
+
+        Args:
+            x0: list, optional.
+                A starting point. If given, the numerical part of the mode of each cell is searched only from there,
+                and only if that fails (see `gaussian_kernels.warm_mixture_modes`), from the means of all
+                components.
+        """
+        components = list(self)
+        index = components[0]._index
+        dims = index.dims
+        num_len = len(components[0]._numericals)
+
+        # probability of each cell in each component, shape (cells, k)
+        p = np.stack([c._p.transpose(*dims).values.reshape(-1) if len(dims) > 0 else np.ones(1) for c in components],
+                     axis=1)
+        p = p * np.asarray(self.weights, dtype=float)
+
+        if num_len == 0:
+            best = int(p.sum(axis=1).argmax())
+            return [levels[code] for levels, code in zip(index.levels, np.unravel_index(best, index.shape))]
+
+        size = index.size
+        mu = np.stack([c._mu.transpose(*dims, 'mean').values.reshape(size, num_len) for c in components], axis=1)
+        invS = np.stack([c._SInv.transpose(*dims, 'S1', 'S2').values.reshape(size, num_len, num_len)
+                         for c in components], axis=1)
+        # _detS of the components is |det(S)|^-0.5
+        log_norm = np.stack([np.log(c._detS.values).reshape(-1) for c in components], axis=1) \
+            - num_len / 2 * math.log(2 * math.pi)
+        with np.errstate(divide='ignore'):
+            log_p = np.log(p)
+
+        result = None
+        if x0 is not None:
+            result = gk.warm_mixture_modes(np.array(x0[len(dims):], dtype=float), mu, invS, log_norm, log_p)
+        modes, log_density = gk.mixture_modes(mu, mu, invS, log_norm, log_p) if result is None else result
+        best = int(log_density.argmax())
+        cat = [] if len(dims) == 0 else \
+            [levels[code] for levels, code in zip(index.levels, np.unravel_index(best, index.shape))]
+        return cat + modes[best].tolist()
+
 
 def MoCGModelWithK(name, k):
     """Returns an empty Mixture of Cond Gaussians model."""
@@ -2,10 +2,10 @@
 
 import logging
 import math
+import numpy as np
 from sklearn import mixture
-from numpy import matrix
-from scipy.optimize import minimize
 
+from mb_modelbase.models_core import gaussian_kernels as gk
 from mb_modelbase.models_core.fixed_mixture_model import FixedMixtureModel
 from mb_modelbase.models_core.gaussians import MultiVariateGaussianModel
 
@@ -34,46 +34,43 @@ class MixtureOfGaussiansModel(FixedMixtureModel):
 
     def _fit(self):
         # learn model using sklearn
-        sklgmm = mixture.GMM(n_components=self._k, covariance_type='full')
+        sklgmm = mixture.GaussianMixture(n_components=self._k, covariance_type='full')
         sklgmm.fit(self.data)
         mus = sklgmm.means_
-        Sigmas = sklgmm.covars_
+        Sigmas = sklgmm.covariances_
         weights = sklgmm.weights_
 
         # set mean and covar of each component
         for idx, (weight, model) in enumerate(zip(self.weights, self)):
-            model._mu = matrix(mus[idx]).T
-            model._S = matrix(Sigmas[idx])
+            model._mu = mus[idx].copy()
+            model._S = Sigmas[idx].copy()
             self.weights[idx] = weights[idx]
             model._update()  # stupid me!!
         return self._unbound_component_updater,
 
     # _maximum = FixedMixtureModel._maximum_naive_heuristic
 
-    def _maximum(self):
-        # this is another heuristic using the function minimize with Newton-CG from scipy.optimize 
-        maximum = None
-        maximum_density = math.inf
-
-        def neg_density(x):
-            return -self._density(x)
-
-        def neg_gradient(x):
-            return -self._gradient(x)
-
-        for weight, model in zip(self.weights, self):
-            cur_value = model._maximum()
-            cur_density = minimize(neg_density, cur_value, method='Newton-CG', jac=neg_gradient, tol=1e-6)
-            cur_value = cur_density.x
-            cur_density = cur_density.fun
-            if cur_density < maximum_density:
-                maximum = cur_value
-                maximum_density = cur_density
-
-        maximum_density = -maximum_density
-
-        return maximum
-
+    def _maximum(self, x0=None):
+        """Returns the mode of largest density of the mixture. All modes are searched at once by
+        `gaussian_kernels.mixture_modes`, started at the means of all components.
+
+        Args:
+            x0: list, optional.
+                A starting point. If given, the mode is searched only from there, and only if that fails (see
+                `gaussian_kernels.warm_mixture_modes`), from the means of all components.
+        """
+        mu = np.array([model._mu for model in self])
+        S = np.array([model._S for model in self])
+        log_norm = -0.5 * (self.dim * math.log(2 * math.pi) + np.linalg.slogdet(S)[1])
+        with np.errstate(divide='ignore'):
+            log_weights = np.log(np.asarray(self.weights, dtype=float))
+        params = (mu[np.newaxis], np.linalg.inv(S)[np.newaxis], log_norm[np.newaxis], log_weights[np.newaxis])
+        if x0 is not None:
+            result = gk.warm_mixture_modes(np.array(x0, dtype=float), *params)
+            if result is not None:
+                return result[0][0].tolist()
+        maximum, _ = gk.mixture_modes(mu[np.newaxis], *params)
+        return maximum[0].tolist()
 
 
 def MoGModelWithK(name, k):
@@ -0,0 +1,211 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Versioned binary file format for models.
+
+A model file in this format consists of:
+
+  * an 8 byte magic string, followed by the length of the header as an 8 byte little-endian unsigned integer,
+  * a JSON header with the format version, the class, name, mode, fields and history of the model, a SHA-1 hash of
+    the content, and an index of the blocks that follow,
+  * the 'skeleton' of the model: the model pickled with dill, however with all numeric numpy arrays (including those
+    inside of pandas and xarray objects, e.g. the parameters and the data of a model) replaced by references, and
+  * the referenced arrays as raw, aligned, C-contiguous memory blocks.
+
+On load the file is memory mapped (copy-on-write) and the arrays are views into the mapping. Hence, loading is
+nearly instant and processes that load (or are forked after loading) the same model share the physical memory
+of its arrays, as long as they do not modify them. Verifying the hash on load reads the entire file, and is hence
+optional.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+
+import dill
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MBMODEL\n'
+FORMAT_VERSION = 1
+
+# alignment in bytes of blocks in the file
+_ALIGNMENT = 64
+
+# arrays smaller than this many bytes are pickled into the skeleton
+_MIN_ARRAY_BYTES = 256
+
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _is_external(obj):
+    """Returns True iff obj is an array that is to be stored as a raw block instead of in the skeleton."""
+    # subclasses (like np.matrix) would lose their type, object arrays cannot be stored raw
+    return type(obj) is np.ndarray and obj.dtype.kind in 'biufc' and obj.nbytes >= _MIN_ARRAY_BYTES
+
+
+class _ArrayExternalizingPickler(dill.Pickler):
+    """A dill pickler that collects numeric arrays instead of pickling them."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.arrays = []
+        self._array_idx = {}
+
+    def persistent_id(self, obj):
+        if not _is_external(obj):
+            return None
+        idx = self._array_idx.get(id(obj))
+        if idx is None:
+            idx = len(self.arrays)
+            self._array_idx[id(obj)] = idx
+            # keep a reference to obj in self.arrays, such that its id is not reused
+            self.arrays.append(obj)
+        return 'ndarray', idx
+
+
+class _ArrayMappingUnpickler(dill.Unpickler):
+    """A dill unpickler that resolves array references to views of a memory mapped file."""
+
+    def __init__(self, file, buffer, offset, arrays_meta):
+        super().__init__(file)
+        self._buffer = buffer
+        self._offset = offset
+        self._arrays_meta = arrays_meta
+
+    def persistent_load(self, pid):
+        kind, idx = pid
+        if kind != 'ndarray':
+            raise dill.UnpicklingError("unsupported persistent id: {}".format(pid))
+        meta = self._arrays_meta[idx]
+        return np.ndarray(shape=tuple(meta['shape']), dtype=np.dtype(meta['dtype']), buffer=self._buffer,
+                          offset=self._offset + meta['offset'], order='C')
+
+
+def _content_hash(skeleton, arrays):
+    """Returns the hex digest of the SHA-1 hash of the bytes `skeleton` and the C-contiguous `arrays`."""
+    hash_ = hashlib.sha1(skeleton)
+    for arr in arrays:
+        hash_.update(arr.dtype.str.encode())
+        hash_.update(arr.reshape(-1).view(np.uint8))
+    return hash_.hexdigest()
+
+
+def _header_json(model):
+    from mb_modelbase.models_core.models import field_tojson
+    return {
+        'format_version': FORMAT_VERSION,
+        'class': type(model).__module__ + '.' + type(model).__qualname__,
+        'name': model.name,
+        'mode': model.mode,
+        'fields': [field_tojson(field) for field in model.fields],
+        'history': model.history,
+    }
+
+
+def is_binary_model_file(filename):
+    """Returns True iff the file at `filename` is in the binary model format."""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save(model, path):
+    """Stores `model` in the binary model format in a file at `path`.
+
+    The file is written to a temporary file first and then moved to `path`. This way processes that have the
+    former file at `path` memory mapped are not affected.
+
+    Raises:
+        Any error raised while pickling the model. In that case no file is written.
+    """
+    buf = io.BytesIO()
+    pickler = _ArrayExternalizingPickler(buf, dill.HIGHEST_PROTOCOL)
+    pickler.dump(model)
+    skeleton = buf.getvalue()
+
+    # lay out blocks relative to the start of the data section
+    arrays_meta = []
+    offset = _aligned(len(skeleton))
+    arrays = []
+    for arr in pickler.arrays:
+        arr = np.ascontiguousarray(arr)
+        arrays_meta.append({'offset': offset, 'dtype': arr.dtype.str, 'shape': list(arr.shape)})
+        arrays.append(arr)
+        offset = _aligned(offset + arr.nbytes)
+
+    header = _header_json(model)
+    header['hash'] = _content_hash(skeleton, arrays)
+    header['skeleton'] = {'offset': 0, 'length': len(skeleton)}
+    header['arrays'] = arrays_meta
+    header_bytes = json.dumps(header, default=str).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + _HEADER_LENGTH.size + len(header_bytes))
+
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header_bytes)))
+            f.write(header_bytes)
+            f.seek(data_start)
+            f.write(skeleton)
+            for meta, arr in zip(arrays_meta, arrays):
+                f.seek(data_start + meta['offset'])
+                arr.tofile(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_header(filename):
+    """Returns the JSON header of the model stored in the binary model format in the file at `filename`."""
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a file in the binary model format: {}".format(filename))
+        length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+        return json.loads(f.read(length).decode('utf-8'))
+
+
+def load(filename, verify=False):
+    """Loads and returns the model stored in the binary model format in the file at `filename`.
+
+    The arrays of the returned model are copy-on-write views into a memory mapping of the file.
+
+    Args:
+        filename: str
+            The path of the file.
+        verify: bool, optional.
+            If True, the hash of the content is verified. This reads the entire file. Defaults to False.
+
+    Raises:
+        ValueError: if the format version is not supported, or if `verify` is True and the hash does not match.
+    """
+    header = read_header(filename)
+    if header['format_version'] > FORMAT_VERSION:
+        raise ValueError("unsupported format version {} of model file {}. Update the modelbase to load it."
+                         .format(header['format_version'], filename))
+    with open(filename, 'rb') as f:
+        f.seek(len(MAGIC))
+        header_length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    data_start = _aligned(len(MAGIC) + _HEADER_LENGTH.size + header_length)
+
+    buffer = np.memmap(filename, dtype=np.uint8, mode='c')
+    skeleton = header['skeleton']
+    start = data_start + skeleton['offset']
+    skeleton_bytes = buffer[start:start + skeleton['length']].tobytes()
+    if verify:
+        arrays = [np.ndarray(shape=tuple(meta['shape']), dtype=np.dtype(meta['dtype']), buffer=buffer,
+                             offset=data_start + meta['offset'], order='C') for meta in header['arrays']]
+        if _content_hash(skeleton_bytes, arrays) != header['hash']:
+            raise ValueError("hash mismatch: model file {} is corrupt".format(filename))
+    skeleton_bytes = io.BytesIO(skeleton_bytes)
+    unpickler = _ArrayMappingUnpickler(skeleton_bytes, buffer, data_start, header['arrays'])
+    return unpickler.load()
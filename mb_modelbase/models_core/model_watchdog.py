@@ -33,12 +33,24 @@ class ModelWatcher(PatternMatchingEventHandler):
                     src_path = path/to/observer
         :return:
         """
-        if not event.is_directory and event.src_path.rsplit("/", 1)[-1][:-4] not in self.modelbase.list_models():
+        if not event.is_directory:
+            self._load(event.src_path)
+
+    def on_moved(self, event):
+        """
+        Loads models that are moved into the watched folder, e.g. by `Model.save`, which writes to a temporary file
+        first and then renames it.
+        """
+        if not event.is_directory and event.dest_path.endswith(".mdl"):
+            self._load(event.dest_path)
+
+    def _load(self, path):
+        if path.rsplit("/", 1)[-1][:-4] not in self.modelbase.list_models():
             try:
-                model = gm.Model.load(str(event.src_path))
-                logger.info("Loaded model from file {}".format(event.src_path.rsplit("/", 1)[-1]))
+                model = gm.Model.load(str(path))
+                logger.info("Loaded model from file {}".format(path.rsplit("/", 1)[-1]))
             except TypeError as err:
-                logger.warning('file "' + event.src_path.rsplit("/", 1)[-1] +
+                logger.warning('file "' + path.rsplit("/", 1)[-1] +
                                '" matches the naming pattern but does not contain a model instance. '
                                'I ignored that file')
                 logger.exception(err)
@@ -49,9 +61,8 @@ class ModelWatcher(PatternMatchingEventHandler):
             else:
                 self.modelbase.add(model)
         else:
-            if not event.is_directory:
-                logger.info("Ignoring Model. Model with same name already exists".format(event.src_path.rsplit("/", 1)[-1]))
-                logger.info(self.modelbase.list_models())
+            logger.info("Ignoring Model. Model with same name already exists".format(path.rsplit("/", 1)[-1]))
+            logger.info(self.modelbase.list_models())
 
 
 class ModelWatchObserver():
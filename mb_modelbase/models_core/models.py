@@ -11,6 +11,8 @@ It also provides definitions of other essential data types, such as `Field`, `Ag
 
 import copy as cp
 import functools
+import inspect
+import itertools
 import operator
 import dill
 import numpy as np
@@ -31,6 +33,7 @@ from mb_modelbase.models_core import data_aggregation
 from mb_modelbase.models_core import data_operations
 from mb_modelbase.models_core import pci_graph
 from mb_modelbase.models_core import auto_extent
+from mb_modelbase.models_core import model_io
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -162,6 +165,12 @@ class Model:
             A flag that indicates whether certain queries should be executed in parallel on multiple available cores
             or not.
 
+        .warm_start : bool
+
+            A flag that indicates whether maximum aggregations of `.predict()` over a grid of conditioning values
+            are warm-started, i.e. each iterative optimization is seeded with the result of the previous grid point.
+            It only has an effect for model classes whose maximum supports a starting point. See `.aggregate()`.
+
         .pci_graph : None or something
 
 
@@ -269,6 +278,7 @@ class Model:
         Each class may additionally implement a number of other methods:
 
           * _probability()
+          * _density_batch(), _probability_batch(): vectorized versions of _density() and _probability()
           * _generate_model()
 
      Private Attributes:
@@ -285,8 +295,16 @@ class Model:
                  implementation must not supply its own implementation of it.
                  Hence, in your class you should set class methods to the keys 'maximum' and 'average'.
 
+           _exact_marginals : bool, class attribute
+
+                True iff the marginals of the model class are exact, i.e. iff marginalizing and conditioning a model
+                commute. This is not the case for model classes that approximate their marginals, e.g. by moment
+                matching. Defaults to False.
+
     """
 
+    _exact_marginals = False
+
     def __str__(self):
         """Return a string representation."""
         # TODO: add some more useful print out functions / info to that function
@@ -387,7 +405,11 @@ class Model:
         self.mode = None
         self.history = {}
         self.parallel_processing = True
+        self.warm_start = False
         self._empirical_model_name = None
+        # see compress()
+        self.compression_bound = 0.0
+        self.auto_compress = None
 
     def _setempty(self):
         self._update_remove_fields()
@@ -409,6 +431,47 @@ class Model:
         }
         return json
 
+    def memory_footprint(self, seen=None):
+        """Returns the memory occupied by this model in bytes, broken down by component.
+
+        The components 'data', 'test_data' and 'fields' exist for all models. Model classes add their specific
+        components, like parameters or caches, by overriding `_memory_components`. Anything else that is
+        referenced by the model is accounted as 'other'. Objects referenced from multiple components are only
+        accounted once.
+
+        Note that `data` is shared between a model and its copies, hence the footprints of models derived from each
+        other do not add up. Pass the same `seen` set to the calls on multiple models to account shared objects only
+        once.
+
+        Args:
+            seen: set, optional.
+                Set of ids of objects that are already accounted for and are hence ignored. It is updated with the
+                ids of the objects accounted for this model.
+
+        Returns: dict
+            A dict of component name to size in bytes, with an additional key 'total' for the total size.
+        """
+        if seen is None:
+            seen = set()
+        seen.add(id(self))
+        footprint = {
+            'data': utils.deep_sizeof(self.data, seen),
+            'test_data': utils.deep_sizeof(self.test_data, seen),
+            'fields': utils.deep_sizeof(self.fields, seen),
+        }
+        for component, objs in self._memory_components().items():
+            footprint[component] = utils.deep_sizeof(objs, seen)
+        footprint['other'] = utils.deep_sizeof(self.__dict__, seen)
+        footprint['total'] = sum(footprint.values())
+        return footprint
+
+    def _memory_components(self):
+        """Returns a dict of component name to the object(s) that make up that component of the model.
+
+        Overwrite this in subclasses to report model specific components in `memory_footprint`.
+        """
+        return {}
+
     def set_empirical_model_name(self, name):
         self._empirical_model_name = name
 
@@ -774,6 +837,9 @@ class Model:
                 [c() for c in callbacks]
             for name in remove:
                 self.history[name]['marginalized'] = 'marginalized_out'
+
+        if getattr(self, 'auto_compress', None) is not None:
+            self.compress(self.auto_compress)
         return self
 
     def _marginalizeout(self, keep, remove):
@@ -794,6 +860,42 @@ class Model:
         """
         raise NotImplementedError("Implement this method in your model!")
 
+    def compress(self, tolerance):
+        """Compress the model by pruning mixture components of negligible weight.
+
+        Components are pruned in order of increasing weight, as long as their total weight does not exceed
+        `tolerance`, and the remaining weights are renormalized. Hence, the total variation distance between the
+        model before and after compression is bounded by the total weight of the pruned components. This bound is
+        added to the attribute `compression_bound` of the model.
+
+        Set the attribute `auto_compress` of a model to a tolerance to automatically compress it (and all models
+        derived from it) whenever it is marginalized or conditioned. Note that conditioning a compressed model
+        may amplify the error, hence `compression_bound` only accounts for the compressions themselves.
+
+        Only mixture-type models implement compression (see `_compress()`), all other models remain unchanged.
+
+        Args:
+            tolerance: float
+                The maximum total weight of the components to prune. Must be in [0, 1).
+
+        Returns:
+            The modified model.
+        """
+        if not 0 <= tolerance < 1:
+            raise ValueError("invalid tolerance: {}".format(tolerance))
+        if self.mode == 'data' or self._isempty():
+            return self
+        removed = self._compress(tolerance)
+        self.compression_bound = getattr(self, 'compression_bound', 0.0) + removed
+        return self
+
+    def _compress(self, tolerance):
+        """Prune mixture components of total weight at most `tolerance` and return their total weight.
+
+        Reimplement this method in mixture-type models. By default nothing is pruned.
+        """
+        return 0.0
+
     def condition(self, conditions=None, is_pure=False):
         """Condition this model according to the list of three-tuples (<name-of-random-variable>, <operator>,
         <value(s)>). In particular objects of type ConditionTuples are accepted and see there for allowed values.
@@ -817,6 +919,8 @@ class Model:
 
         if isinstance(conditions, tuple):
             conditions = [conditions]
+        # conditions may be any iterable (e.g. a zip), but are used multiple times below
+        conditions = list(conditions)
 
         # TODO: simplify the interface?
 
@@ -838,17 +942,24 @@ class Model:
         # in the future this should be decided by the model itself:
         #  for an emperical model it is always possible to compute the conditional model
         #  for an gaussian model we may compute it for point conditinals right away, but we maybe would not want to do it for range conditionals
-        # TODO: if conditions is a zip: how can it be reused a 2nd and 3rd time below!??
-        # condition data
+        # condition data: all conditions on data columns at once
         if self.mode == 'data' or self.mode == 'both':
-            for condition in conditions:
-                if condition.name in self.data.columns.tolist():
-                    self.data = data_operations.condition_data(self.data, conditions)
-            self.test_data = data_operations.condition_data(self.test_data, conditions)
+            self._condition_data([c for c in conditions if c[0] in self.data.columns])
 
         self._update_extents(names)
         return self
 
+    def _condition_data(self, conditions):
+        """Conditions the training and test data of this model, i.e. keeps only the rows that fulfill all
+        `conditions`.
+
+        Reimplement this method in models that must keep their data unfiltered, e.g. since they condition by
+        re-weighting the data points in `_conditionout()`.
+        """
+        predicate = data_operations.compile_conditions(conditions)
+        self.data = self.data.iloc[np.flatnonzero(predicate(self.data))]
+        self.test_data = self.test_data.iloc[np.flatnonzero(predicate(self.test_data))]
+
     def _conditionout(self, keep, remove):
         """Condition the field with name in `remove` on their available, //not unbounded// domain and
         marginalizes them out.
@@ -1054,8 +1165,11 @@ class Model:
         Args:
             method: string
                 The method how to aggregate. It depends on the model class which methods are available.
-            opts: {}
-                Not used.
+            opts: dict, optional.
+                Options of the aggregation. Supported keys are:
+                  * 'x0': a starting point for the iterative optimization of the aggregation, as a sequence of values
+                    in the order of the fields of the model. It is only used by aggregation methods that accept a
+                    keyword argument `x0`, and ignored otherwise.
         """
 
         # need index to merge results later
@@ -1106,7 +1220,11 @@ class Model:
                 aggr_function = model._aggrMethods[method]
             except KeyError:
                 raise ValueError("Your model does not provide the requested aggregation: '" + method + "'")
-            other_res = aggr_function()
+            kwargs = {}
+            x0 = opts.get('x0') if isinstance(opts, dict) else None
+            if x0 is not None and 'x0' in inspect.signature(aggr_function).parameters:
+                kwargs['x0'] = [x0[idx] for idx in other_idx]  # starting point on the remaining fields
+            other_res = aggr_function(**kwargs)
 
             # 4. clamp to values within domain
             # TODO bug/mistake: should we really clamp?
@@ -1125,7 +1243,7 @@ class Model:
             method: string
                 The method how to aggregate. It depends on the model class which methods are available.
             opts: Any, optional.
-                Additional arguments for the aggregation.
+                Additional arguments for the aggregation. See `.aggregate_model()`.
 
         Hidden fields:
             Any value of a field that is hidden will be removed from the resulting aggregation before returning.
@@ -1174,6 +1292,31 @@ class Model:
 
         return model_res
 
+    def _conditional_average_batch(self, names, X):
+        """Return the averages of the conditional models of this model given the values of the fields `names` in
+        each row of `X`.
+
+        By default this derives the conditional model for each row and aggregates it using method 'average'. Model
+        classes may reimplement this method for a faster, vectorized computation.
+
+        Args:
+            names: list of str
+                The names of the fields to condition on.
+            X: pd.DataFrame
+                The values to condition on, one set of values per row, with columns `names`.
+
+        Returns: pd.DataFrame
+            The averages, one row for each row of `X`, with columns for the remaining fields of the model in their
+            order in the model.
+        """
+        names = list(names)
+        keep = [name for name in self.names if name not in names]
+        results = []
+        for row in X.loc[:, names].itertuples(index=False, name=None):
+            model = self.copy().condition(zip(names, ['=='] * len(names), row)).marginalize(keep=keep)
+            results.append(model.aggregate('average'))
+        return pd.DataFrame(data=results, columns=keep)
+
     def density(self, values=None, names=None):
         """Returns the density at given point.
 
@@ -1262,6 +1405,22 @@ class Model:
         """
         raise NotImplementedError("Implement this method in your model!")
 
+    def _density_batch(self, X):
+        """Return the densities of the model at all points in `X`.
+
+        By default this calls `_density()` for each point. Model classes may reimplement this method for a faster,
+        vectorized computation. The same guarantees as for `_density()` apply to each point of `X`.
+
+        Args:
+            X: pd.DataFrame
+                The points, one per row, with columns in the same order as the fields of the model.
+
+        Returns: np.ndarray
+            The densities, in the order of the rows of `X`.
+        """
+        _density = self._density
+        return np.array([_density(list(x)) for x in X.itertuples(index=False, name=None)], dtype=float)
+
     def probability(self, domains=None, names=None):
         """
         Return the probability of given event.
@@ -1346,12 +1505,25 @@ class Model:
         y = [(high + low) / 2 for low, high in num_domains]
 
         # sum up density over all elements of the cartesian product of the categorical part of the event
-        # TODO: generalize
-        assert (all(len(d) == 1 for d in
-                    cat_domains)), "did not implement the case where categorical domain has more than one element"
-        x = list([d[0] for d in cat_domains])
-        return vol * self._density(x + y)
-        # return vol * self._density(list(cat_domains) + y)
+        cat_domains = [[d] if isinstance(d, str) else d for d in cat_domains]
+        return vol * sum(self._density(list(x) + y) for x in itertools.product(*cat_domains))
+
+    def _probability_batch(self, domains):
+        """Return the probabilities of all events in `domains`.
+
+        By default this calls `_probability()` for each event. Model classes may reimplement this method for a faster,
+        vectorized computation.
+
+        Args:
+            domains: pd.DataFrame
+                The events, one per row, with one domain per field and columns in the same order as the fields of the
+                model.
+
+        Returns: np.ndarray
+            The probabilities, in the order of the rows of `domains`.
+        """
+        _probability = self._probability
+        return np.array([_probability(list(d)) for d in domains.itertuples(index=False, name=None)], dtype=float)
 
     def sample(self, n=1):
         """Returns n samples drawn from the model as a dataframe with suitable column names.
@@ -1411,6 +1583,9 @@ class Model:
         mycopy._update_all_field_derivatives()
         mycopy.history = cp.deepcopy(self.history)
         mycopy.parallel_processing = self.parallel_processing
+        mycopy.warm_start = getattr(self, 'warm_start', False)
+        mycopy.compression_bound = getattr(self, 'compression_bound', 0.0)
+        mycopy.auto_compress = getattr(self, 'auto_compress', None)
         return mycopy
 
     def _condition_values(self, names=None, pairflag=False, to_scalar=True):
@@ -1456,7 +1631,7 @@ class Model:
         """Returns default filename of model for saving."""
         return self.name + ".mdl"
 
-    def save(self, dir, filename=None):
+    def save(self, dir, filename=None, format='binary'):
         """Store the model to a file at `filename`.
 
         Args:
@@ -1464,12 +1639,27 @@ class Model:
                 Path to folder where to save the model
             filename: string, optional.
                 Name of file (without path) where to save model. Defaults to self._default_filename().
+            format: string, optional.
+                The file format, one of:
+                  * 'binary': the versioned binary model format of `model_io`. Its parameter and data arrays are
+                    memory mapped on load. Models that cannot be stored in this format are stored as 'dill'.
+                  * 'dill': the model is pickled with dill.
+                Defaults to 'binary'.
 
         You can load a stored model using `Model.load()`.
         """
+        if format not in ['binary', 'dill']:
+            raise ValueError("invalid format: {}".format(format))
         if filename is None:
             filename = self._default_filename()
         path = os.path.join(dir, filename)
+        if format == 'binary':
+            try:
+                model_io.save(self, path)
+                return path
+            except Exception as err:
+                logger.warning("cannot store model '{}' in binary format ({}). Falling back to dill."
+                               .format(self.name, repr(err)))
         with open(path, 'wb') as output:
             dill.dump(self, output, dill.HIGHEST_PROTOCOL)
         return path
@@ -1483,16 +1673,37 @@ class Model:
         model.save(dir, *args, **kwargs)
 
     @staticmethod
-    def load(filename):
+    def load(filename, verify=False):
         """Load the model in file at `filename`.
 
+        Both, files in the binary model format and dill-pickled files are supported. The format is detected
+        automatically. If `verify` is True, the integrity of a file in the binary model format is verified by its
+        hash, see `model_io.load()`. Models stored by an earlier version of the modelbase are upgraded, see
+        `Model._upgrade()`.
+
         You can store a stored model using `Model.store()`.
         """
-        with open(filename, 'rb') as input:
-            model = dill.load(input)
-            if not isinstance(model, Model):
-                raise TypeError('pickled input is not an instance of Model.')
-            return model
+        if model_io.is_binary_model_file(filename):
+            model = model_io.load(filename, verify)
+        else:
+            with open(filename, 'rb') as input:
+                model = dill.load(input)
+        if not isinstance(model, Model):
+            raise TypeError('pickled input is not an instance of Model.')
+        return model._upgrade()
+
+    def _upgrade(self):
+        """Upgrades this model after it was loaded from a file, which may have been stored by an earlier version of
+        the modelbase. Such a model lacks the attributes that were introduced since, hence they are set to their
+        defaults, and derived state that was introduced since is rebuilt.
+
+        Reimplement this method to upgrade the attributes of a particular model class. It must not change a model
+        that is up to date, and must return the model.
+        """
+        for attr, default in [('warm_start', False), ('compression_bound', 0.0), ('auto_compress', None)]:
+            if not hasattr(self, attr):
+                setattr(self, attr, default)
+        return self
 
     def _fields_set_empty(self):
         self.fields = []
@@ -1899,7 +2110,10 @@ class Model:
             selected_data = cond_model.sample(n)
         else:
             df = self.data if opts['data_category'] == 'training data' else self.test_data
-            selected_data = data_operations.condition_data(df, where).loc[:, what]
+            columns = df.columns.get_indexer(what)
+            if (columns == -1).any():
+                raise KeyError('at least one of ' + str(what) + ' is not a column label of the data.')
+            selected_data = df.iloc[data_operations.condition_index(df, where), columns]
 
         # limit number of returned data points if requested
         if 'data_point_limit' in opts:
@@ -686,10 +686,14 @@ def aggr_density_probability_inner(model, method, input_data):
     Returns: list
         The probability/density values.
     """
+    from mb_modelbase.models_core.models import Model  # avoid circular import
     results = []
     if method == 'density':
         assert(model.names == list(input_data.columns))
-        if model.parallel_processing:
+        if model._hidden_count == 0 and type(model)._density_batch is not Model._density_batch:
+            # the model has a vectorized implementation
+            results = model._density_batch(input_data).tolist()
+        elif model.parallel_processing:
             with mp.Pool() as p:
                 results = p.map(model.density, input_data.itertuples(index=False, name=None))
         else:  # Non-parallel execution
@@ -702,7 +706,11 @@ def aggr_density_probability_inner(model, method, input_data):
         assert (method == 'probability')
         _probability = model.probability
         _input_tuples = input_data.itertuples(index=False, name=None)
-        if model.parallel_processing:
+        if model._hidden_count == 0 and type(model)._probability_batch is not Model._probability_batch:
+            # the model has a vectorized implementation
+            assert (model.names == list(input_data.columns))
+            results = model._probability_batch(input_data).tolist()
+        elif model.parallel_processing:
             with mp.Pool() as p:
                 results = p.map(_probability, _input_tuples)
         else:
@@ -715,6 +723,26 @@ def aggr_density_probability_inner(model, method, input_data):
     return results
 
 
+def _has_conditional_average_batch(model, aggr, cond_out_names, cond_out_ops, name2split):
+    """Return True iff the conditional averages of `aggr` can be computed by a single call to
+    `model._conditional_average_batch()`, i.e. iff the model class implements it and it would give the same result as
+    deriving a conditional model for each row of input.
+
+    The batch computation marginalizes the model before conditioning it, whereas a conditional model for a row is
+    conditioned before it is marginalized. Hence, if fields are to be marginalized, the marginals of the model class
+    must be exact.
+    """
+    from mb_modelbase.models_core.models import Model  # avoid circular import
+    return (aggr[METHOD_IDX] == 'average'
+            and type(model)._conditional_average_batch is not Model._conditional_average_batch
+            and model._hidden_count == 0
+            and (model._exact_marginals or set(aggr[NAME_IDX]) | set(cond_out_names) == set(model.names))
+            and aggr[YIELDS_IDX] not in cond_out_names
+            and all(op == '==' or name2split[name]['down_cast_fct'] is not None
+                    for name, op in zip(cond_out_names, cond_out_ops))
+            and not any(field['domain'].isbounded() for field in model.fields))
+
+
 def aggregate_maximum_or_average(model, aggr, partial_data, split_series_dict, name2split, aggr_id='aggr_id'):
     """Compute maximum or average aggregation `aggr` for `model` on given data.
 
@@ -747,6 +775,18 @@ def aggregate_maximum_or_average(model, aggr, partial_data, split_series_dict, n
         i = model.asindex(aggr[YIELDS_IDX])  # reduce to requested field
         results.append(res[i])
 
+    elif _has_conditional_average_batch(model, aggr, cond_out_names, cond_out_ops, name2split):
+        # the model computes all conditional averages at once. conditioning on a domain is, like for a conditional
+        # model, conditioning on its mid
+        cond_values = cond_out_data.copy()
+        for name, op in zip(cond_out_names, cond_out_ops):
+            if op != '==':
+                cond_values[name] = cond_values[name].apply(name2split[name]['down_cast_fct'])
+        keep = set(aggr[NAME_IDX]) | set(cond_out_names)
+        batch_model = model if keep == set(model.names) else model.copy().marginalize(keep=keep)
+        averages = batch_model._conditional_average_batch(list(cond_out_names), cond_values)
+        results = averages[aggr[YIELDS_IDX]].tolist()
+
     else:
         row_id_gen = utils.linear_id_generator(prefix="_row")
         rowmodel_name = model.name + next(row_id_gen)
@@ -764,7 +804,20 @@ def aggregate_maximum_or_average(model, aggr, partial_data, split_series_dict, n
 
         _input_tuples = cond_out_data.itertuples(index=False, name=None)
 
-        if model.parallel_processing:
+        if model.warm_start and aggr[METHOD_IDX] == 'maximum' and model._hidden_count == 0:
+            # evaluate rows in grid order and seed the optimization of each row with the solution of the previous
+            # row. This is inherently sequential.
+            opts = aggr[ARGS_IDX + 1]
+            opts = dict(opts) if isinstance(opts, dict) else {}
+            for row in _input_tuples:
+                rowmodel = model\
+                    .copy(name=rowmodel_name)\
+                    .condition(zip(cond_out_names, cond_out_ops, row))\
+                    .marginalize(keep=aggr[NAME_IDX])
+                res = rowmodel.aggregate(aggr[METHOD_IDX], opts=opts)
+                opts['x0'] = res
+                results.append(res[rowmodel.asindex(aggr[YIELDS_IDX])])
+        elif model.parallel_processing:
             with mp_dill.Pool() as p:
                 results = p.map(pred_max_func, _input_tuples)
         else:
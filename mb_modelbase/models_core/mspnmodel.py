@@ -158,9 +158,14 @@ class MSPNModel(Model):
 
     # calculated iterations times the maximum and returns the position
     # with the highest densitiy value
-    def _maximum(self,steps=3):
+    def _maximum(self, steps=3, x0=None):
         fun = lambda x: -1 * self._density(x)
         xmax = None
+        if x0 is not None:
+            # warm start from x0, and only if that fails start from a lot of start vectors
+            xopt = minimize(fun, x0, method='Nelder-Mead')
+            if xopt.success and np.isfinite(xopt.x).all() and xopt.fun < 0:
+                return xopt.x
         #there should be a lot of start vectors
         for x0 in self._getStartVectors(steps):
             #print(x0)
@@ -2,9 +2,6 @@
 """
 @author: Philipp Lucas
 """
-#from mb_modelbase.models_core import Model
-from CGmodelselection.graph import get_graph_from_data
-
 from mb_modelbase.utils import update_opts
 
 
@@ -25,6 +22,8 @@ def create(df, **kwargs):
     }
     opts = update_opts(default_create_opts, kwargs, valid_create_opts)
 
+    # import lazily, since CGmodelselection is costly to import and only needed here
+    from CGmodelselection.graph import get_graph_from_data
     grpnormmat, graph, dlegend = get_graph_from_data(df, **opts)
     return {
         "weight_matrix": grpnormmat,
@@ -298,6 +298,9 @@ class ProbabilisticPymc3Model(Model):
         self.check_data_and_shared_vars_on_equality()
         return sample
 
+    def _memory_components(self):
+        return {'samples': self.samples}
+
     def copy(self, name=None):
         name = self.name if name is None else name
         # Note: The shared_vars attribute is not copied. Rather, the same shared_vars object is
@@ -0,0 +1,179 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Counting of data points in boxes.
+
+The empirical probability of an event is the relative frequency of the data points in it. Events are boxes: a set
+of values for each categorical field and an interval for each numerical field. Masking all data points for each event
+costs O(n) per event, which is slow for many events, e.g. the cells of a probability heatmap. A `RangeCountIndex`
+answers batches of such queries by binary search on prefix sums instead.
+"""
+import numpy as np
+
+# the maximum number of cells of a two-dimensional grid of cumulative counts
+_MAX_GRID_SIZE = 2**22
+
+
+class _Cumulative1d:
+    """Counts of the points in intervals from the prefix sums of the sorted values. O(log n) per query."""
+
+    def __init__(self, values, counts):
+        order = np.argsort(values[:, 0], kind='stable')
+        self.values = values[order, 0]
+        self.cumulative = np.concatenate([[0], np.cumsum(counts[order])])
+
+    def count(self, lower, upper):
+        return self.cumulative[np.searchsorted(self.values, upper[:, 0], side='right')] - \
+            self.cumulative[np.searchsorted(self.values, lower[:, 0], side='left')]
+
+
+class _Cumulative2d:
+    """Counts of the points in rectangles from a grid of cumulative counts on the distinct values of each dimension.
+    O(log n) per query."""
+
+    def __init__(self, values, counts):
+        self.xs, x = np.unique(values[:, 0], return_inverse=True)
+        self.ys, y = np.unique(values[:, 1], return_inverse=True)
+        grid = np.zeros((len(self.xs) + 1, len(self.ys) + 1), dtype=counts.dtype)
+        np.add.at(grid, (x.ravel() + 1, y.ravel() + 1), counts)
+        self.cumulative = grid.cumsum(axis=0).cumsum(axis=1)
+
+    def count(self, lower, upper):
+        x0 = np.searchsorted(self.xs, lower[:, 0], side='left')
+        x1 = np.searchsorted(self.xs, upper[:, 0], side='right')
+        y0 = np.searchsorted(self.ys, lower[:, 1], side='left')
+        y1 = np.searchsorted(self.ys, upper[:, 1], side='right')
+        c = self.cumulative
+        return c[x1, y1] - c[x0, y1] - c[x1, y0] + c[x0, y0]
+
+
+class _Sorted:
+    """Counts of the points in boxes by binary search on the first dimension and masking of the points in that range
+    on the other dimensions. O(log n + k) per query, where k is the number of points in the range of the first
+    dimension."""
+
+    def __init__(self, values, counts):
+        order = np.argsort(values[:, 0], kind='stable')
+        self.values = values[order]
+        self.counts = counts[order]
+
+    def count(self, lower, upper):
+        start = np.searchsorted(self.values[:, 0], lower[:, 0], side='left')
+        stop = np.searchsorted(self.values[:, 0], upper[:, 0], side='right')
+        result = np.zeros(len(lower), dtype=self.counts.dtype)
+        for q in np.flatnonzero(stop > start):
+            values = self.values[start[q]:stop[q], 1:]
+            inside = ((values >= lower[q, 1:]) & (values <= upper[q, 1:])).all(axis=1)
+            result[q] = self.counts[start[q]:stop[q]][inside].sum()
+        return result
+
+
+class _Total:
+    """Counts of the points without numerical dimensions."""
+
+    def __init__(self, values, counts):
+        self.total = counts.sum()
+
+    def count(self, lower, upper):
+        return np.full(len(lower), self.total)
+
+
+class RangeCountIndex:
+    """An index to count the data points in boxes.
+
+    The distinct data points of a `FrequencyIndex` are grouped by their categorical values (cells). The points of each
+    cell are stored in a structure that depends on the number of numerical dimensions:
+
+      * one: the sorted values with prefix sums of the counts,
+      * two: a grid of cumulative counts on the distinct values of each dimension, if it has at most `max_grid_size`
+        cells,
+      * otherwise: the points sorted by the first dimension.
+
+    Args:
+        frequencies: FrequencyIndex
+            The distinct data points and their frequencies.
+        max_grid_size: int, optional.
+            The maximum size of a grid of cumulative counts.
+    """
+
+    def __init__(self, frequencies, max_grid_size=_MAX_GRID_SIZE):
+        self.names = frequencies.names
+        self.total = frequencies.total
+        self._categorical = [not np.issubdtype(levels.dtype, np.number) for levels in frequencies.levels]
+        cat_idx = [i for i, categorical in enumerate(self._categorical) if categorical]
+        num_idx = [i for i, categorical in enumerate(self._categorical) if not categorical]
+        self._levels = [frequencies.levels[i] for i in cat_idx]
+
+        # the numerical values of the distinct data points
+        codes = frequencies.codes
+        values = np.stack([frequencies.levels[i][codes[:, i]] for i in num_idx], axis=1).astype(float) \
+            if num_idx else np.zeros((len(codes), 0))
+
+        # group by cell
+        if len(codes) == 0:
+            self._cells = np.zeros((0, len(cat_idx)), dtype=int)
+            cell_of_point = np.zeros(0, dtype=int)
+        elif cat_idx:
+            self._cells, cell_of_point = np.unique(codes[:, cat_idx], axis=0, return_inverse=True)
+            cell_of_point = cell_of_point.ravel()
+        else:
+            self._cells = np.zeros((1, 0), dtype=int)
+            cell_of_point = np.zeros(len(codes), dtype=int)
+
+        self._counters = []
+        for cell in range(len(self._cells)):
+            mask = cell_of_point == cell
+            cell_values, cell_counts = values[mask], frequencies.counts[mask]
+            if len(num_idx) == 0:
+                counter = _Total
+            elif len(num_idx) == 1:
+                counter = _Cumulative1d
+            elif len(num_idx) == 2 and \
+                    (len(np.unique(cell_values[:, 0])) + 1) * (len(np.unique(cell_values[:, 1])) + 1) <= max_grid_size:
+                counter = _Cumulative2d
+            else:
+                counter = _Sorted
+            self._counters.append(counter(cell_values, cell_counts))
+
+    def count(self, domains):
+        """Returns the number of data points in each of the boxes `domains`.
+
+        Args:
+            domains: sequence of sequence
+                The boxes, one per element. Each box is a sequence of domains in the order of `names`. The domain of a
+                categorical dimension is a sequence of values, and that of a numerical dimension is an interval
+                [lower, upper] (both inclusive) or a sequence of a single value.
+
+        Returns: np.ndarray
+            The counts, in the order of `domains`.
+        """
+        Q = len(domains)
+        lower, upper, allowed = [], [], np.ones((Q, len(self._cells)), dtype=bool)
+        cat = 0
+        for i, categorical in enumerate(self._categorical):
+            column = [domain[i] for domain in domains]
+            if categorical:
+                codes = self._cells[:, cat]
+                levels = self._levels[cat]
+                allowed &= np.array([np.isin(levels, list(domain))[codes] for domain in column]).reshape(Q, -1)
+                cat += 1
+            else:
+                bounds = np.array([[domain[0], domain[-1]] for domain in column], dtype=float).reshape(Q, 2)
+                lower.append(bounds[:, 0])
+                upper.append(bounds[:, 1])
+        lower = np.stack(lower, axis=1) if lower else np.zeros((Q, 0))
+        upper = np.stack(upper, axis=1) if upper else np.zeros((Q, 0))
+
+        counts = np.zeros(Q, dtype=np.result_type(self.total, int))
+        for cell, counter in enumerate(self._counters):
+            queries = np.flatnonzero(allowed[:, cell])
+            if len(queries) > 0:
+                counts[queries] += counter.count(lower[queries], upper[queries])
+        return counts
+
+    def probability(self, domains):
+        """Returns the relative frequency of the data points in each of the boxes `domains`. See `count()`."""
+        if self.total == 0:
+            return np.zeros(len(domains))
+        return self.count(domains) / self.total
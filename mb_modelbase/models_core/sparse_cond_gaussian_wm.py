@@ -0,0 +1,353 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+A conditional gaussian model with weak marginals and sparse parameter storage.
+"""
+import functools
+import logging
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from mb_modelbase.models_core import models as md
+from mb_modelbase.models_core import cond_gaussians as cg
+from mb_modelbase.models_core import gaussian_kernels as gk
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
+
+def _group_cells(cells):
+    """Returns the unique rows of the integer array `cells` and for each row of `cells` the index of its unique
+    row."""
+    if cells.shape[1] == 0:
+        return cells[:1], np.zeros(len(cells), dtype=int)
+    unique, inverse = np.unique(cells, axis=0, return_inverse=True)
+    return unique, inverse.reshape(-1)
+
+
+class SparseCgWmModel(md.Model):
+    """A conditional gaussian model with weak marginals that only stores the parameters of cells with non-negligible
+    probability.
+
+    Like `CgWmModel` it is a conditional gaussian (CG) model and derives marginals by weak marginalization. However,
+    `CgWmModel` stores dense parameters over the full cartesian product of the values of the categorical fields.
+    Hence, its memory and the cost of conditioning grows exponentially with the number of categorical fields, even
+    if most combinations of values (cells) never occur in the data. This model instead stores a list of cells.
+
+    On fitting, a cell is created for every combination of categorical values that occurs in the data, with the
+    maximum likelihood estimate of its probability. Note, that this is a difference to `CgWmModel`, which applies
+    laplacian smoothing: the density of any cell that does not occur in the data is 0. Cells whose probability drops
+    below the option 'tolerance' (default 1e-12) by conditioning are pruned.
+
+    Internal:
+        Assume m categorical and n numerical fields and C cells.
+
+            _index:
+                `CategoricalIndex` of the categorical fields. It maps their values to integer codes.
+            _cells:
+                np.ndarray of shape (C, m). The codes of the values of the categorical fields of each cell.
+            _p:
+                np.ndarray of shape (C,). The probability of each cell.
+            _mu:
+                np.ndarray of shape (C, n). The mean of the gaussian of each cell.
+            _S:
+                np.ndarray of shape (C, n, n). The covariance matrix of the gaussian of each cell.
+
+        Precomputed on update:
+            _keys:
+                np.ndarray of shape (C,). Flat index of each cell with respect to _index. Cells are sorted by it.
+            _key2row:
+                dict of flat index to row of a cell.
+            _Linv, _log_norm:
+                see `gaussian_kernels.cholesky_factors()`
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._aggrMethods = {
+            'maximum': self._maximum,
+            'average': self._average
+        }
+        self._categoricals = []
+        self._numericals = []
+        self._index = CategoricalIndex([], [])
+        self._cells = np.zeros((0, 0), dtype=int)
+        self._p = np.array([])
+        self._mu = np.zeros((0, 0))
+        self._S = np.zeros((0, 0, 0))
+        self._keys = np.array([], dtype=int)
+        self._key2row = {}
+        self._Linv = np.zeros((0, 0, 0))
+        self._log_norm = np.array([])
+        self.opts = {
+            'tolerance': 1e-12,
+        }
+        # creates an self contained update function. we use it as a callback function later
+        self._unbound_updater = functools.partial(self.__class__._update, self)
+
+    def _set_data(self, df, drop_silently, **kwargs):
+        self._set_data_mixed(df, drop_silently)
+        return ()
+
+    def _fit(self, **kwargs):
+        assert (self.mode != 'none')
+        if 'tolerance' in kwargs:
+            tolerance = kwargs['tolerance']
+            if not 0 <= tolerance < 1:
+                raise ValueError("invalid value for tolerance: {}".format(tolerance))
+            self.opts['tolerance'] = tolerance
+
+        df = self.data
+        cat_len = len(self._categoricals)
+        self._index = CategoricalIndex(self._categoricals, [f['extent'].value() for f in self.fields[:cat_len]])
+
+        # group data by cells
+        codes = np.column_stack([pd.Categorical(df[name], categories=levels).codes.astype(int)
+                                 for name, levels in zip(self._index.dims, self._index.levels)] +
+                                [np.zeros((len(df), 0), dtype=int)])
+        self._cells, inverse = _group_cells(codes)
+        counts = np.bincount(inverse, minlength=len(self._cells))
+        self._p = counts / len(df)
+
+        # individual means, but a common covariance matrix for all cells, like in `CgWmModel`
+        num = df[self._numericals].values.astype(float)
+        mu = np.zeros((len(self._cells), num.shape[1]))
+        np.add.at(mu, inverse, num)
+        self._mu = mu / counts[:, np.newaxis]
+        residuals = num - self._mu[inverse]
+        S = residuals.T.dot(residuals) / len(df)
+        self._S = np.repeat(S[np.newaxis], len(self._cells), axis=0)
+
+        return self._unbound_updater,
+
+    def _update(self):
+        """Updates dependent parameters / precalculated values of the model after some internal changes."""
+        if self.mode == 'data':
+            return self
+
+        keys = self._cells.dot(self._index.strides) if len(self._index) > 0 else np.zeros(len(self._p), dtype=int)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._cells = self._cells[order]
+        self._p = self._p[order]
+        self._mu = self._mu[order]
+        self._S = self._S[order]
+        self._key2row = {key: row for row, key in enumerate(self._keys.tolist())}
+
+        if len(self._numericals) > 0:
+            self._Linv, self._log_norm = gk.cholesky_factors(self._S)
+        else:
+            self._Linv, self._log_norm = np.zeros((len(self._p), 0, 0)), np.zeros(len(self._p))
+
+        assert not np.isnan(self._p).any()
+        assert not np.isnan(self._mu).any()
+        return self
+
+    def _prune(self):
+        """Removes all cells with probability below the tolerance and renormalizes p."""
+        keep = self._p >= self.opts['tolerance']
+        if not keep.any():
+            raise ValueError("cannot derive model: all cells have negligible probability")
+        if not keep.all():
+            self._cells, self._p, self._mu, self._S = \
+                self._cells[keep], self._p[keep], self._mu[keep], self._S[keep]
+        self._p = self._p / self._p.sum()
+
+    def _marginalizeout(self, keep, remove):
+        keep = set(keep)
+        num_keep = [i for i, name in enumerate(self._numericals) if name in keep]
+        cat_keep = [i for i, name in enumerate(self._categoricals) if name in keep]
+
+        # numerical fields: slice out the gaussian part to keep
+        mu = self._mu[:, num_keep]
+        S = self._S[:, num_keep][:, :, num_keep]
+
+        # categorical fields: weak marginals, i.e. merge all cells that only differ in the removed fields into the
+        # best cg approximation of their mixture
+        if len(cat_keep) < len(self._categoricals):
+            p = self._p
+            cells, inverse = _group_cells(self._cells[:, cat_keep])
+            p_new = np.bincount(inverse, weights=p, minlength=len(cells))
+            mu_new = np.zeros((len(cells), mu.shape[1]))
+            np.add.at(mu_new, inverse, p[:, np.newaxis] * mu)
+            mu_new /= p_new[:, np.newaxis]
+            diff = mu - mu_new[inverse]
+            S_new = np.zeros((len(cells),) + S.shape[1:])
+            np.add.at(S_new, inverse, p[:, np.newaxis, np.newaxis] * (S + np.einsum('ci,cj->cij', diff, diff)))
+            S_new /= p_new[:, np.newaxis, np.newaxis]
+
+            self._cells, self._p, mu, S = cells, p_new, mu_new, S_new
+            self._index = self._index.remove([name for i, name in enumerate(self._categoricals) if i not in cat_keep])
+
+        self._mu, self._S = mu, S
+        self._categoricals = [self._categoricals[i] for i in cat_keep]
+        self._numericals = [self._numericals[i] for i in num_keep]
+        return self._unbound_updater,
+
+    def _conditionout_categorical(self, cat_remove):
+        pairs = dict(self._condition_values(names=cat_remove, pairflag=True))
+        mask = np.ones(len(self._p), dtype=bool)
+        for name, value in pairs.items():
+            mask &= self._cells[:, self._index.axis[name]] == self._index.code(name, value)
+        if not mask.any():
+            raise ValueError("cannot condition on an event of zero probability: {}".format(pairs))
+
+        cat_keep = [i for i, name in enumerate(self._categoricals) if name not in pairs]
+        self._cells = self._cells[mask][:, cat_keep]
+        self._p = self._p[mask] / self._p[mask].sum()
+        self._mu = self._mu[mask]
+        self._S = self._S[mask]
+        self._index = self._index.remove(cat_remove)
+        self._categoricals = [self._categoricals[i] for i in cat_keep]
+
+    def _conditionout_continuous(self, num_remove):
+        y = np.array(self._condition_values(num_remove), dtype=float)
+        j = [i for i, name in enumerate(self._numericals) if name in num_remove]
+        i = [i for i, name in enumerate(self._numericals) if name not in num_remove]
+        mu, S = self._mu, self._S
+
+        # reweight cells by the density of their gaussian at the values conditioned on
+        Sjj_Linv, Sjj_log_norm = gk.cholesky_factors(S[:, j][:, :, j])
+        mu_j = mu[:, j]
+        log_density = gk.log_gaussians(y[np.newaxis], mu_j[np.newaxis], Sjj_Linv[np.newaxis], Sjj_log_norm[np.newaxis])[0]
+        with np.errstate(divide='ignore'):
+            log_p = np.log(self._p) + log_density
+        self._p = np.exp(log_p - log_p.max())
+
+        # conditional gaussians: Schur complement
+        if len(i) > 0:
+            Sjj_inv = np.einsum('cki,ckj->cij', Sjj_Linv, Sjj_Linv)
+            K = np.einsum('cij,cjk->cik', S[:, i][:, :, j], Sjj_inv)
+            self._mu = mu[:, i] + np.einsum('cij,cj->ci', K, y - mu_j)
+            self._S = S[:, i][:, :, i] - np.einsum('cij,cjk->cik', K, S[:, j][:, :, i])
+        else:
+            self._mu = np.zeros((len(self._p), 0))
+            self._S = np.zeros((len(self._p), 0, 0))
+        self._numericals = [self._numericals[k] for k in i]
+
+    def _conditionout(self, keep, remove):
+        remove = set(remove)
+        cat_remove = [name for name in self._categoricals if name in remove]
+        num_remove = [name for name in self._numericals if name in remove]
+        if len(cat_remove) > 0:
+            self._conditionout_categorical(cat_remove)
+        if len(num_remove) > 0:
+            self._conditionout_continuous(num_remove)
+        self._prune()
+        return self._unbound_updater,
+
+    def _row(self, cat):
+        """Returns the row of the cell of given categorical values, or None if there is no such cell."""
+        if len(cat) == 0:
+            return 0
+        key = sum(c * s for c, s in zip(self._index.encode(cat), self._index.strides.tolist()))
+        return self._key2row.get(key)
+
+    def _density(self, x):
+        cat_len = len(self._categoricals)
+        row = self._row(x[:cat_len])
+        if row is None:
+            return 0.0
+        p = self._p[row]
+        if len(self._numericals) == 0:
+            return p
+        z = self._Linv[row].dot(np.array(x[cat_len:], dtype=float) - self._mu[row])
+        return p * np.exp(self._log_norm[row] - .5 * z.dot(z))
+
+    def _density_batch(self, X):
+        cat_len = len(self._categoricals)
+        if cat_len == 0:
+            rows = np.zeros(len(X), dtype=int)
+            found = np.ones(len(X), dtype=bool)
+        else:
+            keys = self._index.encode_columns(X[name] for name in self._index.dims)
+            rows = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            found = self._keys[rows] == keys
+
+        density = self._p[rows]
+        if len(self._numericals) > 0:
+            num = X.iloc[:, cat_len:].values.astype(float)
+            density = density * np.exp(gk.log_gaussians(num, self._mu[rows, np.newaxis], self._Linv[rows, np.newaxis],
+                                                         self._log_norm[rows, np.newaxis])[:, 0])
+        return np.where(found, density, 0.0)
+
+    def _probability(self, domains):
+        return self._probability_batch(pd.DataFrame([domains], columns=self.names))[0]
+
+    def _probability_batch(self, domains):
+        """Vectorized, exact computation of probabilities over the stored cells. See `Model._probability_batch()` and
+        `cond_gaussians.box_probability_cg()`."""
+        cats = self._categoricals
+        cat_domains, lower, upper = cg.split_domains(domains, len(cats))
+        return cg.box_probability_cg(self._index, self._p, self._mu, self._S, cats, cat_domains, lower, upper,
+                                     cells=self._cells)
+
+    def _maximum(self):
+        """Returns the point of the maximum density in this model, using the same heuristic as `CgWmModel`: the
+        mean of the cell with the largest density at its mean."""
+        with np.errstate(divide='ignore'):
+            row = np.argmax(np.log(self._p) + self._log_norm)
+        cat = [levels[code] for levels, code in zip(self._index.levels, self._cells[row])]
+        return cat + self._mu[row].tolist()
+
+    def _average(self):
+        """Returns the average of this model, i.e. the expectation of the numerical fields and the most probable
+        value of the categorical fields."""
+        return self._conditional_average_batch([], pd.DataFrame(index=range(1))).values.tolist()[0]
+
+    def _conditional_average_batch(self, names, X):
+        """Vectorized computation of conditional averages over the stored cells. See
+        `Model._conditional_average_batch()` and `cond_gaussians.conditional_average_cg()`."""
+        return cg.conditional_average_cg(self._index, self._p, self._mu, self._S, self._categoricals,
+                                         self._numericals, names, X, cells=self._cells)
+
+    def _sample(self, n=1):
+        n = int(n)
+        rows = np.random.choice(len(self._p), size=n, p=self._p)
+        cat = np.column_stack([np.array(levels, dtype=object)[self._cells[rows, i]]
+                               for i, levels in enumerate(self._index.levels)] + [np.empty((n, 0), dtype=object)])
+        L = np.linalg.cholesky(self._S) if len(self._numericals) > 0 else self._S
+        num = self._mu[rows] + np.einsum('kij,kj->ki', L[rows], np.random.randn(n, len(self._numericals)))
+        return [c + v for c, v in zip(cat.tolist(), num.tolist())]
+
+    def to_dense(self):
+        """Returns the parameters as dense xarray.DataArrays (p, mu, S) over the full cartesian product of the values of
+        the categorical fields, in the layout of `CgWmModel`. Cells that are not stored have a probability of 0 and
+        nan mean and covariance. This is meant for debugging and export only, since it may require huge amounts of
+        memory."""
+        shape = self._index.shape
+        num_len = len(self._numericals)
+        flat = self._keys
+        p = np.zeros(self._index.size)
+        p[flat] = self._p
+        mu = np.full((self._index.size, num_len), np.nan)
+        mu[flat] = self._mu
+        S = np.full((self._index.size, num_len, num_len), np.nan)
+        S[flat] = self._S
+        coords = self._index.levels
+        dims = self._index.dims
+        return (xr.DataArray(p.reshape(shape), coords=coords, dims=dims),
+                xr.DataArray(mu.reshape(shape + (num_len,)), coords=coords + [self._numericals], dims=dims + ['mean']),
+                xr.DataArray(S.reshape(shape + (num_len, num_len)), coords=coords + [self._numericals]*2,
+                             dims=dims + ['S1', 'S2']))
+
+    def _memory_components(self):
+        return {'parameters': [self._cells, self._p, self._mu, self._S],
+                'precomputed': [self._keys, self._key2row, self._Linv, self._log_norm]}
+
+    def copy(self, name=None):
+        mycopy = self._defaultcopy(name)
+        mycopy._categoricals = self._categoricals.copy()
+        mycopy._numericals = self._numericals.copy()
+        mycopy._index = self._index
+        mycopy._cells = self._cells.copy()
+        mycopy._p = self._p.copy()
+        mycopy._mu = self._mu.copy()
+        mycopy._S = self._S.copy()
+        mycopy.opts = self.opts.copy()
+        mycopy._update()
+        return mycopy
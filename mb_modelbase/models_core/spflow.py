@@ -202,11 +202,17 @@ class SPNModel(Model):
         e = Expectation(self._spn)
         return e
 
-    def _maximum(self):
+    def _maximum(self, x0=None):
         fun = lambda x : -1 * self._density(x)
         xmax = None
         xlength = len(self.names)
 
+        if x0 is not None:
+            # warm start from x0, and only if that fails from the default start vectors
+            xopt = scpo.minimize(fun, x0, method='Nelder-Mead')
+            if xopt.success and np.isfinite(xopt.x).all() and xopt.fun < 0:
+                return xopt.x
+
         #startVectors = self.data.sample(20).values
         startVectors = self.data.mean()
 
@@ -237,6 +243,9 @@ class SPNModel(Model):
 
         return result
 
+    def _memory_components(self):
+        return {'spn': self._spn}
+
     def copy(self, name=None):
         mycopy = self._defaultcopy(name)
         mycopy._spn = cp.deepcopy(self._spn)
@@ -0,0 +1,57 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for categorical_index.py
+"""
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from mb_modelbase.models_core.categorical_index import CategoricalIndex
+from mb_modelbase.models_core.categoricals import CategoricalModel
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestCategoricalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.p = xr.DataArray(np.arange(12).reshape(2, 3, 2), dims=['a', 'b', 'c'],
+                              coords=[['a1', 'a2'], ['b1', 'b2', 'b3'], ['c1', 'c2']])
+        self.index = CategoricalIndex.from_dataarray(self.p)
+
+    def test_encode(self):
+        index = self.index
+        self.assertEqual(index.shape, (2, 3, 2))
+        self.assertEqual(index.strides.tolist(), [6, 2, 1])
+        self.assertEqual(index.axis, {'a': 0, 'b': 1, 'c': 2})
+        self.assertEqual(index.encode(['a2', 'b3', 'c1']), (1, 2, 0))
+        self.assertEqual(self.p.values[index.encode(['a2', 'b3', 'c1'])],
+                         self.p.loc[dict(a='a2', b='b3', c='c1')].item())
+        with self.assertRaises(KeyError):
+            index.encode(['a2', 'foo', 'c1'])
+
+        flat = index.encode_columns([['a1', 'a2'], ['b2', 'b3'], ['c2', 'c1']])
+        self.assertEqual(self.p.values.ravel()[flat].tolist(), [3, 10])
+        with self.assertRaises(KeyError):
+            index.encode_columns([['a1'], ['foo'], ['c2']])
+
+    def test_indexer(self):
+        indexer = self.index.indexer({'b': 'b2'})
+        self.assertTrue(self.p[indexer].equals(self.p.loc[dict(b='b2')]))
+
+        index = self.index.remove(['b'])
+        self.assertEqual(index.dims, ['a', 'c'])
+        self.assertEqual(index.shape, (2, 2))
+
+    def test_categorical_model(self):
+        data = test_crabs.mixed().loc[:, ['species', 'sex']]
+        model = CategoricalModel('crabs').fit(data)
+        densities = model._density_batch(data)
+        self.assertEqual(densities.tolist(), [model._density(list(x)) for x in data.itertuples(index=False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
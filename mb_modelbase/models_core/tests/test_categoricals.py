@@ -5,6 +5,7 @@
 Test Suite for categoricals.py
 """
 
+import os
 import unittest
 import numpy.testing as npt
 import numpy as np
@@ -78,6 +79,34 @@ class TestRunningShouldNotRaiseException(unittest.TestCase):
                   'maximum'))
 
 
+class TestFit(unittest.TestCase):
+
+    def test_maximum_aposteriori(self):
+        df = pd.read_csv(os.path.join(os.path.dirname(__file__), 'categorical_dummy.csv'))
+        model = CategoricalModel('test').fit(df)
+        df = model.data
+        counts = df.groupby(list(df.columns)).size()
+        p = model._p
+        self.assertEqual(list(p.dims), list(df.columns))
+        # cells without data only get the smoothing mass
+        self.assertAlmostEqual(float(p.sum()), 1)
+        for values, count in counts.items():
+            npt.assert_allclose(p.loc[values].item(), (count + 1) / (len(df) + p.size))
+        self.assertEqual((p.values > 1 / (len(df) + p.size)).sum(), len(counts))
+
+    def test_cond_gaussian(self):
+        from mb_modelbase.models_core.cond_gaussians import ConditionallyGaussianModel
+        from mb_modelbase.models_core.tests import test_crabs
+        df = test_crabs.mixed()
+        model = ConditionallyGaussianModel('test').fit(df)
+        df = model.data
+        groups = df.groupby(['species', 'sex'])
+        for (species, sex), group in groups:
+            npt.assert_allclose(model._mu.loc[species, sex].values, group.iloc[:, 2:].mean().values)
+        residuals = df.iloc[:, 2:] - groups.transform('mean')
+        npt.assert_allclose(model._S.values, residuals.T.dot(residuals).values / len(df))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -6,8 +6,17 @@ Test Suite for cond_gaussians_wm.py
 """
 
 import unittest
+import numpy as np
+import pandas as pd
+from scipy import integrate
+
+from mb_modelbase.models_core.base import Aggregation, Condition, Probability, Split
+from mb_modelbase.models_core import models_predict
+from mb_modelbase.models_core.models import Model
 from mb_modelbase.models_core.cond_gaussian_wm import CgWmModel
+from mb_modelbase.models_core.cond_gaussians import ConditionallyGaussianModel
 from mb_modelbase.models_core.cond_gaussian.datasampling import cg_dummy
+from mb_modelbase.models_core.tests import test_crabs
 
 
 def print_info(model):
@@ -102,6 +111,83 @@ class TestInference(unittest.TestCase):
         pass
 
 
+class TestAverage(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+
+    def test_average(self):
+        for cls in [CgWmModel, ConditionallyGaussianModel]:
+            model = cls('crabs').fit(self.data)
+            average = model.aggregate('average')
+            nums = model._numericals
+            np.testing.assert_allclose(average[2:], self.data[nums].mean(), rtol=0.01)
+
+            # vectorized conditional averages are identical to those of the derived conditional models
+            for names, keep in [(['sex', 'FL'], ['species', 'sex', 'FL', 'RW']), (['FL', 'CW'], ['sex', 'FL', 'CW']),
+                                (['species'], ['species', 'RW', 'CL'])]:
+                marginal = model.copy().marginalize(keep=keep)
+                X = self.data.loc[:, names].iloc[:20]
+                actual = marginal._conditional_average_batch(names, X)
+                expected = Model._conditional_average_batch(marginal, names, X)
+                self.assertEqual(list(actual.columns), list(expected.columns))
+                for name in actual.columns:
+                    if name in model._categoricals:
+                        self.assertEqual(actual[name].tolist(), expected[name].tolist())
+                    else:
+                        np.testing.assert_allclose(actual[name], expected[name])
+
+    def test_aggregate_average(self):
+        # marginalizing and conditioning do not commute for weak marginals, but the averages are those of the models
+        # conditioned on each row of input
+        aggr = Aggregation(['RW'], 'average', 'RW')
+        splitby = [Split('sex', 'elements'), Split('FL', 'equidist', 5)]
+        for cls in [CgWmModel, ConditionallyGaussianModel]:
+            model = cls('crabs').fit(self.data)
+            model.parallel_processing = False
+            name2split = models_predict.make_name2split(model, splitby)
+            partial_data, split_data = models_predict.generate_all_input(model, splitby, ['sex', 'FL'], pd.DataFrame())
+            result = models_predict.aggregate_maximum_or_average(model, aggr, partial_data, split_data, name2split)
+            self.assertEqual(len(result), 10)
+            for sex, fl, rw in result.itertuples(index=False, name=None):
+                conditional = model.copy().condition([Condition('sex', '==', sex), Condition('FL', '==', fl)])\
+                    .marginalize(keep=['RW'])
+                self.assertAlmostEqual(rw, conditional.aggregate('average')[0])
+
+
+class TestProbability(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+
+    def test_probability(self):
+        for cls in [CgWmModel, ConditionallyGaussianModel]:
+            model = cls('crabs').fit(self.data)
+            marginal = model.copy().marginalize(keep=['sex', 'FL', 'RW'])
+
+            # exact probability of a box, summed over several categorical values
+            actual = marginal.probability([['Male', 'Female'], [10, 15], [8, 12]])
+            expected = integrate.dblquad(
+                lambda rw, fl: marginal.density(['Male', fl, rw]) + marginal.density(['Female', fl, rw]), 10, 15, 8, 12)
+            self.assertAlmostEqual(actual, expected[0], places=6)
+
+            # unbounded intervals give the marginal probabilities of the categorical values
+            self.assertAlmostEqual(marginal.probability([['Male'], [-np.inf, np.inf], [-np.inf, np.inf]]),
+                                   marginal.copy().marginalize(keep=['sex']).density(['Male']))
+            self.assertEqual(marginal.probability([['Male'], [10, 10], [8, 12]]), 0)
+
+            # vectorized probabilities are identical to the single ones, and used in predictions
+            sex, FL = marginal.byname(['sex', 'FL'])
+            result = marginal.predict(['sex', 'FL', Probability(['sex', 'FL'])],
+                                      splitby=[Split(sex, 'elements'), Split(FL, 'equiinterval', args=10)])
+            # the intervals are returned by their midpoints
+            width = np.diff(np.unique(result['FL']))[0]
+            conditional = marginal.copy().marginalize(keep=['sex', 'FL'])
+            for sex_, fl, probability in result.itertuples(index=False, name=None):
+                self.assertAlmostEqual(probability, conditional.probability([[sex_], [fl - width/2, fl + width/2]]))
+            self.assertAlmostEqual(result.iloc[:, 2].sum(), 1, places=2)
+
+
 class TestModelSelection(unittest.TestCase):
 
     def test_it(self):
@@ -0,0 +1,56 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for data_aggregation.py
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from mb_modelbase.models_core import data_aggregation as data_aggr
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestMostFrequent(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+
+    def test_most_frequent(self):
+        rs = np.random.RandomState(1)
+        df = pd.DataFrame({'a': rs.choice(['x', 'y', 'z'], 1000), 'b': rs.choice(['u', 'v'], 1000),
+                           'c': rs.choice(['p', 'q', 'r', 's'], 1000)})
+        expected = df.groupby(list(df.columns)).size().idxmax()
+        self.assertEqual(data_aggr.most_frequent(df), list(expected))
+        self.assertEqual(data_aggr.most_frequent(df[['b']]), [df['b'].value_counts().idxmax()])
+
+        # ties are broken by the lexicographically smallest row
+        tie = pd.DataFrame({'a': ['y', 'x', 'y', 'x'], 'b': ['v', 'v', 'v', 'v']})
+        self.assertEqual(data_aggr.most_frequent(tie), ['x', 'v'])
+
+        # more distinct values than fit into a single key
+        wide = pd.DataFrame({str(i): rs.choice(['v{}'.format(j) for j in range(300)], 50) for i in range(10)})
+        wide = pd.concat([wide, wide.iloc[[3]]])
+        self.assertEqual(data_aggr.most_frequent(wide), list(wide.iloc[3]))
+
+    def test_aggregate(self):
+        result = data_aggr.aggregate_data(self.data, 'maximum')
+        expected = list(self.data.groupby(['species', 'sex']).size().idxmax()) + \
+            self.data.iloc[:, 2:].mean().tolist()
+        self.assertEqual(result[:2], expected[:2])
+        np.testing.assert_allclose(result[2:], expected[2:])
+        self.assertEqual(data_aggr.aggregate_data(self.data.iloc[:0], 'maximum'), [None] * self.data.shape[1])
+
+    def test_equi_sized(self):
+        df = pd.DataFrame({'a': ['x'] * 6 + ['y'] * 4, 'b': [0, 1, 2, 9, 9, 10, 9, 9, 9, 10.]})
+        # the most frequent combination is y and the last of the two intervals of b
+        self.assertEqual(data_aggr.most_frequent_equi_sized(df, [2]), ['y', 7.5])
+        result = data_aggr.most_frequent_equi_sized(self.data, [5])
+        self.assertEqual(len(result), self.data.shape[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
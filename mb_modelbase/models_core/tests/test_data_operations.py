@@ -0,0 +1,52 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for data_operations.py
+"""
+
+import unittest
+
+import numpy as np
+
+from mb_modelbase.models_core import data_operations as data_op
+from mb_modelbase.models_core.empirical_model import EmpiricalModel
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestConditions(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+
+    def test_compile(self):
+        data = self.data
+        where = [('species', 'in', ['Blue']), ('FL', 'in', [10, 20]), ('sex', '==', 'Male'), ('RW', '>', 10),
+                 ('RW', 'less', 14)]
+        expected = (data.species.isin(['Blue']) & data.FL.between(10, 20) & (data.sex == 'Male') & (data.RW >= 10) &
+                    (data.RW < 14)).values
+        np.testing.assert_array_equal(data_op.compile_conditions(where)(data), expected)
+        np.testing.assert_array_equal(data_op.condition_index(data, where), np.flatnonzero(expected))
+        self.assertTrue(data_op.condition_data(data, where).equals(data.loc[expected]))
+
+        # a single condition, and no condition
+        self.assertEqual(len(data_op.condition_index(data, ('sex', 'equals', 'Female'))), (data.sex == 'Female').sum())
+        self.assertEqual(len(data_op.condition_index(data, None)), len(data))
+        with self.assertRaises(ValueError):
+            data_op.compile_conditions([('sex', '!=', 'Male')])
+
+    def test_model_condition(self):
+        model = EmpiricalModel('crabs').fit(self.data)
+        # conditions may be given as a zip of plain tuples
+        model.condition(zip(['sex', 'FL'], ['==', 'in'], ['Male', [10, 15]]))
+        expected = self.data.loc[(self.data.sex == 'Male') & self.data.FL.between(10, 15)]
+        # both training and test data are conditioned
+        self.assertEqual(sorted(model.data.FL.tolist() + model.test_data.FL.tolist()), sorted(expected.FL))
+
+        selected = model.select(['RW', 'sex'], where=[('RW', '<', 10)])
+        self.assertEqual(list(selected.columns), ['RW', 'sex'])
+        self.assertEqual(len(selected), (model.data.RW < 10).sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for frequency_index.py
+"""
+
+import unittest
+
+import numpy as np
+
+from mb_modelbase.models_core import data_operations as data_op
+from mb_modelbase.models_core.empirical_model import EmpiricalModel
+from mb_modelbase.models_core.frequency_index import FrequencyIndex
+from mb_modelbase.models_core.kde_model import KDEModel
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestFrequencyIndex(unittest.TestCase):
+
+    def setUp(self):
+        # few distinct values, such that points occur multiple times
+        self.data = test_crabs.mixed().loc[:, ['species', 'sex', 'FL']]
+        self.data['FL'] = self.data['FL'].round(-1)
+        self.index = FrequencyIndex.from_data(self.data)
+
+    def _assert_counts(self, index, df):
+        points = df.drop_duplicates()
+        expected = [data_op.density(df, list(x)) for x in points.itertuples(index=False)]
+        self.assertEqual([index.count(list(x)) for x in points.itertuples(index=False)], expected)
+        self.assertEqual(index.count_batch(points).tolist(), expected)
+        self.assertEqual(index.total, len(df))
+        self.assertEqual(len(index), len(points))
+
+    def test_count(self):
+        self._assert_counts(self.index, self.data)
+        self.assertEqual(self.index.count(['Blue', 'Male', 1000.0]), 0)
+        self.assertEqual(self.index.count(['foo', 'Male', 10.0]), 0)
+
+        weights = np.arange(len(self.data), dtype=float)
+        weighted = FrequencyIndex.from_data(self.data, weights)
+        point = list(self.data.iloc[0])
+        mask = (self.data == point).all(axis=1).values
+        self.assertAlmostEqual(weighted.count(point), weights[mask].sum())
+
+    def test_condition_marginalize(self):
+        conditions = [('species', '==', 'Blue'), ('FL', 'in', [10, 15])]
+        self._assert_counts(self.index.condition(conditions), data_op.condition_data(self.data, conditions))
+        self._assert_counts(self.index.marginalize(['sex', 'species']), self.data.loc[:, ['sex', 'species']])
+
+    def test_models(self):
+        model = EmpiricalModel('crabs').fit(self.data)
+        model.marginalize(keep=['sex', 'FL'])
+        expected = [data_op.density(model._emp_data, list(x)) for x in model._emp_data.itertuples(index=False)]
+        np.testing.assert_array_equal(model._density_batch(model._emp_data), expected)
+
+        kde = KDEModel('crabs').fit(self.data.loc[:, ['species', 'sex']])
+        self.assertAlmostEqual(kde._density(['Blue', 'Male']), 0.25)
+        np.testing.assert_allclose(kde._density_batch(kde.data.iloc[:3]), 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
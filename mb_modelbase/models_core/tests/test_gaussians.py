@@ -8,8 +8,13 @@ Test Suite for gaussians.py
 import unittest
 import numpy.testing as npt
 import numpy as np
+import pandas as pd
+from scipy.stats import multivariate_normal, norm
 
+from mb_modelbase.models_core import gaussian_kernels as gk
+from mb_modelbase.models_core.base import Condition
 from mb_modelbase.models_core.gaussians import MultiVariateGaussianModel as Gaussian
+from mb_modelbase.models_core.mixture_gaussians import MoGModelWithK
 from mb_modelbase.models_core.models import Density
 
 class TestRunningShouldNotRaiseException(unittest.TestCase):
@@ -18,10 +23,10 @@ class TestRunningShouldNotRaiseException(unittest.TestCase):
 
     def test_1(self):
         sigma = np.matrix([
-            [1.0, 0.6, 0.0, 2.0],
+            [1.0, 0.6, 0.0, 0.2],
             [0.6, 1.0, 0.4, 0.0],
             [0.0, 0.4, 1.0, 0.0],
-            [2.0, 0.0, 0.0, 1.]])
+            [0.2, 0.0, 0.0, 1.]])
         mu = np.matrix([1.0, 2.0, 0.0, 0.5]).T
         foo = Gaussian("foo")
         opts = {'mode': 'custom', 'sigma': sigma, 'mu': mu}
@@ -101,24 +106,24 @@ class TestInferenceLvl01(unittest.TestCase):
         m.model(model=m.names[1:4])
         dim = m.dim
         npt.assert_equal(m._S, np.eye(dim))
-        npt.assert_equal(m._mu, np.matrix(np.zeros(dim)).T)
+        npt.assert_equal(m._mu, np.zeros(dim))
 
         m.model(model=m.names[0:2])
         dim = m.dim
         npt.assert_equal(m._S, np.eye(dim))
-        npt.assert_equal(m._mu, np.matrix(np.zeros(dim)).T)
+        npt.assert_equal(m._mu, np.zeros(dim))
 
     def test_condition_1(self):
         m = self.m
         m.model(model='*', where=[('dim1', '==', 0)])
         dim = m.dim
         npt.assert_equal(m._S, np.eye(dim))
-        npt.assert_equal(m._mu, np.matrix(np.zeros(dim)).T)
+        npt.assert_equal(m._mu, np.zeros(dim))
 
         m.model(model='*', where=[('dim3', '==', 0), ('dim4', '==', 0)])
         dim = m.dim
         npt.assert_equal(m._S, np.eye(dim))
-        npt.assert_equal(m._mu, np.matrix(np.zeros(dim)).T)
+        npt.assert_equal(m._mu, np.zeros(dim))
 
     def test_maximum_1(self):
         m = self.m
@@ -151,5 +156,68 @@ class TestSimple2DMVG(unittest.TestCase):
         print(result)
 
 
+class TestCholesky(unittest.TestCase):
+
+    def setUp(self):
+        self.mu = np.array([1.0, 2.0, 0.0])
+        self.sigma = np.array([[1.0, 0.6, 0.2], [0.6, 2.0, 0.4], [0.2, 0.4, 1.0]])
+        self.m = Gaussian("test")
+        self.m.generate_model({'mode': 'custom', 'mu': self.mu, 'sigma': self.sigma})
+
+    def test_density(self):
+        X = np.random.RandomState(1).randn(20, 3)
+        expected = multivariate_normal(self.mu, self.sigma).pdf(X)
+        npt.assert_allclose(self.m._density_batch(pd.DataFrame(X, columns=self.m.names)), expected)
+        npt.assert_allclose([self.m._density(x) for x in X], expected)
+
+        # the gradient is the derivative of the density
+        x, eps = X[0], 1e-6
+        numerical = [(self.m._density(x + eps*e) - self.m._density(x - eps*e)) / (2*eps) for e in np.eye(3)]
+        npt.assert_allclose(self.m._gradient(x), numerical, rtol=1e-5)
+
+    def test_condition(self):
+        m = self.m.copy().condition([Condition('dim2', '==', 1.0)]).marginalize(keep=['dim0', 'dim1'])
+        i, j = [0, 1], [2]
+        SInv = np.linalg.inv(self.sigma[np.ix_(j, j)])
+        npt.assert_allclose(m._mu, self.mu[i] + self.sigma[np.ix_(i, j)].dot(SInv).dot(1.0 - self.mu[j]))
+        npt.assert_allclose(m._S, self.sigma[np.ix_(i, i)] -
+                            self.sigma[np.ix_(i, j)].dot(SInv).dot(self.sigma[np.ix_(j, i)]))
+
+    def test_sample(self):
+        np.random.seed(1)
+        samples = self.m.sample(20000)
+        self.assertEqual(samples.shape, (20000, 3))
+        npt.assert_allclose(samples.mean(), self.mu, atol=0.05)
+        npt.assert_allclose(np.cov(samples.values, rowvar=False), self.sigma, atol=0.05)
+
+        # fitting recovers the parameters
+        m = Gaussian("fitted").fit(samples)
+        npt.assert_allclose(m._mu, self.mu, atol=0.05)
+        npt.assert_allclose(m._S, self.sigma, atol=0.05)
+
+    def test_probability(self):
+        # a box that is bounded in one dimension only has the probability of the marginal interval
+        lower, upper = np.array([[-np.inf, 0.0, -np.inf]]), np.array([[np.inf, 3.0, np.inf]])
+        expected = norm.cdf((3.0 - 2.0) / np.sqrt(2.0)) - norm.cdf((0.0 - 2.0) / np.sqrt(2.0))
+        npt.assert_allclose(gk.box_probabilities(lower, upper, self.mu[np.newaxis], self.sigma[np.newaxis]),
+                            [[expected]], atol=1e-5)
+
+        # bounded boxes, compared to the relative frequency of samples
+        lower = np.array([[0.0, 1.0, -1.0], [1.0, 1.0, 1.0], [-1.0, 0.0, 0.0]])
+        upper = np.array([[2.0, 3.0, 1.0], [1.0, 2.0, 2.0], [0.5, 4.0, 0.5]])
+        samples = np.random.RandomState(1).multivariate_normal(self.mu, self.sigma, 200000)
+        expected = [((samples >= l) & (samples <= u)).all(axis=1).mean() for l, u in zip(lower, upper)]
+        npt.assert_allclose(gk.box_probabilities(lower, upper, self.mu[np.newaxis], self.sigma[np.newaxis])[:, 0],
+                            expected, atol=5e-3)
+
+    def test_mixture(self):
+        np.random.seed(1)
+        samples = pd.concat([self.m.sample(1000), self.m.sample(1000) + 5], ignore_index=True)
+        mixture = MoGModelWithK("mixture", 2).fit(samples)
+        X = samples.iloc[:10]
+        npt.assert_allclose(mixture._density_batch(X), [mixture._density(list(x)) for x in X.values])
+        self.assertEqual(mixture.sample(100).shape, (100, 3))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for kde_backends.py
+"""
+
+import unittest
+
+import numpy as np
+from scipy import stats
+
+from mb_modelbase.models_core import kde_backends as kb
+from mb_modelbase.models_core.kde_model import KDEModel
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestKDEBackends(unittest.TestCase):
+
+    def setUp(self):
+        rs = np.random.RandomState(1)
+        self.data = {d: rs.randn(3000, d).dot(np.triu(np.ones((d, d)))) for d in [1, 2, 3]}
+        self.X = {d: rs.randn(200, d) * 2 for d in [1, 2, 3]}
+
+    def test_exact(self):
+        for d, data in self.data.items():
+            expected = stats.gaussian_kde(data.T).evaluate(self.X[d].T)
+            np.testing.assert_allclose(kb.ExactBackend(data).evaluate(self.X[d]), expected, rtol=1e-10)
+
+            weights = np.random.RandomState(d).rand(len(data))
+            expected = stats.gaussian_kde(data.T, weights=weights).evaluate(self.X[d].T)
+            for method in ['exact', 'tree']:
+                backend = kb.make_backend(data, method=method, weights=weights, tolerance=1e-8)
+                np.testing.assert_allclose(backend.evaluate(self.X[d]), expected, rtol=1e-6, atol=1e-10)
+
+    def test_approximations(self):
+        for method, dims in [('tree', [1, 2, 3]), ('grid', [1, 2])]:
+            for d in dims:
+                exact = kb.ExactBackend(self.data[d])
+                backend = kb.make_backend(self.data[d], method=method, tolerance=1e-4)
+                peak = np.exp(exact._log_norm)
+                error = np.abs(backend.evaluate(self.X[d]) - exact.evaluate(self.X[d])).max()
+                self.assertLess(error, 1e-4 * peak)
+
+        with self.assertRaises(ValueError):
+            kb.make_backend(self.data[3], method='grid')
+        with self.assertRaises(ValueError):
+            kb.make_backend(self.data[3], method='foo')
+
+    def test_kde_model(self):
+        data = test_crabs.mixed().loc[:, ['species', 'sex', 'FL', 'RW']]
+        for backend in ['exact', 'tree', 'grid']:
+            model = KDEModel('crabs').fit(data, backend=backend)
+            X = data.iloc[:50]
+            expected = [model._density(list(x)) for x in X.itertuples(index=False, name=None)]
+            np.testing.assert_allclose(model._density_batch(X), expected)
+
+            # unseen categorical values have zero density
+            self.assertEqual(model._density(['Blue', 'foo', 15, 12]), 0)
+
+        with self.assertRaises(ValueError):
+            KDEModel('crabs').fit(data, backend='foo')
+
+    def test_mode(self):
+        # a bimodal density, where the larger mode is not at the mean
+        rs = np.random.RandomState(2)
+        data = np.concatenate([rs.randn(300, 2), rs.randn(100, 2) * .5 + 4])
+        grid = np.stack(np.meshgrid(np.linspace(-2, 6, 161), np.linspace(-2, 6, 161)), axis=-1).reshape(-1, 2)
+        for method in ['exact', 'tree']:
+            backend = kb.make_backend(data, method=method, tolerance=1e-8)
+            mode, density = backend.mode()
+            densities = backend.evaluate(grid)
+            self.assertGreaterEqual(density, densities.max())
+            np.testing.assert_allclose(mode, grid[densities.argmax()], atol=0.05)
+            # a warm start does not change the result
+            np.testing.assert_allclose(backend.mode(x0=mode + 0.1)[0], mode, atol=1e-5)
+
+    def test_cache(self):
+        backends = [kb.ExactBackend(self.data[1][i*100:(i+1)*100]) for i in range(3)]
+        cache = kb.BackendCache(max_bytes=2 * backends[0].nbytes)
+        cache[0], cache[1] = backends[:2]
+        self.assertIs(cache[0], backends[0])
+        # adding a third backend evicts the least recently used one
+        cache[2] = backends[2]
+        self.assertEqual(cache.keys(), [0, 2])
+        self.assertEqual(cache.nbytes, 2 * backends[0].nbytes)
+
+        # the model evicts backends, but still computes the same densities
+        data = test_crabs.mixed().loc[:, ['species', 'sex', 'FL', 'RW']]
+        X = data.iloc[:50]
+        model = KDEModel('crabs').fit(data, precompute=True)
+        self.assertEqual(len(model.kde), len(model._cells))
+        bounded = KDEModel('crabs').fit(data, cache_bytes=1)
+        np.testing.assert_allclose(bounded._density_batch(X), model._density_batch(X))
+        self.assertEqual(len(bounded.kde), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 import numpy as np
 import pandas as pd
+from scipy import stats
 import mb_modelbase as mbase
 import unittest
 from mb_modelbase.models_core.kde_model import KDEModel
+from mb_modelbase.models_core.base import Aggregation, Split, Condition
+from mb_modelbase.models_core.cond_gaussian.datasampling import genMixedSample
 import math
 
 
@@ -40,11 +43,37 @@ class kde_test(unittest.TestCase):
         kde_model.fields[1]['domain'].setupperbound(4)
         # Condition and marginalize model
         kde_model._conditionout(keep='B', remove='A')
-        # Generate control data
-        data_cond = pd.DataFrame({'B': np.array([4, 7, 7, 7, 4]), 'A': np.array([2, 3, 3, 3, 4])},
-                                 columns=['B', 'A'])
-        self.assertTrue(kde_model.data.sort_values(by='A').reset_index(drop=True).equals(data_cond),
-                        "model data was not marginalized and conditioned properly")
+        # The data is re-weighted by the kernel probability of the interval instead of being filtered
+        weights = pd.Series(kde_model._weights, index=kde_model._emp_data['A'].values)
+        self.assertEqual(len(weights), len(data))
+        self.assertGreater(weights[3].min(), weights[2])
+        self.assertGreater(weights[2], weights[1])
+        self.assertAlmostEqual(weights[2], weights[4])
+
+    def test_point_condition(self):
+        data = pd.DataFrame({'B': np.array([2, 4, 7, 7, 7, 4, 1]), 'A': np.array([1, 2, 3, 3, 3, 4, 5])},
+                            columns=['B', 'A'])
+        kde_model = KDEModel('kde_model').fit(data)
+        kde_model.byname('A')['domain'].setlowerbound(3.5)
+        kde_model.byname('A')['domain'].setupperbound(3.5)
+        kde_model.marginalize(keep=['B'])
+
+        # the conditional KDE is the KDE of B weighted by the kernel density of A at 3.5
+        full_kde = stats.gaussian_kde(data.values.T)
+        bandwidth = np.sqrt(full_kde.covariance[1, 1])
+        weights = stats.norm.pdf((data['A'].values - 3.5) / bandwidth)
+        expected = stats.gaussian_kde(data['B'].values, weights=weights)
+        for b in [1, 4, 6.5]:
+            self.assertAlmostEqual(kde_model._density([b]), expected([b])[0])
+
+    def test_numeric_point_condition_keeps_data(self):
+        data = genMixedSample(300, 2, [3, 2], seed=1)
+        kde_model = KDEModel('kde_model').fit(data)
+        value = float(data['g0'].iloc[0])
+        kde_model.condition([Condition('g0', '==', value)]).marginalize(remove=['g0'])
+        # conditioning re-weights the data points instead of dropping them
+        self.assertEqual(len(kde_model.data), 300)
+        self.assertGreater(kde_model.density(list(data.loc[0, ['c0', 'c1', 'g1']])), 0)
 
     def test_maximum(self):
         data = pd.DataFrame({'B': np.array([0, 2, 2, 3, 3, 3, 4, 4, 6]), 'A': np.array([1, 2, 3, 3, 3, 3, 3, 4, 5])},
@@ -74,6 +103,16 @@ class kde_test(unittest.TestCase):
         # For the remaining dimension: get point of maximum/average probability density
         self.assertAlmostEqual(kde_model._maximum()[0], 3.0, places=2, msg='prediction is not correct')
 
+    def test_predict_split_by_categorical(self):
+        data = genMixedSample(300, 2, [3, 2], seed=1)
+        kde_model = KDEModel('kde_model').fit(data)
+        res = kde_model.predict(['c0', Aggregation(['c1', 'g0', 'g1'], 'maximum', 'g1')],
+                                splitby=[Split('c0', 'elements')])
+        self.assertEqual(len(res), 3)
+        self.assertTrue(np.isfinite(res.iloc[:, 1].astype(float)).all())
+        # splitting must not filter the data of the model, since it is aligned to the weights of its points
+        self.assertEqual(len(kde_model.data), 300)
+
 
     def test_mixed_categorical_numerical_model(self):
         data = pd.DataFrame({'A': np.array([1, 2, 3, 2, 3, 4, 5]),
@@ -100,6 +139,23 @@ class kde_test(unittest.TestCase):
         kde_model.fit(data)
         self.assertTrue(kde_model._maximum() == ['foo', 'hey'], 'maximum was not correctly calculated')
 
+    def test_sample(self):
+        rs = np.random.RandomState(3)
+        data = pd.DataFrame({'A': np.concatenate([rs.randn(500), rs.randn(500) + 10]),
+                             'B': np.array(['foo'] * 500 + ['bar'] * 500)}, columns=['A', 'B'])
+        kde_model = KDEModel('kde_model').fit(data)
+        np.random.seed(1)
+        samples = kde_model.sample(4000)
+        self.assertEqual(list(samples.columns), kde_model.names)
+        self.assertEqual(samples['A'].dtype, np.float64)
+        # the categorical and numerical values are sampled jointly
+        means = samples.groupby('B')['A'].mean()
+        self.assertAlmostEqual(means['foo'], 0, delta=0.15)
+        self.assertAlmostEqual(means['bar'], 10, delta=0.15)
+        # the kernel noise is that of the kde of the cell
+        bandwidth = np.sqrt(kde_model._conditional_kde(['foo'])[0].covariance[0, 0])
+        self.assertAlmostEqual(samples.loc[samples['B'] == 'foo', 'A'].std(), np.sqrt(1 + bandwidth**2), delta=0.1)
+
     def test_kde_storage(self):
         data = pd.DataFrame({'A': np.array([1, 2, 3, 2, 3, 4, 5]),
                              'B': np.array(['foo', 'bar', 'foo', 'foo', 'bar', 'foo', 'bar']),
@@ -109,4 +165,10 @@ class kde_test(unittest.TestCase):
         kde_model.fit(data)
         kde_model._density(['foo', 'hey', 2])
         kde_model._density(['foo', 'hey', 3])
-        self.assertTrue(kde_model.kde['[\'foo\', \'hey\']'], 'kde storage does not work properly')
+        cell = kde_model._encode([['foo', 'hey']])[0]
+        self.assertIn(cell, kde_model.kde, 'kde storage does not work properly')
+        self.assertEqual(len(kde_model.kde), 1)
+
+        # copies share the cache
+        kde_model.copy()._density(['bar', 'hey', 2])
+        self.assertEqual(len(kde_model.kde), 2)
@@ -2,10 +2,14 @@ import unittest
 import numpy as np
 import pandas as pd
 
+from mb_modelbase.models_core.base import Aggregation, Condition, Split
+from mb_modelbase.models_core.models import Model
 from mb_modelbase.models_core.mixable_cond_gaussian import MixableCondGaussianModel as MixCondGauss
+from mb_modelbase.models_core.cond_gaussian.datasampling import genMixedSample
 
 # load data
 from mb_modelbase.models_core.tests import test_allbus as ta
+from mb_modelbase.models_core.tests import test_crabs
 
 class TestMethods(unittest.TestCase):
 
@@ -42,5 +46,212 @@ class TestMethods(unittest.TestCase):
         margmod = self.model.copy().marginalize(keep=['age'])
         self.assertEqual(type(margmod._sample(1)[0][0]), type(0.12345))
 
+
+class TestDensityBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+        self.model = MixCondGauss("crabs").fit(df=self.data, fit_algo='full')
+
+    def _assert_batch_equals_pointwise(self, model):
+        X = self.data.loc[:, model.names]
+        expected = [model._density(list(x)) for x in X.itertuples(index=False, name=None)]
+        np.testing.assert_allclose(model._density_batch(X), np.array(expected, dtype=float), rtol=1e-8)
+
+    def test_density_batch(self):
+        model = self.model
+        self._assert_batch_equals_pointwise(model)
+        for keep in [['species', 'FL', 'RW'], ['FL', 'RW'], ['species', 'sex'], ['sex']]:
+            self._assert_batch_equals_pointwise(model.copy().marginalize(keep=keep))
+
+        # the cached parameters are updated on derived models
+        marginal = model.copy().marginalize(keep=['species', 'sex', 'FL'])
+        marginal._density_batch(self.data.loc[:, marginal.names])
+        marginal.marginalize(keep=['sex', 'FL'])
+        self._assert_batch_equals_pointwise(marginal)
+
+    def test_invalid_value(self):
+        X = pd.DataFrame([['foo', 'Male', 10, 10, 20, 20, 10]], columns=self.model.names)
+        with self.assertRaises(KeyError):
+            self.model._density_batch(X)
+
+
+class TestSample(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+        self.model = MixCondGauss("crabs").fit(df=self.data, fit_algo='full')
+
+    def test_sample(self):
+        samples = self.model._sample(20000)
+        self.assertEqual(len(samples), 20000)
+        self.assertEqual([type(v) for v in samples[0]], [str, str] + [float]*5)
+
+        # sample moments match the model
+        df = pd.DataFrame(data=samples, columns=self.model.names)
+        np.testing.assert_allclose(df.groupby(['species', 'sex']).size() / len(df), self.model._p.values.ravel(),
+                                   atol=0.02)
+        nums = self.model._numericals
+        np.testing.assert_allclose(df[nums].mean(), self.data[nums].mean(), rtol=0.02)
+
+    def test_sample_marginals(self):
+        for keep, types in [(['sex'], [str]), (['FL', 'RW'], [float, float]), (['species', 'RW'], [str, float])]:
+            marginal = self.model.copy().marginalize(keep=keep)
+            samples = marginal._sample(3)
+            self.assertEqual(len(samples), 3)
+            self.assertEqual([type(v) for v in samples[0]], types)
+
+
+class TestAverage(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+        self.model = MixCondGauss("crabs").fit(df=self.data, fit_algo='full')
+
+    def test_average(self):
+        nums = self.model._numericals
+        np.testing.assert_allclose(self.model.aggregate('average')[2:], self.data[nums].mean(), rtol=0.01)
+
+        # marginalized categorical fields are components of the mixture
+        marginal = self.model.copy().marginalize(keep=['sex', 'RW'])
+        X = self.data.loc[:, ['RW']].iloc[:20]
+        actual = marginal._conditional_average_batch(['RW'], X)
+        expected = Model._conditional_average_batch(marginal, ['RW'], X)
+        self.assertEqual(actual['sex'].tolist(), expected['sex'].tolist())
+
+        marginal = self.model.copy().marginalize(keep=['species', 'FL', 'RW', 'CW'])
+        X = self.data.loc[:, ['species', 'FL']].iloc[:20]
+        actual = marginal._conditional_average_batch(['species', 'FL'], X)
+        expected = Model._conditional_average_batch(marginal, ['species', 'FL'], X)
+        np.testing.assert_allclose(actual.values.astype(float), expected.values.astype(float))
+
+    def test_predict(self):
+        sex, FL, RW = self.model.byname(['sex', 'FL', 'RW'])
+        res = self.model.predict(['sex', 'FL', Aggregation([RW], method='average', yields='RW')],
+                                 splitby=[Split(sex), Split(FL, method='equidist', args=5)])
+        self.assertEqual(res.shape, (10, 3))
+        for sex, fl, rw in res.itertuples(index=False, name=None):
+            conditional = self.model.copy().condition([Condition('sex', '==', sex), Condition('FL', '==', fl)])\
+                .marginalize(keep=['RW'])
+            self.assertAlmostEqual(rw, conditional.aggregate('average')[0])
+
+
+class TestMaximum(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+        self.model = MixCondGauss("crabs").fit(df=self.data, fit_algo='full')
+
+    def _numerical_gradient(self, model, x, eps=1e-6):
+        cat_len = len(model._categoricals)
+        gradient = []
+        for i in range(cat_len, len(x)):
+            upper, lower = list(x), list(x)
+            upper[i] += eps
+            lower[i] -= eps
+            gradient.append((model._density(upper) - model._density(lower)) / (2 * eps))
+        return np.array(gradient)
+
+    def test_gradient(self):
+        for keep in [['sex', 'FL', 'RW'], ['CL', 'CW', 'BD']]:
+            marginal = self.model.copy().marginalize(keep=keep)
+            x = marginal._maximum()
+            x[-1] += 0.5
+            np.testing.assert_allclose(marginal._gradient(x), self._numerical_gradient(marginal, x), rtol=1e-4)
+
+    def test_maximum(self):
+        for keep in [['sex', 'FL', 'RW'], ['CL', 'CW', 'BD'], ['species', 'CW', 'BD']]:
+            marginal = self.model.copy().marginalize(keep=keep)
+            maximum = marginal._maximum()
+            # it is a stationary point, and no mean of a component has larger density
+            self.assertLess(np.abs(marginal._gradient(maximum)).max(), 1e-8)
+            for x in marginal.sample(50).itertuples(index=False, name=None):
+                self.assertGreaterEqual(marginal._density(maximum), marginal._density(list(x)))
+
+    def test_warm_start(self):
+        marginal = self.model.copy().marginalize(keep=['sex', 'FL', 'RW'])
+        maximum = marginal._maximum()
+        # warm starts nearby or at a remote point find the same mode
+        np.testing.assert_allclose(marginal._maximum(x0=maximum)[1:], maximum[1:], rtol=1e-6)
+        remote = marginal.aggregate('maximum', opts={'x0': ['Male', 5, 30]})
+        self.assertEqual(remote[0], maximum[0])
+        np.testing.assert_allclose(remote[1:], maximum[1:], rtol=1e-6)
+
+        # predictions over a split grid are the same with and without warm starts
+        FL, RW, CW = self.model.byname(['FL', 'RW', 'CW'])
+        query = dict(predict=['FL', Aggregation([RW, CW], method='maximum', yields='RW')],
+                     splitby=[Split(FL, method='equidist', args=10)])
+        cold = self.model.predict(**query)
+        self.model.warm_start = True
+        warm = self.model.predict(**query)
+        np.testing.assert_allclose(warm.values.astype(float), cold.values.astype(float), rtol=1e-6)
+        self.assertTrue(self.model.copy().warm_start)
+
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        self.data = genMixedSample(5000, 2, [3]*2, seed=1)
+        self.model = MixCondGauss("mixed").fit(df=self.data, fit_algo='full')
+
+    def _derive(self, model):
+        return model.copy().condition(Condition('g0', '==', 1.0)).marginalize(keep=['c0', 'g1'])
+
+    def test_compress(self):
+        model = self._derive(self.model)
+        compressed = model.copy().compress(0.01)
+        self.assertGreater(compressed.compression_bound, 0)
+        self.assertLessEqual(compressed.compression_bound, 0.01)
+        self.assertLess((compressed._p.values > 0).sum(), model._p.size)
+        self.assertAlmostEqual(compressed._p.values.sum(), 1)
+
+        # the L1 distance of the densities is bounded by twice the removed mass
+        X = model.sample(5000)
+        a, b = model._density_batch(X), compressed._density_batch(X)
+        self.assertLess(np.mean(np.abs(a - b) / a), 2 * compressed.compression_bound + 0.01)
+
+        # batch and pointwise densities agree after compression
+        points = X.iloc[:20]
+        np.testing.assert_allclose(compressed._density_batch(points),
+                                   [compressed._density(list(x)) for x in points.itertuples(index=False)])
+
+    def test_pruned_components(self):
+        model = self._derive(self.model)
+        compressed = model.copy().compress(0.1)
+        # values of marginalized fields without components are dropped, and batch queries skip pruned components
+        self.assertLess(compressed._p.sizes['c1'], model._p.sizes['c1'])
+        self.assertEqual(compressed._batch_factors()['mu'].shape[1], 1)
+        X = model.sample(20)
+        np.testing.assert_allclose(compressed._density_batch(X),
+                                   [compressed._density(list(x)) for x in X.itertuples(index=False)])
+        self.assertEqual(len(compressed.aggregate('maximum')), 2)
+
+    def test_condition_on_pruned_cell(self):
+        data = test_crabs.mixed()
+        model = MixCondGauss('crabs').fit(data, fit_algo='full')
+        compressed = model.copy().compress(0.3)
+        species, sex = compressed._index.decode(int(np.flatnonzero(compressed._p.values.ravel() == 0)[0]))
+        query = [Condition('species', '==', species), Condition('sex', '==', sex)]
+        self.assertGreater(model.copy().condition(query).marginalize(keep=['FL', 'RW']).density([15, 12]), 0)
+
+        # the conditional model of a pruned cell has probability 0
+        pruned = compressed.copy().condition(query).marginalize(keep=['FL', 'RW'])
+        self.assertEqual(pruned.density([15, 12]), 0)
+        np.testing.assert_array_equal(pruned._density_batch(data.loc[:, ['FL', 'RW']]), 0)
+        self.assertEqual(pruned._probability_batch(pd.DataFrame([[[10, 20], [10, 20]]], columns=['FL', 'RW']))[0], 0)
+        pruned = compressed.copy().condition(query + [Condition('FL', '==', 15)]).marginalize(keep=['RW'])
+        self.assertEqual(pruned.density([12]), 0)
+
+    def test_auto_compress(self):
+        self.model.auto_compress = 0.001
+        derived = self._derive(self.model)
+        self.assertEqual(derived.auto_compress, 0.001)
+        self.assertGreater(derived.compression_bound, 0)
+        self.assertLessEqual(derived.compression_bound, 0.001)
+
+        with self.assertRaises(ValueError):
+            derived.compress(1)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
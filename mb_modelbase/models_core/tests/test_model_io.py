@@ -0,0 +1,193 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for model_io.py
+"""
+
+import os
+import tempfile
+import unittest
+
+import dill
+import numpy as np
+import numpy.testing as npt
+
+from mb_modelbase.models_core import data_operations
+from mb_modelbase.models_core import kde_backends
+from mb_modelbase.models_core import model_io
+from mb_modelbase.models_core.base import Condition
+from mb_modelbase.models_core.models import Model
+from mb_modelbase.models_core.categoricals import CategoricalModel
+from mb_modelbase.models_core.empirical_model import EmpiricalModel
+from mb_modelbase.models_core.kde_model import KDEModel
+from mb_modelbase.models_core.mixable_cond_gaussian import MixableCondGaussianModel
+from mb_modelbase.models_core.tests import test_crabs
+
+
+def _is_memory_mapped(arr):
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return True
+        arr = arr.base
+    return False
+
+
+class TestBinaryModelFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data = test_crabs.mixed()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _roundtrip(self, model, **kwargs):
+        path = model.save(self.dir.name, **kwargs)
+        return path, Model.load(path)
+
+    def test_mixable_cond_gaussian(self):
+        model = MixableCondGaussianModel('crabs').fit(self.data, fit_algo='full')
+        path, loaded = self._roundtrip(model)
+
+        self.assertTrue(model_io.is_binary_model_file(path))
+        self.assertEqual(loaded.names, model.names)
+        self.assertEqual(loaded.mode, model.mode)
+        x = ['Blue', 'Female', 10, 10, 20, 20, 10]
+        self.assertAlmostEqual(loaded.density(x), model.density(x))
+
+        # parameters and data are memory mapped
+        self.assertTrue(_is_memory_mapped(loaded._S.values))
+        self.assertTrue(any(_is_memory_mapped(b.values) for b in loaded.data._mgr.blocks))
+
+        # derived models work and do not change the loaded model
+        marginal = loaded.copy().marginalize(keep=['species', 'FL'])
+        self.assertAlmostEqual(marginal.density(['Blue', 10]),
+                               model.copy().marginalize(keep=['species', 'FL']).density(['Blue', 10]))
+        self.assertAlmostEqual(loaded.density(x), model.density(x))
+
+        # the header is readable without loading the model
+        header = model_io.read_header(path)
+        self.assertEqual(header['format_version'], model_io.FORMAT_VERSION)
+        self.assertEqual(header['name'], 'crabs')
+        self.assertEqual([f['name'] for f in header['fields']], model.names)
+        self.assertEqual(header['class'], 'mb_modelbase.models_core.mixable_cond_gaussian.MixableCondGaussianModel')
+
+    def test_other_models(self):
+        for model in [CategoricalModel('cat').fit(self.data.loc[:, ['species', 'sex']]),
+                      EmpiricalModel('emp').fit(self.data)]:
+            path, loaded = self._roundtrip(model)
+            self.assertTrue(model_io.is_binary_model_file(path))
+            self.assertEqual(loaded.names, model.names)
+            self.assertTrue(loaded.data.equals(model.data))
+
+    def test_dill(self):
+        model = CategoricalModel('cat').fit(self.data.loc[:, ['species', 'sex']])
+
+        # explicitly requested
+        path, loaded = self._roundtrip(model, format='dill')
+        self.assertFalse(model_io.is_binary_model_file(path))
+        self.assertEqual(loaded.names, model.names)
+
+        # formerly stored models
+        path = os.path.join(self.dir.name, 'old.mdl')
+        with open(path, 'wb') as f:
+            dill.dump(model, f, dill.HIGHEST_PROTOCOL)
+        self.assertEqual(Model.load(path).names, model.names)
+
+        with self.assertRaises(ValueError):
+            model.save(self.dir.name, format='foo')
+
+    def test_future_version(self):
+        model = CategoricalModel('cat').fit(self.data.loc[:, ['species', 'sex']])
+        path = model.save(self.dir.name)
+        with open(path, 'r+b') as f:
+            content = f.read()
+            f.seek(0)
+            f.write(content.replace(b'"format_version": 1', b'"format_version": 9'))
+        with self.assertRaises(ValueError):
+            Model.load(path)
+
+    def test_verify(self):
+        model = MixableCondGaussianModel('cg').fit(self.data, fit_algo='full')
+        path = model.save(self.dir.name)
+        self.assertEqual(Model.load(path, verify=True).names, model.names)
+
+        # corrupt the last byte of the last array
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xff]))
+        Model.load(path)
+        with self.assertRaises(ValueError):
+            Model.load(path, verify=True)
+
+
+class TestLegacyModelFiles(unittest.TestCase):
+    """The files in `legacy_models` are models pickled with dill by an earlier version of the modelbase, i.e. before
+    the binary model format was introduced. They are fitted to subsets of the crabs data."""
+
+    @staticmethod
+    def _load(name):
+        return Model.load(os.path.join(os.path.dirname(__file__), 'legacy_models', name + '.mdl'))
+
+    def test_upgrade(self):
+        model = self._load('categorical')
+        self.assertIsInstance(model, CategoricalModel)
+        self.assertFalse(model.warm_start)
+        self.assertEqual(model.compression_bound, 0.0)
+        self.assertIsNone(model.auto_compress)
+
+        # upgrading an up to date model does not change it
+        fitted = CategoricalModel('cat').fit(test_crabs.categorical())
+        fitted.warm_start = True
+        self.assertIs(fitted._upgrade(), fitted)
+        self.assertTrue(fitted.warm_start)
+
+    def test_categorical_index(self):
+        for name in ['categorical', 'cgwm', 'cg', 'mixable']:
+            model = self._load(name)
+            # a copy is built from the parameters only
+            expected = model.copy()
+            for x in model.data.iloc[:5].values.tolist():
+                self.assertAlmostEqual(model.density(x), expected.density(x))
+            marginal = model.copy().marginalize(keep=model.names[:2])
+            self.assertAlmostEqual(marginal.density(x[:2]), expected.marginalize(keep=model.names[:2]).density(x[:2]))
+
+    def test_empirical(self):
+        model = self._load('empirical')
+        data = model._emp_data
+        for x in data.iloc[:5].values.tolist():
+            self.assertEqual(model.density(x), data_operations.density(data, x))
+        event = [['Orange'], ['Female'], [10, 20], [5, 15], [20, 40], [20, 50], [5, 20]]
+        self.assertAlmostEqual(model.probability(event), data_operations.probability(data, event))
+        marginal = model.copy().marginalize(keep=['species', 'sex'])
+        x = ['Orange', 'Female']
+        self.assertEqual(marginal.density(x), data_operations.density(data.iloc[:, :2], x))
+
+    def test_kde(self):
+        model = self._load('kde')
+        self.assertIsInstance(model.kde, kde_backends.BackendCache)
+        # the density as computed by the earlier version
+        x = ['Blue', 'Female', 16.4, 14.0]
+        self.assertAlmostEqual(model.density(x), 0.011059736151915885)
+
+        expected = KDEModel('kde').fit(model.data.loc[:, model.names])
+        conditional = model.copy().condition([Condition('FL', '==', 16.4)]).marginalize(remove=['FL'])
+        expected.condition([Condition('FL', '==', 16.4)]).marginalize(remove=['FL'])
+        x = ['Blue', 'Female', 14.0]
+        self.assertAlmostEqual(conditional.density(x), expected.density(x))
+
+    def test_gaussians(self):
+        # the densities as computed by the earlier version
+        x = [10.7, 9.7, 21.4, 24.0, 9.8]
+        for name, density, marginal_density in [('mvg', 0.0012611869244043294, 0.02780438860656387),
+                                                ('mog', 282.62587765171537, 0.029966972786887463)]:
+            model = self._load(name)
+            npt.assert_allclose(model.density(x), density, rtol=1e-7)
+            npt.assert_allclose(model.copy().marginalize(keep=['FL', 'RW']).density(x[:2]), marginal_density, rtol=1e-7)
+
+
+if __name__ == '__main__':
+    unittest.main()
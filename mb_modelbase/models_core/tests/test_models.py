@@ -331,6 +331,41 @@ class TestAllModels(unittest.TestCase):
             self.assertEqual(model.mode, 'both')
 
 
+class TestMemoryFootprint(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_iris.mixed()
+        self.model = MixableCondGaussianModel("iris").fit(df=self.data, fit_algo="full")
+
+    def test_breakdown(self):
+        footprint = self.model.memory_footprint()
+        for component in ['data', 'test_data', 'fields', 'parameters', 'other']:
+            self.assertIn(component, footprint)
+            self.assertGreaterEqual(footprint[component], 0)
+        self.assertGreater(footprint['data'], 0)
+        self.assertGreater(footprint['parameters'], 0)
+        self.assertEqual(footprint['total'], sum(v for k, v in footprint.items() if k != 'total'))
+
+        # marginals have fewer parameters
+        marginal = self.model.copy().marginalize(keep=['species', 'sepal_width'])
+        self.assertLess(marginal.memory_footprint()['parameters'], footprint['parameters'])
+
+    def test_modelbase(self):
+        from mb_modelbase.server.modelbase import ModelBase
+        import json
+        mb = ModelBase("test", load_all=False, watchdog=False)
+        mb.add(self.model)
+        mb.add(self.model.copy("iris2"))
+
+        header = json.loads(mb.execute({'SHOW': 'HEADER', 'FROM': 'iris'}))
+        self.assertEqual(header['memory']['total'], self.model.memory_footprint()['total'])
+
+        memory = json.loads(mb.execute({'SHOW': 'MEMORY'}))
+        self.assertEqual(set(memory['models'].keys()), {'iris', 'iris2'})
+        # data is shared between the model and its copy and must be accounted only once
+        self.assertLess(memory['total'], sum(m['total'] for m in memory['models'].values()))
+
+
 class TestParallelProcessing(unittest.TestCase):
 
     def setUp(self):
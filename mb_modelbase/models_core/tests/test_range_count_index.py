@@ -0,0 +1,66 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for range_count_index.py
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from mb_modelbase.models_core import data_operations as data_op
+from mb_modelbase.models_core.empirical_model import EmpiricalModel
+from mb_modelbase.models_core.frequency_index import FrequencyIndex
+from mb_modelbase.models_core.range_count_index import RangeCountIndex
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestRangeCountIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+
+    def _random_boxes(self, df, n, rs):
+        boxes = []
+        for _ in range(n):
+            box = []
+            for name in df.columns:
+                column = df[name]
+                if column.dtype == object:
+                    levels = column.unique()
+                    box.append(list(rs.choice(levels, rs.randint(1, len(levels) + 1), replace=False)))
+                else:
+                    box.append(sorted(rs.choice(column.values, 2)))
+            boxes.append(box)
+        return boxes
+
+    def test_count(self):
+        rs = np.random.RandomState(1)
+        for names in [['species', 'FL'], ['species', 'sex', 'FL', 'RW'], ['FL', 'RW', 'CL'], ['sex'], ['FL', 'RW']]:
+            df = self.data.loc[:, names]
+            boxes = self._random_boxes(df, 50, rs)
+            expected = [data_op.probability(df, box) for box in boxes]
+            for max_grid_size in [2**22, 0]:
+                index = RangeCountIndex(FrequencyIndex.from_data(df), max_grid_size=max_grid_size)
+                np.testing.assert_allclose(index.probability(boxes), expected)
+
+    def test_model(self):
+        model = EmpiricalModel('crabs').fit(self.data)
+        model.marginalize(keep=['species', 'sex', 'FL', 'RW'])
+        domains = pd.DataFrame(self._random_boxes(model._emp_data, 20, np.random.RandomState(2)), columns=model.names)
+        expected = [data_op.probability(model._emp_data, box) for box in domains.itertuples(index=False)]
+        np.testing.assert_allclose(model._probability_batch(domains), expected)
+
+        # the index follows conditioning
+        model.byname('FL')['domain'].setlowerbound(15)
+        model.marginalize(remove=['FL'])
+        domains = domains.loc[:, model.names]
+        expected = [data_op.probability(model._emp_data, box) for box in domains.itertuples(index=False)]
+        np.testing.assert_allclose(model._probability_batch(domains), expected)
+        self.assertAlmostEqual(model._probability(list(domains.iloc[0])), expected[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
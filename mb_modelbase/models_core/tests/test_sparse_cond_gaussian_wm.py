@@ -0,0 +1,98 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for sparse_cond_gaussian_wm.py
+"""
+
+import unittest
+
+import numpy as np
+
+from mb_modelbase.models_core.base import Condition
+from mb_modelbase.models_core.cond_gaussian_wm import CgWmModel
+from mb_modelbase.models_core.sparse_cond_gaussian_wm import SparseCgWmModel
+from mb_modelbase.models_core.cond_gaussian.datasampling import genMixedSample
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestSparseCgWmModel(unittest.TestCase):
+
+    def setUp(self):
+        self.data = test_crabs.mixed()
+        self.model = SparseCgWmModel('crabs').fit(self.data)
+
+        # a dense model with identical parameters. all cells of the crabs data occur, hence the sparse model stores
+        # all cells. it differs from CgWmModel only in the (unsmoothed) p
+        self.dense = CgWmModel('crabs_dense').fit(self.data)
+        self.dense._p = self.dense._p.copy(data=self.model.to_dense()[0].values)
+        self.dense._update()
+
+    def _assert_equal_densities(self, derive):
+        sparse, dense = derive(self.model.copy()), derive(self.dense.copy())
+        self.assertEqual(sparse.names, dense.names)
+        X = self.data.loc[:, sparse.names]
+        expected = np.array([dense._density(list(x)) for x in X.itertuples(index=False)], dtype=float)
+        actual = np.array([sparse._density(list(x)) for x in X.itertuples(index=False)], dtype=float)
+        np.testing.assert_allclose(actual, expected, rtol=1e-8)
+        np.testing.assert_allclose(sparse._density_batch(X), expected, rtol=1e-8)
+        self.assertEqual(sparse._maximum()[:len(sparse._categoricals)], dense._maximum()[:len(dense._categoricals)])
+
+        # averages, also conditional ones given the first field
+        cat_len = len(sparse._categoricals)
+        average, expected_average = sparse.aggregate('average'), dense.aggregate('average')
+        self.assertEqual(average[:cat_len], expected_average[:cat_len])
+        np.testing.assert_allclose(average[cat_len:], expected_average[cat_len:], rtol=1e-8)
+        given = X.iloc[:5, :1]
+        actual = sparse._conditional_average_batch(list(given.columns), given)
+        expected = dense._conditional_average_batch(list(given.columns), given)
+        cat_len = len([name for name in sparse._categoricals if name not in given.columns])
+        self.assertTrue(actual.iloc[:, :cat_len].equals(expected.iloc[:, :cat_len]))
+        np.testing.assert_allclose(actual.values[:, cat_len:].astype(float), expected.values[:, cat_len:].astype(float),
+                                   rtol=1e-8)
+
+        cat_domains = [list(set(X[name].iloc[:2])) for name in sparse._categoricals]
+        num_domains = [[X[name].iloc[0] - 1, X[name].iloc[1] + 1] for name in sparse._numericals]
+        # the multivariate normal CDF is integrated numerically with an absolute error of about 1e-5
+        self.assertAlmostEqual(sparse.probability(cat_domains + num_domains), dense.probability(cat_domains + num_domains),
+                               places=5)
+
+    def test_equals_dense(self):
+        self._assert_equal_densities(lambda m: m)
+        self._assert_equal_densities(lambda m: m.marginalize(keep=['species', 'FL', 'RW']))
+        self._assert_equal_densities(lambda m: m.marginalize(keep=['FL', 'CW']))
+        self._assert_equal_densities(lambda m: m.marginalize(keep=['sex']))
+        self._assert_equal_densities(
+            lambda m: m.condition(Condition('sex', '==', 'Male')).marginalize(keep=['species', 'FL', 'RW']))
+        self._assert_equal_densities(
+            lambda m: m.condition(Condition('FL', '==', 15)).marginalize(keep=['species', 'sex', 'RW']))
+
+    def test_many_categoricals(self):
+        data = genMixedSample(2000, 2, [6]*8, seed=1)
+        model = SparseCgWmModel('many').fit(data)
+
+        # only the cells that occur are stored, instead of 6**8
+        self.assertLessEqual(len(model._p), len(model.data))
+        self.assertAlmostEqual(model._p.sum(), 1)
+
+        # conditioning and marginalizing works on cells
+        marginal = model.copy().marginalize(keep=['c0', 'c1', 'g0'])
+        self.assertLessEqual(len(marginal._p), 36)
+        conditional = model.copy().condition(Condition('c0', '==', 'val0')).marginalize(keep=['c1', 'g1'])
+        self.assertAlmostEqual(conditional._p.sum(), 1)
+        self.assertEqual(conditional.names, ['c1', 'g1'])
+
+        # unobserved cells have density 0
+        key = next(k for k in range(model._index.size) if k not in model._key2row)
+        codes = np.unravel_index(key, model._index.shape)
+        point = [levels[c] for levels, c in zip(model._index.levels, codes)] + [0.0, 0.0]
+        self.assertEqual(model._density(point), 0)
+
+    def test_sample(self):
+        samples = self.model.sample(5000)
+        self.assertEqual(list(samples.columns), self.model.names)
+        np.testing.assert_allclose(samples['FL'].mean(), self.data['FL'].mean(), rtol=0.03)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,2 +1,3 @@
 from mb_modelbase.server.modelbase import *
+from mb_modelbase.server.prefork import *
 #from mb_modelbase.server.tests import *
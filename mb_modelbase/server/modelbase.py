@@ -266,6 +266,21 @@ class ModelBase:
     def list_models(self):
         return list(self.models.keys())
 
+    def memory_footprint(self):
+        """Returns the memory occupied by the models of this modelbase.
+
+        Returns: dict
+            A dict with the keys 'models' and 'total'. 'models' maps model names to their footprint as returned by
+            `Model.memory_footprint`. 'total' is the total number of bytes occupied by all models, where objects
+            shared between models (e.g. the data of derived models) are accounted only once.
+        """
+        seen = set()
+        total = sum(model.memory_footprint(seen)['total'] for model in self.models.values())
+        return {
+            'models': {name: model.memory_footprint() for name, model in self.models.items()},
+            'total': total
+        }
+
     def execute(self, query):
         """ Executes the given PQL query and returns the result as JSON (or None).
 
@@ -358,8 +373,11 @@ class ModelBase:
             if show == "HEADER":
                 model = self._extractFrom(query)
                 result = model.as_json()
+                result['memory'] = model.memory_footprint()
             elif show == "MODELS":
                 result = {'models': self.list_models()}
+            elif show == "MEMORY":
+                result = self.memory_footprint()
             else:
                 raise ValueError("invalid value given in SHOW-clause: " + str(show))
             return _json_dumps(result)
@@ -436,7 +454,7 @@ class ModelBase:
         if 'SHOW' not in query:
             raise QuerySyntaxError("'SHOW'-statement missing")
         what = query['SHOW']
-        if what not in ["HEADER", "MODELS"]:
+        if what not in ["HEADER", "MODELS", "MEMORY"]:
             raise QueryValueError("Invalid value of SHOW-statement: " + what)
         return what
 
@@ -0,0 +1,234 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+The prefork module provides the PreforkModelBase class, which serves PQL queries of a ModelBase from multiple worker
+processes.
+"""
+
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _serve(modelbase, conn):
+    """Main loop of a worker process: execute queries received on `conn` on `modelbase` and send back results."""
+    while True:
+        try:
+            query = conn.recv()
+        except EOFError:
+            break
+        if query is None:
+            break
+        try:
+            result = ('ok', modelbase.execute(query))
+        except Exception as err:
+            result = ('error', err)
+        try:
+            conn.send(result)
+        except Exception as err:
+            # the exception may not be picklable
+            conn.send(('error', RuntimeError(repr(result[1]) if result[0] == 'error' else repr(err))))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def execute(self, query, acquired=False):
+        """Executes `query` on this worker and returns its result. Set acquired to True if the lock of this worker
+        is already acquired by the caller."""
+        if not acquired:
+            self.lock.acquire()
+        try:
+            self.conn.send(query)
+            status, result = self.conn.recv()
+        finally:
+            self.lock.release()
+        if status == 'error':
+            raise result
+        return result
+
+
+class PreforkModelBase:
+    """Serves PQL queries of a ModelBase from multiple worker processes.
+
+    The given ModelBase, with all its models, is forked into `workers` processes. Since the workers are forked, they
+    share the memory of the models copy-on-write with the master (and with each other). Using the binary model format
+    (see `Model.save`) the loaded models additionally share the page cache of the model files.
+
+    It provides the same `execute` method as `ModelBase` and dispatches queries to the workers as follows:
+
+      * Queries on models that exist in all workers (i.e. that existed when forking) are served by any idle worker.
+      * A model derived by `MODEL ... AS` is only created in the worker that served the query and all subsequent
+        queries on it (or on models derived from it) are routed to that worker. If `replicate_derived` is set,
+        derived models are instead created in all workers, such that queries on them can be served by any worker.
+      * Queries that modify models that exist in all workers (i.e. `DROP` and `MODEL` with `AS` equal to `FROM`),
+        as well as `RELOAD` are broadcast to all workers.
+      * `SHOW MODELS` and `SHOW MEMORY` collect the answers of all workers.
+
+    The dispatcher is thread-safe, i.e. it may be called from the threads of a web server. Call `close()` to
+    terminate the workers.
+    """
+
+    def __init__(self, modelbase, workers=None, replicate_derived=False):
+        """Forks the workers.
+
+        Args:
+            modelbase: ModelBase
+                The modelbase to serve. Its models should be loaded already. Do not start its watchdog, since it
+                would not be forked into the workers.
+            workers: int, optional.
+                The number of workers. Defaults to the number of CPUs.
+            replicate_derived: bool, optional.
+                Create derived models in all workers. Defaults to False.
+        """
+        self.modelbase = modelbase
+        self.name = modelbase.name
+        self.replicate_derived = replicate_derived
+        if workers is None:
+            workers = mp.cpu_count()
+        if workers < 1:
+            raise ValueError("invalid number of workers: {}".format(workers))
+
+        ctx = mp.get_context('fork')
+        self._workers = []
+        for _ in range(workers):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_serve, args=(modelbase, child_conn))
+            process.start()
+            child_conn.close()
+            self._workers.append(_Worker(process, parent_conn))
+        logger.info("forked {} workers for modelbase '{}'".format(workers, self.name))
+
+        self._pinned = {}  # name of model to index of the only worker that holds it
+        self._lock = threading.Lock()  # guards _pinned
+        self._round_robin = itertools.cycle(range(workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Terminates all workers."""
+        for worker in self._workers:
+            with worker.lock:
+                try:
+                    worker.conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            worker.process.join()
+            worker.conn.close()
+        self._workers = []
+
+    def _any_worker(self):
+        """Returns the index of an idle worker (with its lock acquired) or, if all are busy, of the next worker in
+        round-robin order (with its lock acquired after waiting for it)."""
+        start = next(self._round_robin)
+        n = len(self._workers)
+        for i in range(n):
+            idx = (start + i) % n
+            if self._workers[idx].lock.acquire(blocking=False):
+                return idx
+        self._workers[start].lock.acquire()
+        return start
+
+    def _execute_on(self, idx, query):
+        return self._workers[idx].execute(query)
+
+    def _broadcast(self, query):
+        return [worker.execute(query) for worker in self._workers]
+
+    def _pinned_worker(self, name):
+        with self._lock:
+            return self._pinned.get(name)
+
+    def _route(self, name, query):
+        """Executes query on the worker that holds the model `name`, or any worker if all hold it."""
+        idx = self._pinned_worker(name)
+        if idx is None:
+            idx = self._any_worker()
+            return self._workers[idx].execute(query, acquired=True)
+        return self._execute_on(idx, query)
+
+    def execute(self, query):
+        """Executes the given PQL query on a worker and returns the result as JSON (or None).
+
+        See `ModelBase.execute` for details.
+        """
+        if isinstance(query, str):
+            query = json.loads(query)
+
+        if 'MODEL' in query:
+            base_name, name = query.get('FROM'), query.get('AS')
+            base_idx = self._pinned_worker(base_name)
+            if base_idx is not None:
+                # base only exists in one worker: so does the derived model
+                result = self._execute_on(base_idx, query)
+                with self._lock:
+                    self._pinned[name] = base_idx
+            elif name == base_name or self.replicate_derived:
+                result = self._broadcast(query)[0]
+                with self._lock:
+                    self._pinned.pop(name, None)
+            else:
+                idx = self._any_worker()
+                result = self._workers[idx].execute(query, acquired=True)
+                with self._lock:
+                    self._pinned[name] = idx
+            return result
+
+        elif 'DROP' in query:
+            name = query['DROP']
+            with self._lock:
+                idx = self._pinned.pop(name, None)
+            if idx is not None:
+                return self._execute_on(idx, query)
+            return self._broadcast(query)[0]
+
+        elif 'SHOW' in query and query['SHOW'] in ('MODELS', 'MEMORY'):
+            results = [json.loads(r) for r in self._broadcast(query)]
+            if query['SHOW'] == 'MODELS':
+                models = []
+                for result in results:
+                    models.extend(m for m in result['models'] if m not in models)
+                return json.dumps({'models': models})
+            else:
+                models = {}
+                for result in results:
+                    models.update(result['models'])
+                # memory shared copy-on-write is counted for each worker, hence this is an upper bound
+                return json.dumps({'models': models, 'total': sum(r['total'] for r in results)})
+
+        elif 'RELOAD' in query:
+            return self._broadcast(query)[0]
+
+        elif 'FROM' in query:
+            return self._route(query['FROM'], query)
+
+        else:
+            # let any worker report the error
+            idx = self._any_worker()
+            return self._workers[idx].execute(query, acquired=True)
+
+    def upload_files(self, models):
+        """Saves the given dill-dumped models into the model directory and loads them into all workers.
+
+        See `ModelBase.upload_files`.
+        """
+        result = self.modelbase.upload_files(models)
+        self._broadcast({'RELOAD': '*'})
+        return result
+
+    def list_models(self):
+        return json.loads(self.execute({'SHOW': 'MODELS'}))['models']
@@ -0,0 +1,79 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for the prefork module
+"""
+
+import json
+import threading
+import unittest
+
+from mb_modelbase.server.modelbase import ModelBase, QueryValueError
+from mb_modelbase.server.prefork import PreforkModelBase
+from mb_modelbase.models_core.categoricals import CategoricalModel
+from mb_modelbase.models_core.tests import test_crabs
+
+
+class TestPreforkModelBase(unittest.TestCase):
+
+    def setUp(self):
+        mb = ModelBase("test", load_all=False, watchdog=False)
+        mb.add(CategoricalModel('crabs').fit(test_crabs.mixed().loc[:, ['species', 'sex']]))
+        self.mb = mb
+        self.pmb = PreforkModelBase(mb, workers=3)
+
+    def tearDown(self):
+        self.pmb.close()
+
+    def _predict(self, name):
+        return self.pmb.execute({'PREDICT': ['sex', {'name': ['sex'], 'aggregation': 'probability'}],
+                                 'FROM': name, 'SPLIT BY': [{'name': 'sex', 'split': 'elements', 'args': []}]})
+
+    def test_queries(self):
+        expected = self.mb.execute({'PREDICT': ['sex', {'name': ['sex'], 'aggregation': 'probability'}],
+                                    'FROM': 'crabs', 'SPLIT BY': [{'name': 'sex', 'split': 'elements', 'args': []}]})
+        self.assertEqual(self._predict('crabs'), expected)
+
+        # concurrent queries from multiple threads
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self._predict('crabs'))) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [expected] * 10)
+
+        with self.assertRaises(QueryValueError):
+            self._predict('foo')
+
+    def test_derived_models(self):
+        self.pmb.execute({'MODEL': ['sex'], 'FROM': 'crabs', 'AS': 'crabs_sex'})
+        self.pmb.execute({'MODEL': ['sex'], 'FROM': 'crabs_sex', 'AS': 'crabs_sex2'})
+        self.assertEqual(set(self.pmb.list_models()), {'crabs', 'crabs_sex', 'crabs_sex2'})
+
+        # derived models are served by the worker that holds them, no matter how often we ask
+        for _ in range(6):
+            header = json.loads(self.pmb.execute({'SHOW': 'HEADER', 'FROM': 'crabs_sex2'}))
+            self.assertEqual([f['name'] for f in header['fields']], ['sex'])
+            self._predict('crabs_sex')
+
+        self.pmb.execute({'DROP': 'crabs_sex'})
+        self.assertEqual(set(self.pmb.list_models()), {'crabs', 'crabs_sex2'})
+
+        # the master is not affected
+        self.assertEqual(self.mb.list_models(), ['crabs'])
+
+    def test_replicate_derived(self):
+        self.pmb.replicate_derived = True
+        self.pmb.execute({'MODEL': ['sex'], 'FROM': 'crabs', 'AS': 'crabs_sex'})
+        for worker in range(3):
+            result = json.loads(self.pmb._workers[worker].execute({'SHOW': 'MODELS'}))
+            self.assertEqual(set(result['models']), {'crabs', 'crabs_sex'})
+
+        memory = json.loads(self.pmb.execute({'SHOW': 'MEMORY'}))
+        self.assertEqual(set(memory['models'].keys()), {'crabs', 'crabs_sex'})
+
+
+if __name__ == '__main__':
+    unittest.main()
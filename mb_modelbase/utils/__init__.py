@@ -1,6 +1,59 @@
-from mb_modelbase.utils.activity_logger import *
-from mb_modelbase.utils.utils import *
-from mb_modelbase.utils.crossjoin import *
-from mb_modelbase.utils.tests import *
-from mb_modelbase.utils.fit_models import *
-from mb_modelbase.utils.data_import_utils import *
\ No newline at end of file
+"""
+Utilities of the modelbase.
+
+Submodules are imported lazily, i.e. accessing a public name, like `utils.no_nan`, only imports the submodule that
+defines it. In particular, importing this package does not import any model classes.
+"""
+import importlib
+import importlib.util
+
+# public names by the submodule that defines them
+_lazy_names = {
+    'activity_logger': ['ActivityLogger'],
+    'utils': ['assert_all_psd', 'is_psd', 'numpy_to_xarray_params', 'validate_opts', 'update_opts', 'mergebyidx2',
+              'mergebyidx', 'rolling_1d_mean', 'equiweightedintervals', 'shortest_interval', 'unique_list',
+              'sort_filter_list', 'random_id_generator', 'linear_id_generator', 'issorted', 'invert_indexes',
+              'invert_sequence', 'log_it', 'schur_complement', 'is_running_in_debug_mode', 'truncate_string', 'no_nan',
+              'cumulative_density', 'inverse_transform_sampling', 'negligible_weights', 'deep_update', 'all_numeric',
+              'alignment_permutation', 'deep_sizeof'],
+    'crossjoin': ['crossjoin'],
+    'fit_models': ['make_empirical_model', 'save_models', 'fit_models'],
+    'data_import_utils': ['split_training_test_data', 'normalize_dataframe', 'clean_dataframe', 'get_columns_by_dtype',
+                          'get_discrete_fields', 'get_numerical_fields', 'to_category_cols'],
+}
+
+# submodules that are searched (in this order) for any other name. This keeps names available that used to be
+# exported by star-imports of these submodules.
+_fallback_modules = ['utils', 'crossjoin', 'data_import_utils', 'activity_logger', 'fit_models', 'tests']
+
+_name2module = {name: module for module, names in _lazy_names.items() for name in names}
+
+__all__ = list(_name2module.keys())
+
+
+def _import(module):
+    return importlib.import_module('.' + module, __name__)
+
+
+def __getattr__(name):
+    if name in _name2module:
+        value = getattr(_import(_name2module[name]), name)
+    elif name.startswith('_'):
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    elif importlib.util.find_spec('.' + name, __name__) is not None:
+        # a submodule
+        value = _import(name)
+    else:
+        for module in _fallback_modules:
+            module = _import(module)
+            if hasattr(module, name):
+                value = getattr(module, name)
+                break
+        else:
+            raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
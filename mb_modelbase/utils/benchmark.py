@@ -0,0 +1,339 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+Reproducible benchmarks of PQL workloads across model classes.
+
+The benchmark generates synthetic mixed categorical/numerical data of configurable size, fits a number of model
+classes to it and times a canonical mix of queries against each fitted model:
+
+  * 'density': density queries on a grid over (up to) two numerical fields, as issued for heatmaps.
+  * 'probability': probability queries over the splits of a single field, as issued for histograms/bar charts.
+  * 'maximum': maximum aggregations split by a single field, as issued for the 'marks' of a dashboard.
+  * 'select': selection of the training data with a condition.
+  * 'sample': drawing samples from the model.
+
+Results are plain JSON-serializable dicts. Use `compare_results` to diff a run against a stored baseline run. See
+`scripts/benchmark.py` for a command line interface.
+
+@author: Philipp Lucas
+"""
+
+import json
+import logging
+import platform
+import statistics
+import time
+import traceback
+
+import numpy as np
+
+from mb_modelbase.models_core import base
+from mb_modelbase.models_core.cond_gaussian import datasampling
+from mb_modelbase.utils.fit_models import fit_models
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_FORMAT_VERSION = 1
+
+QUERY_NAMES = ('density', 'probability', 'maximum', 'select', 'sample')
+
+
+def _spn_spec(data):
+    from mb_modelbase.models_core.spflow import SPNModel
+    from spn.structure.leaves.parametric.Parametric import Categorical, Gaussian
+    var_types = {name: (Categorical if data[name].dtype == object else Gaussian) for name in data.columns}
+    return {'class': SPNModel, 'data': data, 'fitopts': {'var_types': var_types}}
+
+
+def default_specs(data):
+    """Returns the specification of the models to benchmark for given data.
+
+    The returned dict follows the specification format of `fit_models`. Model classes are imported lazily, such that
+    optional dependencies (like spflow) only need to be available if the corresponding model is benchmarked.
+
+    Args:
+        data: dict
+            Data sets as returned by `make_data`.
+    """
+    def cgwm():
+        from mb_modelbase.models_core.cond_gaussian_wm import CgWmModel
+        return {'class': CgWmModel, 'data': data['mixed']}
+
+    def scgwm():
+        from mb_modelbase.models_core.sparse_cond_gaussian_wm import SparseCgWmModel
+        return {'class': SparseCgWmModel, 'data': data['mixed']}
+
+    def mcg():
+        from mb_modelbase.models_core.mixable_cond_gaussian import MixableCondGaussianModel
+        return {'class': MixableCondGaussianModel, 'data': data['mixed'], 'fitopts': {'fit_algo': 'full'}}
+
+    def kde():
+        from mb_modelbase.models_core.kde_model import KDEModel
+        return {'class': KDEModel, 'data': data['mixed']}
+
+    def emp():
+        from mb_modelbase.models_core.empirical_model import EmpiricalModel
+        return {'class': EmpiricalModel, 'data': data['mixed']}
+
+    def cat():
+        from mb_modelbase.models_core.categoricals import CategoricalModel
+        return {'class': CategoricalModel, 'data': data['categorical']}
+
+    def spn():
+        return _spn_spec(data['mixed'])
+
+    def gaussian():
+        from mb_modelbase.models_core.gaussians import MultiVariateGaussianModel
+        return {'class': MultiVariateGaussianModel, 'data': data['numerical']}
+
+    return {
+        'cgwm': cgwm,
+        'scgwm': scgwm,
+        'mcg': mcg,
+        'kde': kde,
+        'emp': emp,
+        'cat': cat,
+        'spn': spn,
+        'gaussian': gaussian,
+    }
+
+
+def make_data(rows=1000, num_dims=2, cat_levels=(3, 2), seed=1):
+    """Returns a dict of synthetic data sets for benchmarking.
+
+    The keys are 'mixed', 'categorical' and 'numerical', where the latter two are the respective columns of the
+    'mixed' data set. See `datasampling.genMixedSample` for details on the data.
+    """
+    df = datasampling.genMixedSample(rows, num_dims, list(cat_levels), seed=seed)
+    cat_names = [name for name in df.columns if name.startswith('c')]
+    num_names = [name for name in df.columns if name.startswith('g')]
+    return {
+        'mixed': df,
+        'categorical': df.loc[:, cat_names],
+        'numerical': df.loc[:, num_names],
+    }
+
+
+def _split(field, split_cnt):
+    if field['dtype'] == 'string':
+        return base.Split(field, 'elements')
+    return base.Split(field, 'equiinterval', [split_cnt])
+
+
+def default_workload(model, split_cnt=10, sample_cnt=1000):
+    """Returns the canonical query workload for given model as a dict of query name to a callable that runs it.
+
+    Args:
+        model: Model
+            The model to run the queries on.
+        split_cnt: int, optional.
+            Number of splits per numerical field. Defaults to 10.
+        sample_cnt: int, optional.
+            Number of samples to draw. Defaults to 1000.
+    """
+    fields = model.fields
+    nums = [f for f in fields if f['dtype'] == 'numerical']
+    split_field = fields[0]
+    grid_fields = nums[:2] if len(nums) > 0 else fields[:2]
+    grid_names = [f['name'] for f in grid_fields]
+    aggr_fields = fields[1:] if len(fields) > 1 else fields
+    aggr_names = [f['name'] for f in aggr_fields]
+
+    def density():
+        return model.predict(predict=grid_names + [base.Density(grid_names)],
+                             splitby=[_split(f, split_cnt) for f in grid_fields])
+
+    def probability():
+        return model.predict(predict=[split_field['name'], base.Probability(split_field)],
+                             splitby=[_split(split_field, split_cnt)])
+
+    def maximum():
+        return model.predict(predict=[split_field['name'],
+                                      base.Aggregation(aggr_names, method='maximum', yields=aggr_names[-1])],
+                             splitby=[_split(split_field, split_cnt)])
+
+    def select():
+        if len(nums) > 0:
+            name = nums[0]['name']
+            where = [base.Condition(name, 'greater', float(model.data[name].median()))]
+        else:
+            name = fields[0]['name']
+            where = [base.Condition(name, 'in', [model.data[name].iloc[0]])]
+        return model.select(what=model.names, where=where)
+
+    def sample():
+        return model.sample(sample_cnt)
+
+    return {
+        'density': density,
+        'probability': probability,
+        'maximum': maximum,
+        'select': select,
+        'sample': sample,
+    }
+
+
+def _time(func, repeat):
+    """Runs `func` `repeat` times and returns a dict of timing statistics in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        'status': 'SUCCESS',
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+    }
+
+
+def run_benchmark(rows=1000, num_dims=2, cat_levels=(3, 2), seed=1, repeat=3, split_cnt=10, sample_cnt=1000,
+                  include=None, exclude=None, queries=QUERY_NAMES):
+    """Runs the benchmark and returns its results as a JSON-serializable dict.
+
+    Failing fits or queries do not abort the benchmark but are recorded with status 'FAIL' and an error message.
+
+    Args:
+        rows, num_dims, cat_levels, seed:
+            Configure the synthetic data. See `make_data`.
+        repeat: int, optional.
+            Number of times each query is timed. Defaults to 3.
+        split_cnt, sample_cnt:
+            Configure the query workload. See `default_workload`.
+        include, exclude: list-like of strings, optional.
+            Names of models to (not) benchmark. See `default_specs` for available names. By default all are
+            included.
+        queries: list-like of strings, optional.
+            Names of queries to run. Defaults to all of `QUERY_NAMES`.
+
+    Returns: dict
+        A dict with the keys 'meta' and 'models'. 'meta' holds the configuration of the run and information on the
+        environment. 'models' maps model names to dicts with the keys 'status', 'fit' and 'queries', where 'queries'
+        maps query names to timing statistics.
+    """
+    data = make_data(rows, num_dims, cat_levels, seed)
+    specs = default_specs(data)
+    if include is None:
+        include = specs.keys()
+    if exclude is None:
+        exclude = []
+    names = [name for name in specs if name in include and name not in exclude]
+
+    results = {
+        'meta': {
+            'format_version': BENCHMARK_FORMAT_VERSION,
+            'config': {'rows': rows, 'num_dims': num_dims, 'cat_levels': list(cat_levels), 'seed': seed,
+                       'repeat': repeat, 'split_cnt': split_cnt, 'sample_cnt': sample_cnt},
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'platform': platform.platform()},
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'models': {},
+    }
+
+    for name in names:
+        logger.info("benchmarking model '{}' ...".format(name))
+        start = time.perf_counter()
+        fitted = fit_models({name: specs[name]})[name]
+        model_result = {'status': fitted['status'], 'fit': time.perf_counter() - start, 'queries': {}}
+        results['models'][name] = model_result
+        if fitted['status'] != 'SUCCESS':
+            model_result['message'] = fitted['message']
+            continue
+
+        workload = default_workload(fitted['model'], split_cnt, sample_cnt)
+        for query in queries:
+            try:
+                model_result['queries'][query] = _time(workload[query], repeat)
+            except Exception:
+                logger.warning("query '{}' failed on model '{}'".format(query, name))
+                model_result['queries'][query] = {'status': 'FAIL', 'message': traceback.format_exc()}
+    return results
+
+
+def save_results(results, filename):
+    """Stores benchmark results as JSON in file `filename`."""
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    """Loads benchmark results from JSON file `filename`."""
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, threshold=0.1, statistic='min'):
+    """Compares the benchmark results `current` to `baseline`.
+
+    Only timings of fits and queries that succeeded in both runs are compared. A timing is classified as
+    'regression' if it got slower by more than the relative `threshold`, as 'improvement' if it got faster by more
+    than that, and as 'unchanged' otherwise. Fits and queries that changed their status are classified as 'broken'
+    or 'fixed', respectively.
+
+    Args:
+        baseline, current: dict
+            Benchmark results as returned by `run_benchmark`.
+        threshold: float, optional.
+            Relative change in run time to tolerate. Defaults to 0.1, i.e. 10%.
+        statistic: str, optional.
+            The timing statistic to compare, either 'min' or 'median'. Defaults to 'min'.
+
+    Returns: list of dict
+        One dict per compared item with keys 'model', 'query' ('fit' for model fitting), 'baseline', 'current',
+        'ratio' and 'verdict'.
+    """
+    if statistic not in ('min', 'median'):
+        raise ValueError("invalid statistic: {}".format(statistic))
+    if baseline['meta']['config'] != current['meta']['config']:
+        logger.warning("benchmark configurations differ: comparison may not be meaningful.")
+
+    def entry(model, query, old, new):
+        if old['status'] != new['status']:
+            verdict = 'fixed' if new['status'] == 'SUCCESS' else 'broken'
+            return {'model': model, 'query': query, 'baseline': None, 'current': None, 'ratio': None,
+                    'verdict': verdict}
+        if old['status'] != 'SUCCESS':
+            return None
+        old_t, new_t = old['time'], new['time']
+        ratio = new_t / old_t if old_t > 0 else float('inf')
+        if ratio > 1 + threshold:
+            verdict = 'regression'
+        elif ratio < 1 / (1 + threshold):
+            verdict = 'improvement'
+        else:
+            verdict = 'unchanged'
+        return {'model': model, 'query': query, 'baseline': old_t, 'current': new_t, 'ratio': ratio,
+                'verdict': verdict}
+
+    report = []
+    for model, new_model in current['models'].items():
+        if model not in baseline['models']:
+            continue
+        old_model = baseline['models'][model]
+        items = [('fit', {'status': old_model['status'], 'time': old_model['fit']},
+                  {'status': new_model['status'], 'time': new_model['fit']})]
+        for query, new_query in new_model['queries'].items():
+            if query in old_model['queries']:
+                old_query = old_model['queries'][query]
+                items.append((query, {'status': old_query['status'], 'time': old_query.get(statistic)},
+                              {'status': new_query['status'], 'time': new_query.get(statistic)}))
+        for query, old, new in items:
+            res = entry(model, query, old, new)
+            if res is not None:
+                report.append(res)
+    return report
+
+
+def comparison_to_str(report):
+    """Returns a human readable table of a comparison report as returned by `compare_results`."""
+    lines = ['{:<10} {:<12} {:>12} {:>12} {:>8}  {}'.format('model', 'query', 'baseline[s]', 'current[s]', 'ratio',
+                                                           'verdict')]
+    for r in report:
+        if r['ratio'] is None:
+            lines.append('{:<10} {:<12} {:>12} {:>12} {:>8}  {}'.format(r['model'], r['query'], '-', '-', '-',
+                                                                       r['verdict']))
+        else:
+            lines.append('{:<10} {:<12} {:>12.5f} {:>12.5f} {:>8.3f}  {}'.format(
+                r['model'], r['query'], r['baseline'], r['current'], r['ratio'], r['verdict']))
+    return '\n'.join(lines)
@@ -0,0 +1,58 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+@author: Philipp Lucas
+
+Test Suite for benchmark.py
+"""
+
+import unittest
+import pandas as pd
+
+from mb_modelbase.utils import benchmark
+
+
+def _results(fit, queries, status='SUCCESS'):
+    return {
+        'meta': {'config': {'rows': 10}},
+        'models': {'emp': {'status': status, 'fit': fit,
+                           'queries': {q: {'status': 'SUCCESS', 'min': t, 'median': t} for q, t in queries.items()}}}
+    }
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_make_data(self):
+        data = benchmark.make_data(rows=50, num_dims=3, cat_levels=[4, 2], seed=3)
+        self.assertEqual(data['mixed'].shape, (50, 5))
+        self.assertEqual(list(data['categorical'].columns), ['c0', 'c1'])
+        self.assertEqual(list(data['numerical'].columns), ['g0', 'g1', 'g2'])
+        self.assertTrue(set(data['mixed']['c0'].unique()) <= {'val0', 'val1', 'val2', 'val3'})
+
+        # reproducible
+        other = benchmark.make_data(rows=50, num_dims=3, cat_levels=[4, 2], seed=3)
+        pd.testing.assert_frame_equal(data['mixed'], other['mixed'])
+
+    def test_compare_results(self):
+        baseline = _results(1.0, {'density': 1.0, 'maximum': 1.0, 'sample': 1.0})
+        current = _results(1.05, {'density': 2.0, 'maximum': 0.5, 'sample': 1.0})
+        report = benchmark.compare_results(baseline, current, threshold=0.1)
+        verdicts = {r['query']: r['verdict'] for r in report}
+        self.assertEqual(verdicts, {'fit': 'unchanged', 'density': 'regression', 'maximum': 'improvement',
+                                    'sample': 'unchanged'})
+        self.assertIsInstance(benchmark.comparison_to_str(report), str)
+
+        current['models']['emp']['queries']['sample'] = {'status': 'FAIL', 'message': ''}
+        report = benchmark.compare_results(baseline, current)
+        self.assertEqual([r['verdict'] for r in report if r['query'] == 'sample'], ['broken'])
+
+    def test_run_benchmark(self):
+        results = benchmark.run_benchmark(rows=100, num_dims=2, cat_levels=[2], repeat=1, include=['emp'],
+                                          queries=['density', 'select'])
+        self.assertEqual(list(results['models'].keys()), ['emp'])
+        queries = results['models']['emp']['queries']
+        self.assertEqual(set(queries.keys()), {'density', 'select'})
+        self.assertEqual(queries['select']['status'], 'SUCCESS')
+
+
+if __name__ == '__main__':
+    unittest.main()
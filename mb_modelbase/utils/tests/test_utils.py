@@ -113,5 +113,12 @@ class TestUtils(unittest.TestCase):
         inv = list('DEF')
         self.assertEqual(utils.invert_sequence(seq, base), inv)
 
+    def test_negligible_weights(self):
+        weights = np.array([[0.5, 0.01], [0.02, 0.47]])
+        self.assertEqual(utils.negligible_weights(weights, 0.02).tolist(), [[False, True], [False, False]])
+        self.assertEqual(utils.negligible_weights(weights, 0.03).tolist(), [[False, True], [True, False]])
+        # the largest weight is never negligible
+        self.assertEqual(utils.negligible_weights([0.2, 0.8], 0.99).tolist(), [True, False])
+
 if __name__ == '__main__':
     unittest.main()
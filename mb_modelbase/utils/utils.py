@@ -7,6 +7,8 @@ Various utility functions
 
 import string
 import random
+import sys
+import types
 from functools import wraps, reduce
 from numpy import matrix, ix_, isfinite, linalg
 from xarray import DataArray
@@ -349,6 +351,25 @@ def inverse_transform_sampling(cumulative_dens):
     return np.searchsorted(cumulative_dens, np.random.uniform())
 
 
+def negligible_weights(weights, tolerance):
+    """Returns a boolean mask of the smallest weights whose total does not exceed `tolerance`.
+
+    The weights are considered in increasing order. The largest weight is never included.
+
+    Args:
+        weights: array-like
+            Non-negative weights of any shape.
+        tolerance: float
+            The maximum total of the masked weights.
+    """
+    weights = np.asarray(weights, dtype=float)
+    flat = weights.ravel()
+    order = np.argsort(flat, kind='stable')[:-1]
+    mask = np.zeros(flat.shape, dtype=bool)
+    mask[order[np.cumsum(flat[order]) <= tolerance]] = True
+    return mask.reshape(weights.shape)
+
+
 def deep_update(d, u):
     """Deep-update dict d with dict u and return d."""
     for k, v in u.items():
@@ -397,3 +418,65 @@ def alignment_permutation(target, *source):
     return [p_base*~Permutation.from_sequence(seq) for seq in source]
 
 
+
+
+def deep_sizeof(obj, seen=None):
+    """Returns an estimate of the memory in bytes occupied by `obj` and all objects reachable from it.
+
+    numpy arrays, pandas and xarray objects are accounted by the size of their data buffers. Containers and
+    objects with a `__dict__` or `__slots__` are traversed recursively. Modules, classes, functions and methods are
+    not traversed, as they are shared and not owned by `obj`. Each object is accounted at most once.
+
+    Args:
+        obj: any
+            The object to measure.
+        seen: set, optional.
+            Set of ids of objects that are not to be accounted (again). It is updated with the ids of all accounted
+            objects. Pass the same set to repeated calls to avoid double-counting of shared objects.
+
+    Returns: int
+        The size in bytes.
+    """
+    # lazy import to avoid a hard dependency of this module on pandas
+    import pandas as pd
+
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while len(stack) > 0:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+
+        if isinstance(o, np.ndarray):
+            # views share the memory of their base
+            size += o.nbytes if o.base is None else sys.getsizeof(o)
+            if o.dtype == object:
+                stack.extend(o.ravel())
+        elif isinstance(o, (pd.DataFrame, pd.Series, pd.Index)):
+            usage = o.memory_usage(deep=True)
+            size += int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+        elif isinstance(o, DataArray):
+            size += o.nbytes + sum(int(c.nbytes) for c in o.coords.values())
+        elif isinstance(o, (str, bytes, int, float, complex, bool, type(None))):
+            size += sys.getsizeof(o)
+        elif isinstance(o, (types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType,
+                            types.MethodType)):
+            continue
+        elif isinstance(o, dict):
+            size += sys.getsizeof(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, collections.deque)):
+            size += sys.getsizeof(o)
+            stack.extend(o)
+        else:
+            size += sys.getsizeof(o)
+            if hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+            for slot in getattr(type(o), '__slots__', ()):
+                if isinstance(slot, str) and hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return size
@@ -0,0 +1,79 @@
+# Copyright (c) 2019 Philipp Lucas (philipp.lucas@uni-jena.de)
+"""
+Command line interface to the PQL benchmark suite in `mb_modelbase.utils.benchmark`.
+
+how to use it:
+
+  (1) run a benchmark and store its results:
+
+      python benchmark.py run --rows 10000 --num-dims 3 --cat-levels 4 3 -o baseline.json
+
+  (2) later, run it again and compare to the stored baseline:
+
+      python benchmark.py run --rows 10000 --num-dims 3 --cat-levels 4 3 -o current.json
+      python benchmark.py compare baseline.json current.json --threshold 0.1
+
+  The comparison exits with a non-zero status if any regression was found.
+"""
+
+import argparse
+import logging
+import sys
+
+from mb_modelbase.utils import benchmark
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s.%(msecs)03d %(levelname)s :: %(message)s',
+    datefmt='%H:%M:%S'
+)
+
+
+def run(args):
+    results = benchmark.run_benchmark(rows=args.rows, num_dims=args.num_dims, cat_levels=args.cat_levels,
+                                      seed=args.seed, repeat=args.repeat, split_cnt=args.split_cnt,
+                                      sample_cnt=args.sample_cnt, include=args.include, exclude=args.exclude,
+                                      queries=args.queries)
+    benchmark.save_results(results, args.output)
+    print("stored benchmark results in {}".format(args.output))
+    return 0
+
+
+def compare(args):
+    report = benchmark.compare_results(benchmark.load_results(args.baseline), benchmark.load_results(args.current),
+                                       threshold=args.threshold, statistic=args.statistic)
+    print(benchmark.comparison_to_str(report))
+    failed = [r for r in report if r['verdict'] in ('regression', 'broken')]
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark PQL workloads across model classes.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help="run the benchmark")
+    run_parser.add_argument('-o', '--output', default='benchmark.json', help="file to store results in")
+    run_parser.add_argument('--rows', type=int, default=1000, help="number of data rows")
+    run_parser.add_argument('--num-dims', type=int, default=2, help="number of numerical dimensions")
+    run_parser.add_argument('--cat-levels', type=int, nargs='+', default=[3, 2],
+                            help="number of levels of each categorical dimension")
+    run_parser.add_argument('--seed', type=int, default=1, help="seed of the data generator")
+    run_parser.add_argument('--repeat', type=int, default=3, help="number of times each query is timed")
+    run_parser.add_argument('--split-cnt', type=int, default=10, help="number of splits per numerical field")
+    run_parser.add_argument('--sample-cnt', type=int, default=1000, help="number of samples to draw")
+    run_parser.add_argument('--include', nargs='+', default=None, help="models to benchmark")
+    run_parser.add_argument('--exclude', nargs='+', default=None, help="models not to benchmark")
+    run_parser.add_argument('--queries', nargs='+', default=list(benchmark.QUERY_NAMES), help="queries to run")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help="compare results to a baseline")
+    compare_parser.add_argument('baseline', help="JSON file of baseline results")
+    compare_parser.add_argument('current', help="JSON file of current results")
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help="tolerated relative slow down")
+    compare_parser.add_argument('--statistic', choices=['min', 'median'], default='min',
+                                help="timing statistic to compare")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
@@ -25,6 +25,10 @@ cfg = {
             'route': '/webservice',
             'directory': '../../fitted_models',
             'name': 'modelbase management system',
+            # number of worker processes that serve queries. With more than 1 worker the models are loaded once and
+            # then forked into the workers, see mb_modelbase.server.PreforkModelBase. New model files are then
+            # only picked up on RELOAD, since the model directory is not watched.
+            'workers': 1,
         },
         'activitylogger': {
             'enable': True,
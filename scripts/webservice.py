@@ -4,12 +4,14 @@
 from flask import Flask, request
 from flask_cors import cross_origin
 from flask_socketio import SocketIO
+import atexit
 import logging
 import json
 import traceback
 
 from mb_modelbase.utils import utils, ActivityLogger
 from mb_modelbase.server import modelbase as mbase
+from mb_modelbase.server.prefork import PreforkModelBase
 
 # from mb_modelbase.utils.utils import is_running_in_debug_mode
 # if is_running_in_debug_mode():
@@ -63,7 +65,13 @@ def add_modelbase_module():
 
     # start ModelBase
     logger.info("starting modelbase ... ")
-    mb = mbase.ModelBase(name=c['name'], model_dir=c['directory'])
+    if c['workers'] > 1:
+        # fork before any threads of the web server are started
+        mb = mbase.ModelBase(name=c['name'], model_dir=c['directory'], watchdog=False)
+        mb = PreforkModelBase(mb, workers=c['workers'])
+        atexit.register(mb.close)
+    else:
+        mb = mbase.ModelBase(name=c['name'], model_dir=c['directory'])
     logger.info("... done (starting modelbase).")
 
     @app.route(c['route'], methods=['GET', 'POST'])
@@ -188,6 +196,9 @@ if __name__ == "__main__":
     parser.add_argument("-d", "--directory", help="directory that contains the models to be loaded initially. Defaults "
                                                   "to '{}'".format(cfg_mb['directory']),
                         type=str, default=cfg_mb['directory'])
+    parser.add_argument("-w", "--workers", help="number of worker processes that serve queries. Defaults to "
+                                                "{}".format(cfg_mb['workers']),
+                        type=int, default=cfg_mb['workers'])
     parser.add_argument("-l", "--loglevel", help="loglevel for command line output. You can set it to: CRITICAL, ERROR,"
                                                  " WARNING, INFO or DEBUG. Defaults to {}".format(cfg['loglevel']),
                         type=str, default=cfg['loglevel'])
@@ -196,6 +207,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
     cfg['modules']['modelbase']['directory'] = args.directory
     cfg['modules']['modelbase']['name'] = args.name
+    cfg['modules']['modelbase']['workers'] = args.workers
     cfg['loglevel'] = args.loglevel
 
     init()